@@ -0,0 +1,59 @@
+"""
+compares the next run lookup of a compiled cron expression
+with trying minute by minute.
+
+    python benchmarks/bench_cron.py [number of lookups]
+"""
+import random
+import sys
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from swisscore_scheduler import crontab
+
+EXPRESSIONS = ("*/15 8-18 * * 1-5", "30 6 1,15 jan,apr,jul,oct *", "0 0 29 feb *")
+
+
+def minute_by_minute(expression: crontab.CronExpression, now: datetime) -> datetime:
+    then = now.replace(second=0, microsecond=0)
+    while 1:
+        then += timedelta(minutes=1)
+        day = expression.days >> then.day & 1
+        weekday = expression.weekdays >> (then.weekday() + 1) % 7 & 1
+        day_matches = (day or weekday) if expression._either_day else (day and weekday)
+        if (
+            expression.minutes >> then.minute & 1
+            and expression.hours >> then.hour & 1
+            and expression.months >> then.month & 1
+            and day_matches
+        ):
+            return then
+
+
+def main(n: int) -> None:
+    start_time = datetime(2023, 1, 1)
+    times = [
+        start_time + timedelta(seconds=random.randrange(10 * 365 * 24 * 60 * 60))
+        for _ in range(n)
+    ]
+    for text in EXPRESSIONS:
+        expression = crontab.parse(text)
+
+        start = perf_counter()
+        compiled = [expression.next_run(now) for now in times]
+        compiled_time = perf_counter() - start
+
+        # a few lookups are enough, trying minute by minute takes long
+        sample = times[:10]
+        start = perf_counter()
+        iterated = [minute_by_minute(expression, now) for now in sample]
+        iterated_time = (perf_counter() - start) / len(sample) * n
+
+        assert compiled[: len(sample)] == iterated
+        print(f"{text!r} ({n} lookups)")
+        print(f"  minute by minute: {iterated_time:.3f}s (extrapolated)")
+        print(f"  bitsets:          {compiled_time:.3f}s ({iterated_time / compiled_time:.0f}x)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000)
@@ -0,0 +1,48 @@
+"""
+measures the memory used per registered task and per `TaskResult`.
+
+    python benchmarks/bench_memory.py [number of tasks]
+"""
+import gc
+import sys
+import tracemalloc
+from datetime import datetime
+
+from swisscore_scheduler import AsyncScheduler, TaskResult
+
+
+def job(customer_id):
+    pass
+
+
+def measure(create) -> int:
+    gc.collect()
+    tracemalloc.start()
+    objects = create()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return size
+
+
+def main(n: int) -> None:
+    scheduler = AsyncScheduler()
+
+    def create_tasks():
+        with scheduler.batch():
+            for i in range(n):
+                scheduler.each.day.at(6).run(job, i)
+        return scheduler
+
+    now = datetime.now()
+    task_size = measure(create_tasks)
+    result_size = measure(lambda: [TaskResult(True, i, now, 0.1) for i in range(n)])
+
+    print(f"tasks:   {n}")
+    print(f"task:    {task_size / n:.0f} bytes")
+    print(f"result:  {result_size / n:.0f} bytes")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,45 @@
+"""
+compares the scalar and the batched next run calculation
+for a large number of daily and monthly tasks.
+
+    python benchmarks/bench_next_run.py [number of tasks]
+"""
+import random
+import sys
+from datetime import datetime
+from time import perf_counter
+
+from swisscore_scheduler import AsyncScheduler, calculator
+
+
+def job(customer_id):
+    pass
+
+
+def main(n: int) -> None:
+    scheduler = AsyncScheduler()
+    for i in range(n):
+        h, m = random.randrange(24), random.randrange(60)
+        if i % 2:
+            scheduler.each.day.at(h, m).run(job, i)
+        else:
+            scheduler.each.month(random.randint(1, 31)).at(h, m).run(job, i)
+    scheduled_tasks = scheduler.tasks
+    now = datetime.now()
+
+    start = perf_counter()
+    scalar = [t._calculate_next_run(now) for t in scheduled_tasks]
+    scalar_time = perf_counter() - start
+
+    start = perf_counter()
+    batched = calculator.next_runs(scheduled_tasks, now)
+    batched_time = perf_counter() - start
+
+    assert scalar == batched
+    print(f"tasks:   {n}")
+    print(f"scalar:  {scalar_time:.3f}s")
+    print(f"batched: {batched_time:.3f}s ({scalar_time / batched_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
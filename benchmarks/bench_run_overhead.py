@@ -0,0 +1,48 @@
+"""
+measures the overhead of creating tasks and of a single run
+for a job carrying a large payload, with debug logging disabled.
+
+    python benchmarks/bench_run_overhead.py [number of tasks] [number of runs]
+"""
+import asyncio
+import logging
+import sys
+from time import perf_counter
+
+from swisscore_scheduler import AsyncScheduler
+
+logging.getLogger("swisscore_scheduler").setLevel(logging.INFO)
+
+
+def job(payload):
+    pass
+
+
+async def run(task, n: int) -> float:
+    start = perf_counter()
+    for _ in range(n):
+        await task._call()
+    return perf_counter() - start
+
+
+def main(n_tasks: int, n_runs: int) -> None:
+    payload = {f"key-{i}": list(range(10)) for i in range(10_000)}
+    scheduler = AsyncScheduler()
+
+    start = perf_counter()
+    for _ in range(n_tasks):
+        scheduler.each.day.at(6).run(job, payload)
+    create_time = perf_counter() - start
+
+    run_time = asyncio.run(run(scheduler.tasks[0], n_runs))
+
+    print(f"tasks: {n_tasks}, runs: {n_runs}")
+    print(f"create: {create_time / n_tasks * 1e6:.1f}us per task")
+    print(f"run:    {run_time / n_runs * 1e6:.2f}us per run")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 100_000,
+    )
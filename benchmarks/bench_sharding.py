@@ -0,0 +1,53 @@
+"""
+measures the number of runs of CPU bound jobs per second
+with a single `AsyncScheduler` and with a `ShardedScheduler`.
+
+    python benchmarks/bench_sharding.py [number of tasks] [number of shards] [seconds]
+"""
+import asyncio
+import os
+import sys
+
+from swisscore_scheduler import AsyncScheduler, ShardedScheduler
+
+
+def job():
+    # about 5ms of work
+    sum(range(100_000))
+
+
+async def single(n_tasks: int, seconds: int) -> int:
+    scheduler = AsyncScheduler()
+    for _ in range(n_tasks):
+        scheduler.each.second.run(job)
+    scheduler.start_concurrently()
+    await asyncio.sleep(seconds)
+    runs = sum(t.previous_runs for t in scheduler.tasks)
+    scheduler.stop()
+    return runs
+
+
+async def sharded(n_tasks: int, shards: int, seconds: int) -> int:
+    scheduler = ShardedScheduler(shards)
+    with scheduler.batch():
+        for _ in range(n_tasks):
+            scheduler.each.second.run(job)
+    scheduler.start()
+    await asyncio.sleep(seconds)
+    runs = sum(t.previous_runs for t in await scheduler.get_tasks())
+    await scheduler.stop()
+    return runs
+
+
+def main(n_tasks: int, shards: int, seconds: int) -> None:
+    print(f"tasks: {n_tasks}, shards: {shards}, seconds: {seconds}")
+    print(f"single:  {asyncio.run(single(n_tasks, seconds)) / seconds:.0f} runs/s")
+    print(f"sharded: {asyncio.run(sharded(n_tasks, shards, seconds)) / seconds:.0f} runs/s")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 5,
+    )
@@ -0,0 +1,64 @@
+"""
+simulates a job set of daily, weekly and monthly tasks with a `VirtualClock`
+and reports how long a simulated year takes.
+
+    python benchmarks/bench_simulation.py [number of tasks] [number of days]
+"""
+import asyncio
+import logging
+import random
+import sys
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from swisscore_scheduler import AsyncScheduler, VirtualClock
+
+logging.getLogger("swisscore_scheduler").setLevel(logging.INFO)
+
+
+WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+
+
+def job():
+    pass
+
+
+async def simulate(n_tasks: int, days: int, use_dispatcher: bool) -> tuple:
+    clock = VirtualClock(datetime(2023, 1, 1))
+    scheduler = AsyncScheduler(clock=clock, use_dispatcher=use_dispatcher)
+    random.seed(0)
+    for i in range(n_tasks):
+        h, m = random.randrange(24), random.randrange(60)
+        if i % 3 == 0:
+            scheduler.each.day.at(h, m).run(job)
+        elif i % 3 == 1:
+            weekday = random.choice(WEEKDAYS)
+            getattr(scheduler.each, weekday).at(h, m).run(job)
+        else:
+            scheduler.each.month(random.randint(1, 28)).at(h, m).run(job)
+    scheduler.start_concurrently()
+
+    start = perf_counter()
+    await clock.advance(timedelta(days=days))
+    elapsed = perf_counter() - start
+    runs = sum(t.previous_runs for t in scheduler.tasks)
+    scheduler.stop()
+    return elapsed, runs
+
+
+def main(n_tasks: int, days: int) -> None:
+    print(f"tasks: {n_tasks}, simulated days: {days}")
+    for use_dispatcher in (False, True):
+        elapsed, runs = asyncio.run(simulate(n_tasks, days, use_dispatcher))
+        mode = "dispatcher" if use_dispatcher else "task per job"
+        print(
+            f"  {mode:12}: {elapsed:.2f}s for {runs} runs ({elapsed / runs * 1e6:.1f}us per run), "
+            f"{elapsed / days * 365:.1f}s per year (extrapolated)"
+        )
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 10_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 30,
+    )
@@ -11,3 +11,10 @@ logger.addHandler(__stream_handler)
 from .scheduler import AsyncScheduler
 from .tasks import ScheduledTask, CancelledTask, TaskResult
 from .creation_helper import TaskType
+from .crontab import CronExpression
+from .clock import Clock, SystemClock, VirtualClock
+from .jobstore import JobStore, MemoryJobStore, SQLiteJobStore
+from .metrics import Metrics
+from .watchdog import Watchdog, Stall, SlowRun
+from .sharding import ShardedScheduler, ShardedTask
+from .leader import LeaseStore, SQLiteLeaseStore, LeaderElection
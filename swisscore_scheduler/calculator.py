@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Sequence, Tuple
+
+from . import creation_helper, tasks, utils
+
+TaskType = creation_helper.TaskType
+# looking up enum members is slow compared to the rest of the calculation
+_MINUTELY, _HOURLY, _DAILY = TaskType.minutely, TaskType.hourly, TaskType.daily
+_WEEKLY, _MONTHLY, _YEARLY = TaskType.weekly, TaskType.monthly, TaskType.yearly
+
+_EPOCH = datetime(1970, 1, 1)
+_DAY = 24 * 60 * 60
+# 1970-01-01 was a thursday
+_EPOCH_WEEKDAY = 3
+
+
+def next_runs(
+    scheduled_tasks: Sequence[tasks.ScheduledTask], now: datetime
+) -> List[datetime]:
+    """
+    calculates the next run of many tasks at once.
+    returns the same as `[task._calculate_next_run(now) for task in scheduled_tasks]`,
+    but calendar tasks are calculated with integer arithmetic on (naive) epoch seconds
+    and everything depending only on `now` is calculated once for all tasks.
+    tasks running at the same time share the same `datetime` instance.
+    """
+    # runs are at whole seconds, so `then > now` equals `then > floor(now)`
+    seconds = (now - _EPOCH) // timedelta(seconds=1)
+    minute_start = seconds - seconds % 60
+    hour_start = seconds - seconds % 3600
+    day_start = seconds - seconds % _DAY
+    weekday = (day_start // _DAY + _EPOCH_WEEKDAY) % 7
+
+    candidates: Dict[Tuple[int, ...], Tuple[int, int]] = {}
+    converted: Dict[int, datetime] = {}
+    results: List[datetime] = []
+    for task in scheduled_tasks:
+        type = task.type
+        if type is _DAILY:
+            then = day_start + _time_of_day(task.at_time)
+            if then <= seconds:
+                then += task.interval * _DAY
+
+        elif type is _HOURLY:
+            then = hour_start + _time_of_day(task.at_time)
+            if then <= seconds:
+                then += task.interval * 3600
+
+        elif type is _MINUTELY:
+            then = minute_start + task.at_time[0]
+            if then <= seconds:
+                then += task.interval * 60
+
+        elif type is _WEEKLY:
+            then = (
+                day_start
+                + (task.fixed_weekday - weekday) % 7 * _DAY
+                + _time_of_day(task.at_time)
+            )
+            if then <= seconds:
+                then += 7 * _DAY
+
+        elif type is _MONTHLY or type is _YEARLY:
+            # the candidate days only depend on the date, so they are shared by all
+            # tasks running on the same day of the month (or year)
+            key = _date_key(task)
+            if key not in candidates:
+                candidates[key] = _candidate_days(key, now)
+            first, second = candidates[key]
+            time_of_day = _time_of_day(task.at_time)
+            then = first + time_of_day
+            if then <= seconds:
+                then = second + time_of_day
+
+        else:
+            results.append(task._calculate_next_run(now))
+            continue
+
+        next_run = converted.get(then)
+        if next_run is None:
+            next_run = converted[then] = _EPOCH + timedelta(seconds=then)
+        results.append(next_run)
+    return results
+
+
+def resolve_next_runs(scheduled_tasks: Sequence[tasks.ScheduledTask], now: datetime):
+    """calculate the pending next runs of `scheduled_tasks` in bulk"""
+    pending = [t for t in scheduled_tasks if t._next_run is tasks.PENDING]
+    for task, next_run in zip(pending, next_runs(pending, now)):
+        task._next_run = next_run
+
+
+def _time_of_day(at_time: Sequence[int]) -> int:
+    """the seconds given by `at_time`: `[minute, second]` or `[hour, minute, second]`"""
+    if len(at_time) == 3:
+        return at_time[0] * 3600 + at_time[1] * 60 + at_time[2]
+    return at_time[0] * 60 + at_time[1]
+
+
+def _date_key(task: tasks.ScheduledTask) -> Tuple[int, ...]:
+    if task.type is _MONTHLY:
+        return (task.fixed_month_day or task.at_date[0],)
+    return (task.at_date[0], task.at_date[1])
+
+
+def _candidate_days(key: Tuple[int, ...], now: datetime) -> Tuple[int, int]:
+    """
+    the epoch seconds of the first two valid days for the given
+    `(day,)` of a month or `(month, day)` of a year, starting at the month (or year) of `now`
+    """
+    days = []
+    year, month = now.year, now.month
+    while len(days) < 2:
+        if len(key) == 1:
+            if utils.day_in_month_range(key[0], month, year):
+                days.append(date(year, month, key[0]))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        else:
+            if utils.day_in_month_range(key[1], key[0], year):
+                days.append(date(year, *key))
+            year += 1
+    return tuple((day - _EPOCH.date()).days * _DAY for day in days)
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Any, Callable, List, Optional
+
+
+class Clock(ABC):
+    """
+    the time source of an `AsyncScheduler`.
+    `now()` is used for calendar tasks and timestamps,
+    `monotonic()` for interval tasks and deadlines.
+    """
+
+    @abstractmethod
+    def now(self) -> datetime:
+        """the current (naive) wall time"""
+
+    @abstractmethod
+    def monotonic(self) -> float:
+        """the current monotonic time in seconds"""
+
+    @abstractmethod
+    def call_later(self, delay: float, callback: Callable, *args: Any) -> Any:
+        """
+        call `callback(*args)` after `delay` seconds.
+        returns a handle with a `cancel()` method.
+        """
+
+    async def sleep(self, delay: float) -> None:
+        """sleep `delay` seconds"""
+        future = asyncio.get_running_loop().create_future()
+        handle = self.call_later(delay, _set_result, future)
+        try:
+            await future
+        finally:
+            handle.cancel()
+
+
+class SystemClock(Clock):
+    """the real time as seen by the event loop"""
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def call_later(
+        self, delay: float, callback: Callable, *args: Any
+    ) -> asyncio.TimerHandle:
+        return asyncio.get_running_loop().call_later(delay, callback, *args)
+
+    async def sleep(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+
+
+class VirtualTimer:
+    """a pending callback of a `VirtualClock`"""
+
+    def __init__(self, when: float, callback: Callable, args: tuple) -> None:
+        self.when: float = when
+        self.callback: Optional[Callable] = callback
+        self.args: tuple = args
+
+    def cancel(self) -> None:
+        self.callback = None
+        self.args = ()
+
+    def cancelled(self) -> bool:
+        return self.callback is None
+
+
+class VirtualClock(Clock):
+    """
+    a clock which only moves if `advance()` is called.
+    use it to test or simulate schedules without waiting for them:
+
+        clock = VirtualClock(datetime(2023, 1, 1))
+        scheduler = AsyncScheduler(clock=clock)
+        scheduler.each.monday.at(6).run(func)
+        scheduler.start_concurrently()
+        await clock.advance(timedelta(days=365))
+
+    after firing timers the clock yields to the event loop until it has no ready callbacks left,
+    but at most `settle_steps` times, so the woken tasks can run before it moves on.
+    raise it if the tasks take more steps to react, e.g. if they await a long chain of coroutines.
+    """
+
+    def __init__(
+        self, start: Optional[datetime] = None, settle_steps: int = 32
+    ) -> None:
+        if not isinstance(settle_steps, int):
+            raise TypeError("`settle_steps` must be an `int`")
+        if settle_steps < 1:
+            raise ValueError("`settle_steps` cannot be smaller then 1")
+        self._start: datetime = start or datetime.now()
+        self.settle_steps: int = settle_steps
+        self._time: float = 0.0
+        self._timers: List[tuple] = []
+        self._counter = itertools.count()
+
+    def now(self) -> datetime:
+        return self._start + timedelta(seconds=self._time)
+
+    def monotonic(self) -> float:
+        return self._time
+
+    def call_later(self, delay: float, callback: Callable, *args: Any) -> VirtualTimer:
+        timer = VirtualTimer(self._time + max(delay, 0), callback, args)
+        heapq.heappush(self._timers, (timer.when, next(self._counter), timer))
+        return timer
+
+    async def advance(self, delta: float | timedelta) -> None:
+        """
+        move the clock forward by `delta` seconds.
+        all timers due meanwhile are fired in order and the event loop
+        gets the chance to run the woken tasks before the clock moves on.
+        timers due at the same time are fired together, like the event loop does.
+        """
+        if isinstance(delta, timedelta):
+            delta = delta.total_seconds()
+        if delta < 0:
+            raise ValueError("`delta` cannot be negative, the clock cannot move backwards")
+        target = self._time + delta
+        await self._settle()
+        while self._timers and self._timers[0][0] <= target:
+            when = self._timers[0][0]
+            self._time = max(self._time, when)
+            while self._timers and self._timers[0][0] == when:
+                _, _, timer = heapq.heappop(self._timers)
+                if not timer.cancelled():
+                    timer.callback(*timer.args)
+            await self._settle()
+        self._time = target
+        await self._settle()
+
+    async def _settle(self) -> None:
+        """
+        yield to the event loop until it is idle, but at most `settle_steps` times,
+        as a task which keeps yielding would block the clock forever.
+        """
+        # the queue of ready callbacks of the default event loops,
+        # other loops are given `settle_steps` steps
+        ready = getattr(asyncio.get_running_loop(), "_ready", None)
+        for _ in range(self.settle_steps):
+            await asyncio.sleep(0)
+            if ready is not None and not ready:
+                break
+
+    async def advance_to(self, when: datetime) -> None:
+        """move the clock forward to the given datetime"""
+        await self.advance((when - self.now()).total_seconds())
+
+
+def _set_result(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
@@ -1,11 +1,12 @@
 from __future__ import annotations
 from abc import ABC
+from concurrent.futures import Executor
 from datetime import datetime
 
 from enum import Enum
-from typing import Optional, Callable
+from typing import Optional, Callable, Tuple, Union
 
-from . import scheduler, tasks, utils
+from . import crontab, scheduler, tasks, utils
 
 
 class TaskType(Enum):
@@ -17,14 +18,15 @@ class TaskType(Enum):
     weekly = "weekly"
     monthly = "monthly"
     yearly = "yearly"
+    cron = "cron"
 
 
 class FutureTask:
-    def __init__(self, scheduler: scheduler.AsyncScheduler) -> None:
-        self.scheduler: scheduler.AsyncScheduler = scheduler
+    def __init__(self, scheduler: scheduler.BaseScheduler) -> None:
+        self.scheduler: scheduler.BaseScheduler = scheduler
         self.type: TaskType = TaskType.one_time
-        self.at_time: list[int] = []
-        self.at_date: list[int] = []
+        self.at_time: Tuple[int, ...] = ()
+        self.at_date: Tuple[int, ...] = ()
         self.interval: int = 1
         self.tags: list[str] = []
 
@@ -32,6 +34,39 @@ class FutureTask:
         self.fixed_month: Optional[int] = None
         self.fixed_month_day: Optional[int] = None
         self.fixed_weekday: Optional[int] = None
+        self.cron: Optional[str] = None
+
+        self.executor: Union[str, Executor, None] = None
+        self.max_instances: int = 1
+        self.coalesce: bool = False
+        self.misfire_grace_time: Optional[float] = None
+        self.misfire_policy: str = "run_once"
+        self.jitter: Optional[float] = None
+        self.spread: Optional[float] = None
+        self.keep_result: bool = True
+        self.history: int = 0
+        self.timeout: Optional[float] = None
+        self.priority: int = 0
+
+    @property
+    def period(self) -> int:
+        """the (shortest) number of seconds between two runs of a calendar task"""
+        if self.type is TaskType.cron:
+            return crontab.parse(self.cron).period
+        return {
+            TaskType.minutely: 60 * self.interval,
+            TaskType.hourly: 60 * 60 * self.interval,
+            TaskType.daily: 24 * 60 * 60 * self.interval,
+            TaskType.weekly: 7 * 24 * 60 * 60,
+            TaskType.monthly: 28 * 24 * 60 * 60,
+            TaskType.yearly: 365 * 24 * 60 * 60,
+        }[self.type]
+
+    def set_offsets(self, jitter: Optional[float], spread: Optional[float]) -> None:
+        """validate and set the `jitter` and `spread` of a calendar task"""
+        utils.validate_offset(jitter, spread, self.period)
+        self.jitter = jitter
+        self.spread = spread
 
     def create(self, func: Callable, *args, **kwargs):
         return tasks.ScheduledTask(
@@ -40,7 +75,7 @@ class FutureTask:
             self.at_time,
             self.at_date,
             self.interval,
-            self.tags,
+            list(self.tags),
             self.fixed_datetime,
             self.fixed_month,
             self.fixed_month_day,
@@ -48,6 +83,18 @@ class FutureTask:
             func,
             args,
             kwargs,
+            executor=self.executor,
+            max_instances=self.max_instances,
+            coalesce=self.coalesce,
+            misfire_grace_time=self.misfire_grace_time,
+            misfire_policy=self.misfire_policy,
+            jitter=self.jitter,
+            spread=self.spread,
+            keep_result=self.keep_result,
+            history=self.history,
+            timeout=self.timeout,
+            priority=self.priority,
+            cron=self.cron,
         )
 
 
@@ -60,8 +107,68 @@ class TaskFinalizer(Creator):
     def __init__(self, future_task: FutureTask) -> None:
         super().__init__(future_task)
 
-    def run(self, func: Callable, *args, **kwargs) -> tasks.ScheduledTask:
-        """apply the task to the scheduler"""
+    def run(
+        self,
+        func: Callable,
+        *args,
+        executor: Union[str, Executor, None] = None,
+        max_instances: int = 1,
+        coalesce: bool = False,
+        misfire_grace_time: Optional[float] = None,
+        misfire_policy: str = "run_once",
+        keep_result: bool = True,
+        history: int = 0,
+        timeout: Optional[float] = None,
+        priority: int = 0,
+        **kwargs,
+    ) -> tasks.ScheduledTask:
+        """
+        apply the task to the scheduler
+        :param executor: run a regular function in "thread", "process" or a custom executor.
+            defaults to the executor of the scheduler.
+        :param max_instances: the number of runs allowed to overlap.
+            if 1, the next run waits until the previous one is finished.
+        :param coalesce: if True, runs missed because the previous runs were not finished yet
+            are merged into a single run. else they are skipped.
+        :param misfire_grace_time: seconds a run may be late, e.g. after the event loop
+            was blocked or the scheduler was restarted. later runs are misfired.
+            if None, runs are never misfired.
+        :param misfire_policy: what to do if a run misfired:
+            "skip" skips all overdue runs,
+            "run_once" runs once and skips the other overdue runs,
+            "run_all" runs all overdue runs one after another.
+        :param keep_result: if False, the `TaskResult`s only keep the success, duration and
+            traceback of a run but not the returned value or raised exception.
+        :param history: the number of `TaskResult`s kept in `ScheduledTask.history`.
+        :param timeout: seconds a run may take. a coroutine is cancelled after the timeout,
+            a function running in an executor is no longer waited for.
+            a function running in the event loop cannot be interrupted.
+            defaults to the timeout of the scheduler.
+        :param priority: runs due at the same time, or waiting for the concurrency limit
+            or the workers of the scheduler, start in the order of their priority, the highest first.
+        """
+        utils.validate_executor(executor)
+        utils.validate_misfire(misfire_grace_time, misfire_policy)
+        utils.validate_timeout(timeout)
+        if not isinstance(priority, int):
+            raise TypeError("`priority` must be an `int`")
+        if not isinstance(history, int):
+            raise TypeError("`history` must be an `int`")
+        if history < 0:
+            raise ValueError("`history` cannot be negative")
+        if not isinstance(max_instances, int):
+            raise TypeError("`max_instances` must be an `int`")
+        if max_instances < 1:
+            raise ValueError("`max_instances` cannot be smaller then 1")
+        self._future_task.executor = executor
+        self._future_task.max_instances = max_instances
+        self._future_task.coalesce = coalesce
+        self._future_task.misfire_grace_time = misfire_grace_time
+        self._future_task.misfire_policy = misfire_policy
+        self._future_task.keep_result = keep_result
+        self._future_task.history = history
+        self._future_task.timeout = timeout
+        self._future_task.priority = priority
         scheduled_task = self._future_task.create(func, *args, **kwargs)
         return scheduled_task
 
@@ -137,7 +244,7 @@ class UnitSelector(Creator):
             raise TypeError("day must be an `int`")
         if not 1 <= int(day) <= 31:
             raise ValueError("day must be in 1..31")
-        self._future_task.at_date = [day]
+        self._future_task.at_date = (day,)
         self._future_task.type = TaskType.monthly
         self._future_task.fixed_month_day = day
         return HourSelector(self._future_task)
@@ -288,7 +395,7 @@ class UnitSelector(Creator):
         """
         self._future_task.fixed_month = month
         self._future_task.fixed_month_day = day
-        self._future_task.at_date = [month, day]
+        self._future_task.at_date = (month, day)
         self._future_task.type = TaskType.yearly
         return HourSelector(self._future_task)
 
@@ -322,13 +429,23 @@ class SecondSelector(Creator):
     def __init__(self, future_task: FutureTask) -> None:
         super().__init__(future_task)
 
-    def at(self, second: int = 0) -> TaskFinalizer:
+    def at(
+        self,
+        second: int = 0,
+        *,
+        jitter: Optional[float] = None,
+        spread: Optional[float] = None,
+    ) -> TaskFinalizer:
         """
         The second to run.
         :param second: must be in 0..59
+        :param jitter: delay each run by a random number of seconds in 0..jitter
+        :param spread: delay all runs by the same number of seconds in 0..spread,
+            derived from the task id. spreads the runs of many tasks over a stable slot each
         """
         utils.validate_time(second)
-        self._future_task.at_time = [second]
+        self._future_task.set_offsets(jitter, spread)
+        self._future_task.at_time = (second,)
         return TaskFinalizer(self._future_task)
 
     def run(self, func: Callable, *args, **kwargs) -> tasks.ScheduledTask:
@@ -340,14 +457,25 @@ class MinuteSelector(Creator):
     def __init__(self, future_task: FutureTask) -> None:
         super().__init__(future_task)
 
-    def at(self, minute: int = 0, second: int = 0) -> TaskFinalizer:
+    def at(
+        self,
+        minute: int = 0,
+        second: int = 0,
+        *,
+        jitter: Optional[float] = None,
+        spread: Optional[float] = None,
+    ) -> TaskFinalizer:
         """
         The minute to run.
         :param minute: must be in 0..59
         :param second: must be in 0..59
+        :param jitter: delay each run by a random number of seconds in 0..jitter
+        :param spread: delay all runs by the same number of seconds in 0..spread,
+            derived from the task id. spreads the runs of many tasks over a stable slot each
         """
         utils.validate_time(second, minute)
-        self._future_task.at_time = [minute, second]
+        self._future_task.set_offsets(jitter, spread)
+        self._future_task.at_time = (minute, second)
         return TaskFinalizer(self._future_task)
 
     def run(self, func: Callable, *args, **kwargs) -> tasks.ScheduledTask:
@@ -359,15 +487,27 @@ class HourSelector(Creator):
     def __init__(self, future_task: FutureTask) -> None:
         super().__init__(future_task)
 
-    def at(self, hour: int = 0, minute: int = 0, second: int = 0) -> TaskFinalizer:
+    def at(
+        self,
+        hour: int = 0,
+        minute: int = 0,
+        second: int = 0,
+        *,
+        jitter: Optional[float] = None,
+        spread: Optional[float] = None,
+    ) -> TaskFinalizer:
         """
         The time to run.
         :param hour: must be in 0..23
         :param minute: must be in 0..59
         :param second: must be in 0..59
+        :param jitter: delay each run by a random number of seconds in 0..jitter
+        :param spread: delay all runs by the same number of seconds in 0..spread,
+            derived from the task id. spreads the runs of many tasks over a stable slot each
         """
         utils.validate_time(second, minute, hour)
-        self._future_task.at_time = [hour, minute, second]
+        self._future_task.set_offsets(jitter, spread)
+        self._future_task.at_time = (hour, minute, second)
         return TaskFinalizer(self._future_task)
 
     # TODO: Maybe implement this
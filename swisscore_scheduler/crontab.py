@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import calendar
+from datetime import datetime
+from functools import lru_cache
+from typing import Tuple
+
+_MONTHS = ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec")
+_WEEKDAYS = ("sun", "mon", "tue", "wed", "thu", "fri", "sat")
+
+_ALIASES = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+
+# (name, lowest, highest, names) of the five fields
+_FIELDS = (
+    ("minute", 0, 59, ()),
+    ("hour", 0, 23, ()),
+    ("day of month", 1, 31, ()),
+    ("month", 1, 12, _MONTHS),
+    ("day of week", 0, 7, _WEEKDAYS),
+)
+
+# the days of the longest month of each month, february may have 29 days
+_LONGEST = (0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+# a bit at 0, 7, 14, ... 35: repeats a week of 7 bits over the 31 days of a month
+_WEEKS = sum(1 << (7 * week) for week in range(6))
+
+
+class CronExpression:
+    """
+    a cron expression compiled into one bitset per field:
+    bit `n` of `minutes` is set if the expression matches minute `n` and so on.
+
+    the next run is found by looking up the lowest set bit at or after the current value
+    of each field, carrying over to the next larger field if there is none,
+    instead of trying minute by minute.
+
+    like in cron, a day matches if the day of month or the day of week matches
+    if both fields are restricted, e.g. "0 0 1 * 1" runs on the first and on every monday.
+    if one of them starts with "*", both have to match,
+    e.g. "0 0 */5 * 1-5" runs on the 1st, 6th, 11th, ... if it's a weekday.
+    """
+
+    __slots__ = (
+        "expression",
+        "minutes",
+        "hours",
+        "days",
+        "months",
+        "weekdays",
+        "_either_day",
+    )
+
+    def __init__(self, expression: str) -> None:
+        self.expression: str = expression
+        fields = _ALIASES.get(expression.strip().lower(), expression).split()
+        if len(fields) != 5:
+            raise ValueError(
+                f"invalid cron expression {expression!r}: expected 5 fields, got {len(fields)}"
+            )
+        masks = [
+            _parse_field(expression, field, *spec) for field, spec in zip(fields, _FIELDS)
+        ]
+        self.minutes: int = masks[0]
+        self.hours: int = masks[1]
+        self.days: int = masks[2]
+        self.months: int = masks[3]
+        # sunday is 0 or 7
+        self.weekdays: int = (masks[4] | masks[4] >> 7) & 0x7F
+        # True if the day of month or the day of week has to match, else both
+        self._either_day: bool = not (fields[2].startswith("*") or fields[4].startswith("*"))
+
+        # a day of month matches each day of week over the years
+        if not self._either_day and not any(
+            self.months >> month & 1 and self.days & (2 << _LONGEST[month]) - 2
+            for month in range(1, 13)
+        ):
+            raise ValueError(f"invalid cron expression {expression!r}: it never matches")
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.expression!r})"
+
+    @property
+    def period(self) -> int:
+        """the shortest possible number of seconds between two runs"""
+        for mask, size, unit in ((self.minutes, 60, 60), (self.hours, 24, 60 * 60)):
+            values = [value for value in range(size) if mask >> value & 1]
+            if len(values) > 1:
+                gaps = [b - a for a, b in zip(values, values[1:])]
+                gaps.append(values[0] + size - values[-1])
+                return min(gaps) * unit
+        # at most once a day
+        return 24 * 60 * 60
+
+    def next_run(self, now: datetime) -> datetime:
+        """the first time matching the expression after `now`"""
+        year, month, day = now.year, now.month, now.day
+        # runs are at whole minutes, so the next one is in the following minute at the earliest
+        hour, minute = now.hour, now.minute + 1
+        while 1:
+            found = _next_bit(self.months, month)
+            if found < 0:
+                year, month, day, hour, minute = year + 1, 1, 1, 0, 0
+                continue
+            if found != month:
+                month, day, hour, minute = found, 1, 0, 0
+
+            found = _next_bit(self._days_of(year, month), day)
+            if found < 0:
+                month, day, hour, minute = month + 1, 1, 0, 0
+                continue
+            if found != day:
+                day, hour, minute = found, 0, 0
+
+            found = _next_bit(self.hours, hour)
+            if found < 0:
+                day, hour, minute = day + 1, 0, 0
+                continue
+            if found != hour:
+                hour, minute = found, 0
+
+            found = _next_bit(self.minutes, minute)
+            if found < 0:
+                hour, minute = hour + 1, 0
+                continue
+            return datetime(year, month, day, hour, found)
+
+    def _days_of(self, year: int, month: int) -> int:
+        """the days of `month` matching the expression as a bitset"""
+        first_weekday, length = calendar.monthrange(year, month)
+        month_days = (2 << length) - 2
+        if self.weekdays == 0x7F and not self._either_day:
+            return self.days & month_days
+
+        # rotate the weekdays so bit 0 is the weekday of the 1st (monday is 0 in python)
+        shift = (first_weekday + 1) % 7
+        week = (self.weekdays >> shift | self.weekdays << (7 - shift)) & 0x7F
+        weekday_days = (week * _WEEKS) << 1 & month_days
+        if self._either_day:
+            return (self.days | weekday_days) & month_days
+        return self.days & weekday_days
+
+
+@lru_cache(maxsize=None)
+def parse(expression: str) -> CronExpression:
+    """
+    compiles a cron expression. the result is cached,
+    so tasks with the same expression share a `CronExpression`
+    """
+    if not isinstance(expression, str):
+        raise TypeError("the cron expression must be a `str`")
+    return CronExpression(expression)
+
+
+def _next_bit(mask: int, value: int) -> int:
+    """the lowest set bit of `mask` at or after `value`, -1 if there is none"""
+    rest = mask >> value
+    if not rest:
+        return -1
+    return value + (rest & -rest).bit_length() - 1
+
+
+def _parse_field(
+    expression: str, field: str, name: str, lowest: int, highest: int, names: Tuple[str, ...]
+) -> int:
+    """the bitset of the values matched by a field, e.g. "1-5" or "*/15" or "mon,wed" """
+
+    def value(text: str) -> int:
+        text = text.lower()
+        if text in names:
+            return names.index(text) + (1 if name == "month" else 0)
+        if not text.isdigit():
+            raise ValueError(f"invalid cron expression {expression!r}: bad {name} {text!r}")
+        number = int(text)
+        if not lowest <= number <= highest:
+            raise ValueError(
+                f"invalid cron expression {expression!r}: {name} must be in {lowest}..{highest}"
+            )
+        return number
+
+    mask = 0
+    for item in field.split(","):
+        range_, _, step = item.partition("/")
+        if range_ == "*":
+            start, stop = lowest, highest
+        elif "-" in range_:
+            start, stop = map(value, range_.split("-", 1))
+        else:
+            start = value(range_)
+            # "5/15" is short for "5-59/15"
+            stop = highest if step else start
+        if step:
+            if not step.isdigit() or int(step) == 0:
+                raise ValueError(f"invalid cron expression {expression!r}: bad step {step!r}")
+        if start > stop:
+            raise ValueError(
+                f"invalid cron expression {expression!r}: {name} range {range_!r} is reversed"
+            )
+        for number in range(start, stop + 1, int(step or 1)):
+            mask |= 1 << number
+    return mask
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+from typing import List, Optional
+
+from . import scheduler, tasks
+
+
+class Dispatcher:
+    """
+    drives all `ScheduledTask`s of an `AsyncScheduler` from a single coroutine.
+
+    pending runs are kept in a min-heap keyed by their deadline (`clock.monotonic()`),
+    so an idle task costs a heap entry instead of a sleeping `asyncio.Task`.
+    an `asyncio.Task` is only created while a task is actually executing.
+    """
+
+    def __init__(self, scheduler: scheduler.AsyncScheduler) -> None:
+        self._scheduler: scheduler.AsyncScheduler = scheduler
+        self._heap: List[list] = []
+        self._counter = itertools.count()
+        self._removed: int = 0
+
+        self._wakeup: Optional[asyncio.Event] = None
+        self._driver: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._heap) - self._removed
+
+    def start(self) -> None:
+        """start the driver coroutine on the running event loop"""
+        self._wakeup = asyncio.Event()
+        self._driver = asyncio.get_running_loop().create_task(self._drive())
+
+    def stop(self) -> None:
+        """stop the driver coroutine. pending entries are kept"""
+        if self._driver is not None and not self._driver.done():
+            self._driver.cancel()
+        self._driver = None
+
+    def push(self, task: tasks.ScheduledTask) -> None:
+        """insert the next run of `task` into the heap"""
+        if task._entry is not None or task.wait_time is None:
+            return
+        deadline = self._scheduler.clock.monotonic() + task.wait_time
+        entry = [deadline, next(self._counter), task]
+        task._entry = entry
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry and self._wakeup is not None:
+            self._wakeup.set()
+
+    def push_many(self, scheduled_tasks: List[tasks.ScheduledTask]) -> None:
+        """insert the next runs of many tasks, re-heapifying once if it's cheaper"""
+        monotonic = self._scheduler.clock.monotonic()
+        entries = []
+        for task in scheduled_tasks:
+            if task._entry is not None:
+                continue
+            wait_time = task.wait_time
+            if wait_time is None:
+                continue
+            entry = [monotonic + wait_time, next(self._counter), task]
+            task._entry = entry
+            entries.append(entry)
+        if not entries:
+            return
+
+        earliest = self._heap[0] if self._heap else None
+        if len(entries) > len(self._heap) // 8:
+            self._heap.extend(entries)
+            heapq.heapify(self._heap)
+        else:
+            for entry in entries:
+                heapq.heappush(self._heap, entry)
+        if self._heap[0] is not earliest and self._wakeup is not None:
+            self._wakeup.set()
+
+    def discard(self, task: tasks.ScheduledTask) -> None:
+        """
+        remove the pending run of `task`.
+        the heap entry is only marked as removed and skipped once it's popped.
+        """
+        entry = task._entry
+        if entry is None:
+            return
+        entry[-1] = None
+        task._entry = None
+        self._removed += 1
+        if self._removed > len(self._heap) // 2:
+            self._compact()
+
+    def clear(self) -> None:
+        """remove all pending runs at once"""
+        for entry in self._heap:
+            if entry[-1] is not None:
+                entry[-1]._entry = None
+        self._heap = []
+        self._removed = 0
+
+    def _compact(self) -> None:
+        self._heap = [entry for entry in self._heap if entry[-1] is not None]
+        heapq.heapify(self._heap)
+        self._removed = 0
+
+    async def _sleep(self, delay: Optional[float]) -> None:
+        """sleep until `delay` passed or the earliest deadline changed"""
+        handle = None
+        if delay is not None:
+            handle = self._scheduler.clock.call_later(delay, self._wakeup.set)
+        try:
+            await self._wakeup.wait()
+        finally:
+            if handle is not None:
+                handle.cancel()
+            self._wakeup.clear()
+
+    async def _drive(self) -> None:
+        loop = asyncio.get_running_loop()
+        clock = self._scheduler.clock
+        while 1:
+            if not self._heap:
+                await self._sleep(None)
+                continue
+
+            entry = self._heap[0]
+            if entry[-1] is None:
+                heapq.heappop(self._heap)
+                self._removed -= 1
+                continue
+
+            delay = entry[0] - clock.monotonic()
+            if delay > 0:
+                await self._sleep(delay)
+                continue
+
+            for task in self._pop_due(clock.monotonic()):
+                task._task = loop.create_task(task._dispatch())
+
+    def _pop_due(self, now: float) -> List[tasks.ScheduledTask]:
+        """removes the tasks which are due at `now`, the highest priority first"""
+        due = []
+        set_back = []
+        while self._heap and self._heap[0][0] <= now:
+            task: tasks.ScheduledTask = heapq.heappop(self._heap)[-1]
+            if task is None:
+                self._removed -= 1
+                continue
+            task._entry = None
+            if task.wait_time > 0:
+                # the wall clock was set back since the task was pushed
+                set_back.append(task)
+            else:
+                due.append(task)
+        for task in set_back:
+            self.push(task)
+        if len(due) > 1:
+            # stable, so tasks with the same priority keep the order of their deadlines
+            due.sort(key=_priority, reverse=True)
+        return due
+
+
+def _priority(task: tasks.ScheduledTask) -> int:
+    return task.priority
@@ -0,0 +1,507 @@
+from __future__ import annotations
+
+import asyncio
+import importlib
+import json
+import pickle
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from . import creation_helper, scheduler, tasks
+from . import logger
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class JobStore(ABC):
+    """
+    stores the tasks of an `AsyncScheduler`, so they can be restored after a restart.
+
+    the scheduler hands over new, updated and removed tasks as they change
+    and calls `load()` when it's started. a store may buffer the changes
+    until `flush()` is called.
+    """
+
+    @abstractmethod
+    def add(self, scheduled_tasks: List[tasks.ScheduledTask]) -> None:
+        """
+        store new tasks.
+        raises ValueError if a task cannot be stored
+        """
+
+    @abstractmethod
+    def update(self, scheduled_tasks: List[tasks.ScheduledTask]) -> None:
+        """store the changed state (next run, previous runs, tags) of the tasks"""
+
+    @abstractmethod
+    def remove(self, scheduled_tasks: List[tasks.ScheduledTask]) -> None:
+        """remove the tasks from the store"""
+
+    @abstractmethod
+    def load(self) -> Iterator[Dict[str, Any]]:
+        """yields the records of all stored tasks. see `dump()`"""
+
+    def flush(self) -> None:
+        """write the buffered changes"""
+
+    def close(self) -> None:
+        """flush the buffered changes and release the resources of the store"""
+        self.flush()
+
+
+class MemoryJobStore(JobStore):
+    """
+    keeps the records in memory,
+    so they only survive a restart of the scheduler, not of the process.
+
+    the tasks are only referenced until `flush()` takes a record of them.
+    """
+
+    def __init__(self) -> None:
+        self._records: Dict[str, Dict[str, Any]] = {}
+        # the changed tasks or None if they were removed
+        self._pending: Dict[str, Optional[tasks.ScheduledTask]] = {}
+
+    def add(self, scheduled_tasks: List[tasks.ScheduledTask]) -> None:
+        for task in scheduled_tasks:
+            self._pending[task.id] = task
+
+    def update(self, scheduled_tasks: List[tasks.ScheduledTask]) -> None:
+        for task in scheduled_tasks:
+            self._pending[task.id] = task
+
+    def remove(self, scheduled_tasks: List[tasks.ScheduledTask]) -> None:
+        for task in scheduled_tasks:
+            self._pending[task.id] = None
+
+    def load(self) -> Iterator[Dict[str, Any]]:
+        self.flush()
+        return iter(list(self._records.values()))
+
+    def flush(self) -> None:
+        pending, self._pending = self._pending, {}
+        for id, task in pending.items():
+            if task is None:
+                self._records.pop(id, None)
+            else:
+                self._records[id] = dump(task)
+
+
+class SQLiteJobStore(JobStore):
+    """
+    stores the tasks in a SQLite database.
+
+    changes are buffered and written in a single transaction
+    at most every `flush_interval` seconds, so a run doesn't cost a disk write.
+    the transactions are written by a thread, so they don't block the event loop.
+    a crash loses the changes of the last `flush_interval` seconds.
+
+    functions are stored by their import path (`module:qualname`),
+    so only module level functions can be stored. arguments are pickled.
+    custom executors cannot be stored, the tasks fall back to the executor of the scheduler.
+    """
+
+    _columns = (
+        "id",
+        "type",
+        "at_time",
+        "at_date",
+        "interval",
+        "tags",
+        "fixed_datetime",
+        "fixed_month",
+        "fixed_month_day",
+        "fixed_weekday",
+        "cron",
+        "func",
+        "arguments",
+        "executor",
+        "max_instances",
+        "coalesce",
+        "misfire_grace_time",
+        "misfire_policy",
+        "jitter",
+        "spread",
+        "keep_result",
+        "history",
+        "timeout",
+        "priority",
+        "next_run",
+        "previous_runs",
+        "missed_runs",
+        "last_run",
+    )
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        table: str = "jobs",
+        flush_interval: float = 1.0,
+        chunk_size: int = 1000,
+    ) -> None:
+        if not table.isidentifier():
+            raise ValueError("`table` must be a valid identifier")
+        self.path: str = path
+        self.table: str = table
+        self.flush_interval: float = flush_interval
+        self.chunk_size: int = chunk_size
+
+        # buffered changes: the task to write or None to delete the row
+        self._pending: Dict[str, Optional[tasks.ScheduledTask]] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+        # writes in the order they were flushed, off the event loop
+        self._writer: ThreadPoolExecutor = ThreadPoolExecutor(
+            1, thread_name_prefix="swisscore_scheduler_store"
+        )
+        # the connection is used by the writer and by `load()`
+        self._lock: threading.Lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        # a commit does not wait for the disk in WAL mode with synchronous=NORMAL
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connection:
+            self._connection.execute(
+                f"""CREATE TABLE IF NOT EXISTS {table} (
+                    id TEXT PRIMARY KEY,
+                    type TEXT NOT NULL,
+                    at_time TEXT NOT NULL,
+                    at_date TEXT NOT NULL,
+                    interval INTEGER NOT NULL,
+                    tags TEXT NOT NULL,
+                    fixed_datetime REAL,
+                    fixed_month INTEGER,
+                    fixed_month_day INTEGER,
+                    fixed_weekday INTEGER,
+                    cron TEXT,
+                    func TEXT NOT NULL,
+                    arguments BLOB NOT NULL,
+                    executor TEXT,
+                    max_instances INTEGER NOT NULL,
+                    coalesce INTEGER NOT NULL,
+                    misfire_grace_time REAL,
+                    misfire_policy TEXT NOT NULL,
+                    jitter REAL,
+                    spread REAL,
+                    keep_result INTEGER NOT NULL,
+                    history INTEGER NOT NULL,
+                    timeout REAL,
+                    priority INTEGER NOT NULL,
+                    next_run REAL,
+                    previous_runs INTEGER NOT NULL,
+                    missed_runs INTEGER NOT NULL,
+                    last_run BLOB
+                )"""
+            )
+            self._connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_next_run ON {table} (next_run)"
+            )
+
+    def add(self, scheduled_tasks: List[tasks.ScheduledTask]) -> None:
+        # fail early if a task cannot be stored
+        for task in scheduled_tasks:
+            self._to_row(task)
+        self._buffer(scheduled_tasks, False)
+
+    def update(self, scheduled_tasks: List[tasks.ScheduledTask]) -> None:
+        self._buffer(scheduled_tasks, False)
+
+    def remove(self, scheduled_tasks: List[tasks.ScheduledTask]) -> None:
+        self._buffer(scheduled_tasks, True)
+
+    def load(self) -> Iterator[Dict[str, Any]]:
+        """yields the stored tasks ordered by their next run, `chunk_size` rows at once"""
+        self.flush()
+        with self._lock:
+            cursor = self._connection.execute(
+                f"SELECT {', '.join(self._columns)} FROM {self.table} ORDER BY next_run"
+            )
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(self.chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                try:
+                    record = self._to_record(row)
+                except Exception:
+                    # keep the row, the function may be importable again later
+                    logger.exception("Cannot restore the task %s:", row[0])
+                    continue
+                yield record
+
+    def flush(self) -> None:
+        """write the buffered changes and wait until they are written"""
+        changes = self._take_pending()
+        if changes is not None:
+            self._writer.submit(self._write, *changes).result()
+
+    def close(self) -> None:
+        self.flush()
+        self._writer.shutdown()
+        with self._lock:
+            self._connection.close()
+
+    def _flush_later(self) -> None:
+        """write the buffered changes in the writer thread"""
+        changes = self._take_pending()
+        if changes is not None:
+            self._writer.submit(self._write, *changes).add_done_callback(_log_error)
+
+    def _take_pending(self) -> Optional[Tuple[List[tuple], List[tuple]]]:
+        """
+        the rows to write and the ids to delete of the buffered changes.
+        the rows are taken in the event loop, while the tasks don't change
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return None
+
+        pending, self._pending = self._pending, {}
+        rows = []
+        deleted = []
+        for id, task in pending.items():
+            if task is None:
+                deleted.append((id,))
+                continue
+            try:
+                rows.append(self._to_row(task))
+            except ValueError:
+                logger.exception("Cannot store %s:", task)
+        return rows, deleted
+
+    def _write(self, rows: List[tuple], deleted: List[tuple]) -> None:
+        placeholders = ", ".join("?" * len(self._columns))
+        with self._lock, self._connection:
+            self._connection.executemany(
+                f"INSERT OR REPLACE INTO {self.table} VALUES ({placeholders})", rows
+            )
+            self._connection.executemany(
+                f"DELETE FROM {self.table} WHERE id = ?", deleted
+            )
+        logger.debug("Stored %d and deleted %d tasks", len(rows), len(deleted))
+
+    def _buffer(self, scheduled_tasks: List[tasks.ScheduledTask], delete: bool) -> None:
+        for task in scheduled_tasks:
+            self._pending[task.id] = None if delete else task
+        if self._flush_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # flushed when the scheduler is started
+                return
+            self._flush_handle = loop.call_later(self.flush_interval, self._flush_later)
+
+    def _to_row(self, task: tasks.ScheduledTask) -> tuple:
+        record = dump(task)
+        func = record["func"]
+        path = function_path(func)
+        try:
+            arguments = pickle.dumps((record["args"], record["kwargs"]))
+        except Exception as e:
+            raise ValueError(f"cannot pickle the arguments of {task}") from e
+        executor = record["executor"]
+        last_run = record["last_run"]
+        if last_run is not None:
+            try:
+                last_run = pickle.dumps(last_run)
+            except Exception:
+                # keep the run without its result
+                last_run = pickle.dumps(without_result(last_run))
+        return (
+            record["id"],
+            record["type"].value,
+            json.dumps(record["at_time"]),
+            json.dumps(record["at_date"]),
+            record["interval"],
+            json.dumps(record["tags"]),
+            _to_seconds(record["fixed_datetime"]),
+            record["fixed_month"],
+            record["fixed_month_day"],
+            record["fixed_weekday"],
+            record["cron"],
+            path,
+            arguments,
+            executor if isinstance(executor, str) else None,
+            record["max_instances"],
+            record["coalesce"],
+            record["misfire_grace_time"],
+            record["misfire_policy"],
+            record["jitter"],
+            record["spread"],
+            record["keep_result"],
+            record["history"],
+            record["timeout"],
+            record["priority"],
+            _to_seconds(record["next_run"]),
+            record["previous_runs"],
+            record["missed_runs"],
+            last_run,
+        )
+
+    def _to_record(self, row: tuple) -> Dict[str, Any]:
+        record = dict(zip(self._columns, row))
+        record["type"] = creation_helper.TaskType(record["type"])
+        for key in ("at_time", "at_date", "tags"):
+            record[key] = json.loads(record[key])
+        for key in ("fixed_datetime", "next_run"):
+            record[key] = _from_seconds(record[key])
+        record["func"] = resolve_function(record["func"])
+        record["args"], record["kwargs"] = pickle.loads(record.pop("arguments"))
+        record["coalesce"] = bool(record["coalesce"])
+        record["keep_result"] = bool(record["keep_result"])
+        if record["last_run"] is not None:
+            record["last_run"] = pickle.loads(record["last_run"])
+        return record
+
+
+def _log_error(future: Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Cannot write the stored tasks:", exc_info=future.exception())
+
+
+def dump(task: tasks.ScheduledTask) -> Dict[str, Any]:
+    """the definition and the state of a task as a record"""
+    next_run = task._next_run
+    return {
+        "id": task.id,
+        "type": task.type,
+        "at_time": list(task.at_time),
+        "at_date": list(task.at_date),
+        "interval": task.interval,
+        "tags": list(task.tags),
+        "fixed_datetime": task.fixed_datetime,
+        "fixed_month": task.fixed_month,
+        "fixed_month_day": task.fixed_month_day,
+        "fixed_weekday": task.fixed_weekday,
+        "cron": task.cron,
+        "func": task.func,
+        "args": task.args,
+        "kwargs": task.kwargs,
+        "executor": task.executor,
+        "max_instances": task.max_instances,
+        "coalesce": task.coalesce,
+        "misfire_grace_time": task.misfire_grace_time,
+        "misfire_policy": task.misfire_policy,
+        "jitter": task.jitter,
+        "spread": task.spread,
+        "keep_result": task.keep_result,
+        "history": task._history.maxlen if task._history is not None else 0,
+        "timeout": task.timeout,
+        "priority": task.priority,
+        "next_run": None if next_run is tasks.PENDING else next_run,
+        "previous_runs": task.previous_runs,
+        "missed_runs": task.missed_runs,
+        "last_run": task.last_run,
+    }
+
+
+def restore(
+    scheduler: scheduler.AsyncScheduler, record: Dict[str, Any]
+) -> tasks.ScheduledTask:
+    """creates the `ScheduledTask` of a record returned by `dump()`"""
+    task = tasks.ScheduledTask(
+        scheduler,
+        record["type"],
+        record["at_time"],
+        record["at_date"],
+        record["interval"],
+        record["tags"],
+        record["fixed_datetime"],
+        record["fixed_month"],
+        record["fixed_month_day"],
+        record["fixed_weekday"],
+        record["func"],
+        record["args"],
+        record["kwargs"],
+        executor=record["executor"],
+        max_instances=record["max_instances"],
+        coalesce=record["coalesce"],
+        misfire_grace_time=record["misfire_grace_time"],
+        misfire_policy=record["misfire_policy"],
+        jitter=record["jitter"],
+        spread=record["spread"],
+        keep_result=record["keep_result"],
+        history=record["history"],
+        timeout=record["timeout"],
+        priority=record["priority"],
+        cron=record["cron"],
+        id=record["id"],
+    )
+    task._previous_runs = record["previous_runs"]
+    task._missed_runs = record["missed_runs"]
+    task._last_run = record["last_run"]
+    if task._history is not None and task._last_run is not None:
+        task._history.append(task._last_run)
+    next_run = record["next_run"]
+    if next_run is not None:
+        task._next_run = next_run
+        if task._anchor is not None:
+            # interval tasks continue at the stored next run.
+            # if it's past, the run is overdue and the misfire policy applies
+            wait_time = (next_run - scheduler.clock.now()).total_seconds()
+            task._anchor = scheduler.clock.monotonic() + wait_time - task.interval
+            task._slot = 1
+    return task
+
+
+def without_result(result: tasks.TaskResult) -> tasks.TaskResult:
+    """a copy of `result` without the returned value or raised exception"""
+    return tasks.TaskResult(
+        result.succeed,
+        None,
+        result.datetime,
+        result.duration,
+        result.coalesced,
+        result.queued,
+        result.traceback,
+        result.timed_out,
+    )
+
+
+def function_path(func: Callable) -> str:
+    """
+    the import path (`module:qualname`) of a function.
+    raises ValueError if the function cannot be imported by its path
+    """
+    module = getattr(func, "__module__", None)
+    qualname = getattr(func, "__qualname__", None)
+    if module is None or qualname is None or "<" in qualname:
+        raise ValueError(f"`{func!r}` is not a module level function")
+    path = f"{module}:{qualname}"
+    try:
+        resolved = resolve_function(path)
+    except (ImportError, AttributeError):
+        resolved = None
+    if resolved is not func:
+        raise ValueError(f"`{func!r}` cannot be imported as `{path}`")
+    return path
+
+
+def resolve_function(path: str) -> Callable:
+    """imports the function of an import path returned by `function_path()`"""
+    module, _, qualname = path.partition(":")
+    obj = importlib.import_module(module)
+    for name in qualname.split("."):
+        obj = getattr(obj, name)
+    return obj
+
+
+def _to_seconds(dt: Optional[datetime]) -> Optional[float]:
+    """(naive) epoch seconds of a datetime"""
+    if dt is None:
+        return None
+    return (dt - _EPOCH).total_seconds()
+
+
+def _from_seconds(seconds: Optional[float]) -> Optional[datetime]:
+    if seconds is None:
+        return None
+    return _EPOCH + timedelta(seconds=seconds)
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Optional
+from uuid import uuid4
+
+from . import logger
+
+
+class LeaseStore(ABC):
+    """
+    keeps leases shared by the replicas of a scheduler, e.g. in a database.
+    a lease is held by a single owner until it expires or is released.
+    """
+
+    @abstractmethod
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        """
+        acquire or renew the lease `name` for `ttl` seconds.
+        returns True if `owner` holds the lease
+        """
+
+    @abstractmethod
+    def release(self, name: str, owner: str) -> None:
+        """release the lease `name` if it's held by `owner`"""
+
+    def close(self) -> None:
+        """release the resources of the store"""
+
+
+class SQLiteLeaseStore(LeaseStore):
+    """
+    keeps the leases in a SQLite database,
+    for replicas running on the same host.
+    """
+
+    def __init__(self, path: str, *, table: str = "leases") -> None:
+        if not table.isidentifier():
+            raise ValueError("`table` must be a valid identifier")
+        self.path: str = path
+        self.table: str = table
+        # the leases are renewed in a thread of the event loop
+        self._lock: threading.Lock = threading.Lock()
+        self._connection: sqlite3.Connection = sqlite3.connect(
+            path, timeout=5.0, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute(
+            f"""CREATE TABLE IF NOT EXISTS {table} (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires REAL NOT NULL
+            )"""
+        )
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            connection = self._connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    f"SELECT owner, expires FROM {self.table} WHERE name = ?", (name,)
+                ).fetchone()
+                acquired = row is None or row[0] == owner or row[1] < now
+                if acquired:
+                    connection.execute(
+                        f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?)",
+                        (name, owner, now + ttl),
+                    )
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+        return acquired
+
+    def release(self, name: str, owner: str) -> None:
+        with self._lock:
+            self._connection.execute(
+                f"DELETE FROM {self.table} WHERE name = ? AND owner = ?", (name, owner)
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class LeaderElection:
+    """
+    elects one of the replicas of a scheduler to run the tasks.
+
+    the leader holds the lease `name` of `store` and renews it every `ttl / 3` seconds.
+    the other replicas keep trying to acquire it, so one of them takes over
+    within `ttl` seconds after the leader stopped or crashed.
+
+    the replicas calculate the next runs of their tasks as usual,
+    but only the leader executes them. the runs of a replica which
+    is not the leader are skipped, they are executed by the leader.
+    """
+
+    def __init__(
+        self,
+        store: LeaseStore,
+        name: str = "swisscore_scheduler",
+        *,
+        ttl: float = 15.0,
+        owner: Optional[str] = None,
+    ) -> None:
+        if not isinstance(ttl, (int, float)):
+            raise TypeError("`ttl` must be a number")
+        if ttl <= 0:
+            raise ValueError("`ttl` must be greater then zero")
+        self.store: LeaseStore = store
+        self.name: str = name
+        self.ttl: float = ttl
+        self.owner: str = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+        self._leader: bool = False
+        # monotonic time until the lease is surely held
+        self._valid_until: float = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_leader(self) -> bool:
+        """True if this replica holds the lease"""
+        return self._leader and time.monotonic() < self._valid_until
+
+    async def start(self) -> None:
+        """try to acquire the lease and keep renewing it in the background"""
+        if self._task is not None:
+            return
+        await self._renew()
+        self._task = asyncio.create_task(self._keep_renewing())
+
+    def stop(self) -> None:
+        """stop renewing and release the lease, so another replica can take over"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._leader:
+            self._set_leader(False)
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self._release()
+            else:
+                # like the renewal, don't block the event loop
+                loop.run_in_executor(None, self._release)
+
+    def _release(self) -> None:
+        try:
+            self.store.release(self.name, self.owner)
+        except Exception:
+            logger.exception("Cannot release the leader lease:")
+
+    async def _keep_renewing(self) -> None:
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            await self._renew()
+
+    async def _renew(self) -> None:
+        # the lease may expire `ttl` seconds after the attempt was started
+        valid_until = time.monotonic() + self.ttl
+        loop = asyncio.get_running_loop()
+        try:
+            acquired = await loop.run_in_executor(
+                None, self.store.acquire, self.name, self.owner, self.ttl
+            )
+        except Exception:
+            logger.exception("Cannot acquire the leader lease:")
+            # keep the leadership until the lease expires, the next attempt may succeed
+            return
+        if acquired:
+            self._valid_until = valid_until
+        self._set_leader(acquired)
+
+    def _set_leader(self, leader: bool) -> None:
+        if leader != self._leader:
+            if leader:
+                logger.info("%s is the leader now", self.owner)
+            else:
+                logger.info("%s is not the leader anymore", self.owner)
+        self._leader = leader
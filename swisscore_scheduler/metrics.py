@@ -0,0 +1,289 @@
+from __future__ import annotations
+
+import asyncio
+from bisect import bisect_left
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from . import scheduler, tasks
+
+# upper bounds in seconds
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+)
+
+
+class Histogram:
+    """counts observed values in fixed buckets"""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.bounds: Tuple[float, ...] = tuple(bounds)
+        # the last bucket counts the values above all bounds
+        self.counts: List[int] = [0] * (len(self.bounds) + 1)
+        self.sum: float = 0.0
+        self.count: int = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        estimates the `q` quantile (0..1) by interpolating within its bucket.
+        returns None if nothing was observed
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if i == len(self.bounds):
+                    # above all bounds
+                    return self.bounds[-1]
+                lower = self.bounds[i - 1] if i else 0.0
+                return lower + (self.bounds[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.bounds[-1]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": dict(zip((*self.bounds, float("inf")), self.counts)),
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+class RunMetrics:
+    """the metrics of the runs of a task, a tag or all tasks"""
+
+    __slots__ = ("succeeded", "failed", "lateness", "duration")
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.succeeded: int = 0
+        self.failed: int = 0
+        # seconds between the scheduled and the actual start of a run
+        self.lateness: Histogram = Histogram(buckets)
+        self.duration: Histogram = Histogram(buckets)
+
+    def observe(self, succeed: bool, duration: float, lateness: float) -> None:
+        if succeed:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+        self.duration.observe(duration)
+        self.lateness.observe(lateness)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "runs": self.succeeded + self.failed,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "lateness": self.lateness.snapshot(),
+            "duration": self.duration.snapshot(),
+        }
+
+
+class Metrics:
+    """
+    collects the metrics of the runs of an `AsyncScheduler`:
+    run counts, lateness and duration histograms for all tasks and per tag.
+    the metrics of a tag are dropped when no task carries it any more.
+
+    if `per_task` is True the metrics of each task are kept as well
+    until the task is cancelled.
+    """
+
+    def __init__(
+        self, buckets: Sequence[float] = DEFAULT_BUCKETS, per_task: bool = False
+    ) -> None:
+        self.buckets: Tuple[float, ...] = tuple(buckets)
+        self.per_task: bool = per_task
+        self.total: RunMetrics = RunMetrics(self.buckets)
+        self.tags: Dict[str, RunMetrics] = {}
+        self.tasks: Dict[str, RunMetrics] = {}
+        # number of runs currently executing or waiting for the concurrency limit
+        self.running: int = 0
+        self.waiting: int = 0
+        # observed by the `Watchdog` of the scheduler
+        self.loop_lag: Histogram = Histogram(self.buckets)
+
+    def observe(
+        self, task: tasks.ScheduledTask, succeed: bool, duration: float, lateness: float
+    ) -> None:
+        """record a finished run of `task`"""
+        self.total.observe(succeed, duration, lateness)
+        for tag in task.tags:
+            tag_metrics = self.tags.get(tag)
+            if tag_metrics is None:
+                tag_metrics = self.tags[tag] = RunMetrics(self.buckets)
+            tag_metrics.observe(succeed, duration, lateness)
+        if self.per_task:
+            task_metrics = self.tasks.get(task.id)
+            if task_metrics is None:
+                task_metrics = self.tasks[task.id] = RunMetrics(self.buckets)
+            task_metrics.observe(succeed, duration, lateness)
+
+    def forget(self, task: tasks.ScheduledTask) -> None:
+        """drop the metrics of a cancelled task"""
+        self.tasks.pop(task.id, None)
+
+    def forget_tag(self, tag: str) -> None:
+        """drop the metrics of a tag no task carries any more"""
+        self.tags.pop(tag, None)
+
+    def clear_tasks(self) -> None:
+        self.tasks.clear()
+        self.tags.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """the current metrics as a (json serializable) dict"""
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "loop_lag": self.loop_lag.snapshot(),
+            "total": self.total.snapshot(),
+            "tags": {tag: m.snapshot() for tag, m in self.tags.items()},
+            "tasks": {id: m.snapshot() for id, m in self.tasks.items()},
+        }
+
+
+def prometheus_text(
+    scheduler: scheduler.AsyncScheduler, prefix: str = "swisscore_scheduler"
+) -> str:
+    """the metrics of `scheduler` in the Prometheus text format"""
+    metrics = scheduler.metrics
+    lines = [
+        f"# HELP {prefix}_tasks The number of pending tasks.",
+        f"# TYPE {prefix}_tasks gauge",
+        f"{prefix}_tasks {len(scheduler._tasks)}",
+    ]
+    if metrics is None:
+        return "\n".join(lines) + "\n"
+
+    lines += [
+        f"# HELP {prefix}_running The number of executing runs.",
+        f"# TYPE {prefix}_running gauge",
+        f"{prefix}_running {metrics.running}",
+        f"# HELP {prefix}_waiting The number of runs waiting for the concurrency limit.",
+        f"# TYPE {prefix}_waiting gauge",
+        f"{prefix}_waiting {metrics.waiting}",
+        f"# HELP {prefix}_queued The number of runs waiting for a worker.",
+        f"# TYPE {prefix}_queued gauge",
+        f"{prefix}_queued {scheduler._queue.qsize() if scheduler._queue else 0}",
+        f"# HELP {prefix}_loop_lag_seconds The lag of the event loop.",
+        f"# TYPE {prefix}_loop_lag_seconds histogram",
+        *_histogram_lines(f"{prefix}_loop_lag_seconds", "", metrics.loop_lag),
+    ]
+    groups = [
+        ("", [("", metrics.total)]),
+        ("_tag", [(_labels(tag=tag), m) for tag, m in metrics.tags.items()]),
+        ("_task", [(_task_labels(scheduler, id), m) for id, m in metrics.tasks.items()]),
+    ]
+    for group, series in groups:
+        if not series:
+            continue
+        name = f"{prefix}{group}_runs_total"
+        lines.append(f"# HELP {name} The number of finished runs.")
+        lines.append(f"# TYPE {name} counter")
+        for labels, m in series:
+            for status, value in (("succeeded", m.succeeded), ("failed", m.failed)):
+                lines.append(f"{name}{{{_join(labels, _labels(status=status))}}} {value}")
+
+        for metric, help in (
+            ("lateness_seconds", "Seconds between the scheduled and the actual start."),
+            ("duration_seconds", "The duration of the runs."),
+        ):
+            name = f"{prefix}{group}_{metric}"
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, m in series:
+                histogram = m.lateness if metric == "lateness_seconds" else m.duration
+                lines.extend(_histogram_lines(name, labels, histogram))
+    return "\n".join(lines) + "\n"
+
+
+async def serve(
+    scheduler: scheduler.AsyncScheduler, host: str = "127.0.0.1", port: int = 9464
+) -> asyncio.AbstractServer:
+    """
+    serve the metrics of `scheduler` in the Prometheus text format
+    at `http://host:port/metrics`. close the returned server to stop it.
+    """
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await reader.readline()
+            # skip the headers
+            while (await reader.readline()).strip():
+                pass
+            parts = request.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1] in ("/", "/metrics"):
+                status = "200 OK"
+                body = prometheus_text(scheduler).encode()
+            else:
+                status = "404 Not Found"
+                body = b""
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+def _histogram_lines(name: str, labels: str, histogram: Histogram) -> Iterator[str]:
+    cumulative = 0
+    for bound, count in zip((*histogram.bounds, float("inf")), histogram.counts):
+        cumulative += count
+        le = "+Inf" if bound == float("inf") else repr(bound)
+        yield f"{name}_bucket{{{_join(labels, _labels(le=le))}}} {cumulative}"
+    suffix = f"{{{labels}}}" if labels else ""
+    yield f"{name}_sum{suffix} {histogram.sum}"
+    yield f"{name}_count{suffix} {histogram.count}"
+
+
+def _task_labels(scheduler: scheduler.AsyncScheduler, id: str) -> str:
+    task = scheduler._tasks.get(id)
+    name = getattr(task.func, "__name__", "") if task is not None else ""
+    return _labels(task=id, func=name)
+
+
+def _labels(**labels: str) -> str:
+    return ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+
+
+def _join(*labels: str) -> str:
+    return ",".join(label for label in labels if label)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
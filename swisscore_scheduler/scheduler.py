@@ -1,11 +1,39 @@
 from __future__ import annotations
 
 import asyncio
-from ctypes import Union
+import heapq
+import itertools
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, time, timedelta
-from typing import Awaitable, Dict, List, Optional, Callable
-
-from . import creation_helper, tasks
+from typing import (
+    Any,
+    Awaitable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Callable,
+    Tuple,
+    Union,
+)
+
+from . import (
+    calculator,
+    creation_helper,
+    crontab,
+    dispatcher,
+    jobstore,
+    metrics,
+    tasks,
+    utils,
+)
+from .clock import Clock, SystemClock
+from .metrics import Metrics
+from .leader import LeaderElection
+from .watchdog import Watchdog
 from . import logger
 
 
@@ -22,16 +50,324 @@ class CallbackHandler:
             logger.exception("Caught Exception while running a callback handler:")
 
 
-class AsyncScheduler:
-    def __init__(self) -> None:
-        self.tasks: list[tasks.ScheduledTask] = []
+class PrioritySemaphore:
+    """a semaphore which lets the waiters with the highest priority acquire it first"""
+
+    def __init__(self, value: int) -> None:
+        self._value: int = value
+        # heap of (-priority, sequence, future)
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+
+    def locked(self) -> bool:
+        return self._value == 0
+
+    async def acquire(self, priority: int = 0) -> bool:
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return True
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (-priority, next(self._counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # acquired, but cancelled before it was woken up
+                self.release()
+            raise
+        return True
+
+    def release(self) -> None:
+        self._value += 1
+        while self._value > 0 and self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self._value -= 1
+                future.set_result(None)
+
+
+class BaseScheduler(ABC):
+    """
+    the task builders and the bulk registration shared by the schedulers.
+    the built tasks are handed over to `_add_tasks()` of the subclass.
+    """
+
+    def __init__(self, clock: Optional[Clock] = None) -> None:
+        self.clock: Clock = clock or SystemClock()
+        # the number of workers executing the queued runs, see `AsyncScheduler`
+        self.workers: Optional[int] = None
+        # tasks created within `batch()` which are not registered yet
+        self._batch: Optional[List[tasks.ScheduledTask]] = None
+
+    @property
+    def each(self) -> creation_helper.UnitSelector:
+        """schedule a function or coroutine to run periodically"""
+        return creation_helper.UnitSelector(creation_helper.FutureTask(self))
+
+    def every(
+        self, interval: int, limit: Optional[int] = None
+    ) -> creation_helper.UnitsSelector:
+        """schedule a function or coroutine to run periodically in a fixed interval"""
+        if not isinstance(interval, int):
+            raise TypeError(f"`interval` must be an `int`")
+        if interval <= 1:
+            raise ValueError("use `each` instead")
+        if limit:
+            if not isinstance(limit, int):
+                raise TypeError(f"`limit` must be an `int`")
+            if limit < 1:
+                raise ValueError("`limit` cannot be smaller then 1")
+        future_task = creation_helper.FutureTask(self)
+        future_task.interval = interval
+        return creation_helper.UnitsSelector(future_task)
+
+    def at(self, at: datetime) -> creation_helper.TaskFinalizer:
+        """schedule a function or coroutine to run once at a specific time"""
+        if at < self.clock.now():
+            raise ValueError("cannot schedule a task to run in the past!")
+        future_task = creation_helper.FutureTask(self)
+        future_task.type = creation_helper.TaskType.one_time
+        future_task.fixed_datetime = at
+        return creation_helper.TaskFinalizer(future_task)
+
+    def cron(
+        self,
+        expression: str,
+        *,
+        jitter: Optional[float] = None,
+        spread: Optional[float] = None,
+    ) -> creation_helper.TaskFinalizer:
+        """
+        schedule a function or coroutine to run at the times matching a cron expression,
+        e.g. "*/15 8-18 * * 1-5" runs every 15 minutes from 8:00 to 18:45 on weekdays.
+        the fields are minute, hour, day of month, month and day of week
+        with `*`, lists, ranges, steps and names ("jan", "mon"), or an alias like "@daily".
+        :param jitter: delay each run by a random number of seconds in 0..jitter
+        :param spread: delay all runs by the same number of seconds in 0..spread,
+            derived from the task id. spreads the runs of many tasks over a stable slot each
+        """
+        crontab.parse(expression)
+        future_task = creation_helper.FutureTask(self)
+        future_task.type = creation_helper.TaskType.cron
+        future_task.cron = expression
+        future_task.set_offsets(jitter, spread)
+        return creation_helper.TaskFinalizer(future_task)
+
+    def after(
+        self,
+        days: Optional[int] = 0,
+        hours: Optional[int] = 0,
+        minutes: Optional[int] = 0,
+        seconds: Optional[int] = 0,
+    ) -> creation_helper.TaskFinalizer:
+        """schedule a function or coroutine to run once after a specific delay"""
+        delta = timedelta(days=days, hours=hours, minutes=minutes, seconds=seconds)
+        at = self.clock.now() + delta
+        return self.at(at)
+
+    @contextmanager
+    def batch(self) -> Iterator[BaseScheduler]:
+        """
+        register all tasks created within the `with` block at once:
+
+            with scheduler.batch():
+                for customer in customers:
+                    scheduler.each.day.at(6).run(report, customer)
+
+        the tasks are inserted into the scheduler and handed over to the event loop
+        in a single step when the block is left. their next runs are calculated in bulk.
+        if the block raises an exception, none of its tasks are registered.
+        nested batches are registered by the outermost one.
+        """
+        if self._batch is not None:
+            yield self
+            return
+
+        self._batch = []
+        try:
+            yield self
+        except BaseException:
+            logger.debug("Discarded batch of %d tasks", len(self._batch))
+            raise
+        else:
+            self._add_tasks(self._batch)
+        finally:
+            self._batch = None
+
+    def add_many(
+        self, specs: Iterable[Tuple[Any, ...]]
+    ) -> List[tasks.ScheduledTask]:
+        """
+        create many tasks at once. each spec is a tuple of
+        `(builder, func)`, `(builder, func, args)` or `(builder, func, args, kwargs)`
+        where `builder` is anything with a `run` method, e.g. `scheduler.each.day.at(6)`.
+        builders can be reused for multiple specs.
+
+            scheduler.add_many((scheduler.each.hour, ping, (host,)) for host in hosts)
+
+        returns the created `ScheduledTask`s. see `batch()`
+        """
+        created: List[tasks.ScheduledTask] = []
+        with self.batch():
+            for spec in specs:
+                if not isinstance(spec, tuple) or not 2 <= len(spec) <= 4:
+                    raise TypeError(
+                        "a spec must be a tuple of `(builder, func[, args[, kwargs]])`"
+                    )
+                builder, func, args, kwargs = spec + ((), {})[len(spec) - 2 :]
+                if not isinstance(builder, creation_helper.Creator) or not hasattr(
+                    builder, "run"
+                ):
+                    raise TypeError(f"`{builder!r}` is not a task builder")
+                created.append(builder.run(func, *args, **kwargs))
+        return created
+
+    def _add_task(self, task: tasks.ScheduledTask) -> None:
+        """register a new task"""
+        if self._batch is not None:
+            self._batch.append(task)
+            return
+        self._add_tasks([task])
+
+    @abstractmethod
+    def _add_tasks(self, new_tasks: List[tasks.ScheduledTask]) -> None:
+        """register many new tasks in one step"""
+
+    @abstractmethod
+    def cancel_task(self, task: tasks.ScheduledTask):
+        """cancel a task"""
+
+    def _index_tags(self, task: tasks.ScheduledTask, *tags: str) -> None:
+        """add `task` to the tag index of the given `tags`"""
+
+    def _unindex_tags(self, task: tasks.ScheduledTask, *tags: str) -> None:
+        """remove `task` from the tag index of the given `tags`"""
+
+    def _update_stored(self, task: tasks.ScheduledTask) -> None:
+        """hand over the changed state of a registered task"""
+
+
+class AsyncScheduler(BaseScheduler):
+    def __init__(
+        self,
+        *,
+        use_dispatcher: bool = False,
+        executor: Union[str, Executor, None] = None,
+        max_workers: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+        clock: Optional[Clock] = None,
+        store: Optional[jobstore.JobStore] = None,
+        metrics: Union[bool, Metrics] = False,
+        watchdog: Union[bool, Watchdog] = False,
+        leader: Optional[LeaderElection] = None,
+        workers: Optional[int] = None,
+        queue_size: int = 1000,
+    ) -> None:
+        """
+        if `use_dispatcher` is True:
+            all tasks are driven by a single coroutine keeping a heap of deadlines
+            instead of one sleeping `asyncio.Task` per `ScheduledTask`.
+            recommended for a large number of tasks.
+
+        `executor` is used to run regular (non coroutine) functions:
+            None runs them directly in the event loop (default),
+            "thread" or "process" runs them in a pool with `max_workers` workers,
+            a `concurrent.futures.Executor` runs them in the given executor.
+
+        `max_concurrency` limits the number of tasks running at the same time.
+        the waiting runs with the highest priority start first.
+
+        if `workers` is set:
+            due runs are put into a queue of at most `queue_size` runs,
+            the highest priority first, then the earliest,
+            and executed by `workers` worker coroutines. the tasks keep firing on time
+            while the workers are busy. if the queue is full, firing waits until there's room.
+            combine it with `executor="thread"` to execute regular functions in threads.
+
+        `timeout` is the default number of seconds a run may take, see `TaskFinalizer.run()`.
+
+        `clock` is the time source of the scheduler. defaults to the system clock.
+        use a `VirtualClock` to test or simulate schedules without waiting.
+
+        `store` keeps the tasks, so they are restored when the scheduler is started again.
+        use a `MemoryJobStore` to keep them when the scheduler is stopped
+        or a `SQLiteJobStore` to restore them after the process was restarted,
+        see `load_tasks()`. without a store, `stop()` cancels all tasks.
+
+        `metrics` collects run counts, lateness and duration histograms of the runs,
+        see `Metrics`. pass True to enable it with the default settings.
+
+        `watchdog` measures the lag of the event loop and reports the tasks blocking it
+        and slow runs, see `Watchdog`. pass True to enable it with the default settings.
+
+        `leader` elects one of multiple replicas of the scheduler to run the tasks,
+        so they are not executed by every replica, see `LeaderElection`.
+        """
+        utils.validate_executor(executor)
+        utils.validate_timeout(timeout)
+        if max_concurrency is not None:
+            if not isinstance(max_concurrency, int):
+                raise TypeError("`max_concurrency` must be an `int`")
+            if max_concurrency < 1:
+                raise ValueError("`max_concurrency` cannot be smaller then 1")
+        if workers is not None:
+            if not isinstance(workers, int):
+                raise TypeError("`workers` must be an `int`")
+            if workers < 1:
+                raise ValueError("`workers` cannot be smaller then 1")
+        if not isinstance(queue_size, int):
+            raise TypeError("`queue_size` must be an `int`")
+        if queue_size < 0:
+            raise ValueError("`queue_size` cannot be negative")
+        self.timeout: Optional[float] = timeout
+        super().__init__(clock)
+        self.store: Optional[jobstore.JobStore] = store
+        self._loaded: bool = False
+        self.metrics: Optional[Metrics] = (
+            Metrics() if metrics is True else metrics or None
+        )
+        self.watchdog: Optional[Watchdog] = (
+            Watchdog() if watchdog is True else watchdog or None
+        )
+        self.leader: Optional[LeaderElection] = leader
+        self._tasks: Dict[str, tasks.ScheduledTask] = {}
+        # the tasks of each tag, dicts keep them in the order they were tagged
+        self._tag_index: Dict[str, Dict[tasks.ScheduledTask, None]] = {}
         self.conditional_tasks: list[tasks.ConditionalTask] = []
 
         self.is_running: bool = False
 
+        self._state_changed: Optional[asyncio.Event] = None
         self._callback_handlers: List[CallbackHandler] = []
         self._exception_handler: Optional[CallbackHandler] = None
 
+        self._dispatcher: Optional[dispatcher.Dispatcher] = (
+            dispatcher.Dispatcher(self) if use_dispatcher else None
+        )
+
+        self.executor: Union[str, Executor, None] = executor
+        self.max_workers: Optional[int] = max_workers
+        self._semaphore: Optional[PrioritySemaphore] = (
+            PrioritySemaphore(max_concurrency) if max_concurrency else None
+        )
+        # set if any task has a priority, see `_take_turn()`
+        self._prioritized: bool = False
+        self._due: List[Tuple[int, int, asyncio.Future]] = []
+        self._due_counter = itertools.count()
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+
+        self.workers: Optional[int] = workers
+        self.queue_size: int = queue_size
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers: List[asyncio.Task] = []
+
+    @property
+    def tasks(self) -> List[tasks.ScheduledTask]:
+        """all pending `ScheduledTask`s"""
+        return list(self._tasks.values())
+
     def start_concurrently(self):
         """
         start scheduler concurrently.
@@ -64,30 +400,118 @@ class AsyncScheduler:
 
     def stop(self) -> None:
         """
-        Cancel all pending Tasks and stop scheduler
+        Cancel all pending Tasks and stop scheduler.
+        the tasks are kept in the store, if any, and restored on the next start
         """
         if not self.is_running:
             raise RuntimeError("Scheduler is not running")
 
-        for task in self.tasks:
-            self.cancel_task(task)
+        if self.store is not None:
+            self.store.flush()
+        self._cancel(self.tasks, everything=True, keep_stored=True)
+        self._loaded = False
+
+        if self._dispatcher is not None:
+            self._dispatcher.stop()
+        if self.watchdog is not None:
+            self.watchdog.stop()
+        if self.leader is not None:
+            self.leader.stop()
+
+        for worker in self._workers:
+            worker.cancel()
+        self._workers.clear()
+        if self._queue is not None:
+            while not self._queue.empty():
+                *_, task = self._queue.get_nowait()
+                task._queued -= 1
+
+        for pool in (self._thread_pool, self._process_pool):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        self._thread_pool = None
+        self._process_pool = None
 
         self.is_running = False
+        self._notify()
         logger.info("Scheduler was stopped!")
 
     async def _main(self, run_forever: bool = False):
-        loop = asyncio.get_running_loop()
-        for t in self.tasks:
-            t._task = loop.create_task(t._run())
+        state_changed = self._state_changed = asyncio.Event()
+        if self._dispatcher is not None:
+            self._dispatcher.start()
+        if self.watchdog is not None:
+            self.watchdog.start(self)
+        if self.workers:
+            self._queue = asyncio.PriorityQueue(self.queue_size)
+            loop = asyncio.get_running_loop()
+            self._workers = [loop.create_task(self._work()) for _ in range(self.workers)]
+        if self.leader is not None:
+            await self.leader.start()
+            # the scheduler may have been stopped meanwhile
+            if not self.is_running or self._state_changed is not state_changed:
+                return
+        if self.store is not None:
+            self.load_tasks()
+            self.store.flush()
+        scheduled_tasks = self.tasks
+        calculator.resolve_next_runs(scheduled_tasks, self.clock.now())
+        if self._dispatcher is not None:
+            self._dispatcher.push_many(scheduled_tasks)
+        else:
+            for t in scheduled_tasks:
+                self._schedule(t)
 
-        while 1:
-            await asyncio.sleep(0.5 if not run_forever else 60)
-            if len(self.tasks) == 0 and not run_forever:
+        # the scheduler may have been stopped and started again meanwhile
+        while self.is_running and self._state_changed is state_changed:
+            if len(self._tasks) == 0 and not run_forever:
                 self.stop()
-
-            if not self.is_running:
                 break
 
+            # woken up by `stop()` or when the pending tasks changed
+            await state_changed.wait()
+            state_changed.clear()
+
+    async def _work(self) -> None:
+        """a worker executing the runs of the queue one after another"""
+        queue = self._queue
+        loop = asyncio.get_running_loop()
+        while True:
+            _, due, _, task = await queue.get()
+            task._queued -= 1
+            # skip the runs of tasks which were cancelled meanwhile
+            if self._tasks.get(task.id) is not task:
+                continue
+            run = loop.create_task(task._execute_queued(self.clock.monotonic() - due))
+            task._instances.add(run)
+            run.add_done_callback(task._instances.discard)
+            # the run may be cancelled, but not the worker
+            await asyncio.wait((run,))
+
+    async def _take_turn(self, task: tasks.ScheduledTask) -> None:
+        """
+        waits until the tasks which woke up at the same time as `task`
+        and have a higher priority have fired
+        """
+        loop = asyncio.get_running_loop()
+        if not self._due:
+            loop.call_soon(self._fire_due)
+        future = loop.create_future()
+        self._due.append((-task.priority, next(self._due_counter), future))
+        await future
+
+    def _fire_due(self) -> None:
+        due, self._due = self._due, []
+        due.sort()
+        for _, _, future in due:
+            if not future.done():
+                future.set_result(None)
+
+    def _notify(self) -> None:
+        """wake up the main loop"""
+        if self._state_changed is not None:
+            self._state_changed.set()
+
     def callback(self, *tags: str):
         """
         Use this decorator to setup a callback handler
@@ -98,65 +522,77 @@ class AsyncScheduler:
         """
 
         def wrapper(func):
-            async def handler(*args, **kwargs):
-                if asyncio.iscoroutinefunction(func) or isinstance(func, Awaitable):
-                    return await func(*args, **kwargs)
-                else:
-                    return func(*args, **kwargs)
-
+            handler = _as_coroutine(func)
             self._callback_handlers.append(CallbackHandler(handler, *tags))
             return handler
 
         return wrapper
 
+    def exception_handler(self, func: Callable) -> Callable:
+        """
+        Use this decorator to setup a handler for failed runs,
+        e.g. if the scheduled function raised an exception or timed out.
+        The handler gets called with the `ScheduledTask` before the callbacks.
+        """
+        handler = _as_coroutine(func)
+        self._exception_handler = CallbackHandler(handler)
+        return handler
+
     async def _run_callback(self, task: tasks.ScheduledTask) -> None:
+        last_run = task.last_run
+        if self._exception_handler is not None and last_run is not None:
+            if not last_run.succeed:
+                await self._exception_handler.run(task)
         for handler in self._callback_handlers:
             if task.matching_tags(*handler.tags):
-                logger.debug(f"Running callback with tags: {handler.tags}")
+                logger.debug("Running callback with tags: %s", handler.tags)
                 return await handler.run(task)
 
-    @property
-    def each(self) -> creation_helper.UnitSelector:
-        """schedule a function or coroutine to run periodically"""
-        return creation_helper.UnitSelector(creation_helper.FutureTask(self))
+    def load_tasks(self) -> List[tasks.ScheduledTask]:
+        """
+        restore the tasks of the store which are not registered yet.
+        called when the scheduler is started. call it before to check
+        which tasks were restored, so they are not created twice:
 
-    def every(
-        self, interval: int, limit: Optional[int] = None
-    ) -> creation_helper.UnitsSelector:
-        """schedule a function or coroutine to run periodically in a fixed interval"""
-        if not isinstance(interval, int):
-            raise TypeError(f"`interval` must be an `int`")
-        if interval <= 1:
-            raise ValueError("use `each` instead")
-        if limit:
-            if not isinstance(limit, int):
-                raise TypeError(f"`limit` must be an `int`")
-            if limit < 1:
-                raise ValueError("`limit` cannot be smaller then 1")
-        future_task = creation_helper.FutureTask(self)
-        future_task.interval = interval
-        return creation_helper.UnitsSelector(future_task)
+            scheduler = AsyncScheduler(store=SQLiteJobStore("jobs.sqlite"))
+            scheduler.load_tasks()
+            if not scheduler.get_tasks("report"):
+                scheduler.each.day.at(6).run(report).add_tags("report")
 
-    def at(self, at: datetime) -> creation_helper.TaskFinalizer:
-        """schedule a function or coroutine to run once at a specific time"""
-        if at < datetime.now():
-            raise ValueError("cannot schedule a task to run in the past!")
-        future_task = creation_helper.FutureTask(self)
-        future_task.type = creation_helper.TaskType.one_time
-        future_task.fixed_datetime = at
-        return creation_helper.TaskFinalizer(future_task)
+        returns the restored `ScheduledTask`s
+        """
+        if self._loaded or self.store is None:
+            return []
+        self._loaded = True
 
-    def after(
-        self,
-        days: Optional[int] = 0,
-        hours: Optional[int] = 0,
-        minutes: Optional[int] = 0,
-        seconds: Optional[int] = 0,
-    ) -> creation_helper.TaskFinalizer:
-        """schedule a function or coroutine to run once after a specific delay"""
-        delta = timedelta(days=days, hours=hours, minutes=minutes, seconds=seconds)
-        at = datetime.now() + delta
-        return self.at(at)
+        # defer the registration of the restored tasks like in a batch
+        batch, self._batch = self._batch, []
+        try:
+            for record in self.store.load():
+                if record["id"] in self._tasks:
+                    continue
+                try:
+                    jobstore.restore(self, record)
+                except Exception:
+                    logger.exception("Cannot restore the task %s:", record["id"])
+            restored = self._batch
+        finally:
+            self._batch = batch
+        self._add_tasks(restored, store=False)
+        if restored:
+            logger.info("Restored %d tasks", len(restored))
+        return restored
+
+    async def serve_metrics(
+        self, host: str = "127.0.0.1", port: int = 9464
+    ) -> asyncio.AbstractServer:
+        """
+        serve the metrics in the Prometheus text format at `http://host:port/metrics`.
+        close the returned server to stop serving
+        """
+        if self.metrics is None:
+            raise RuntimeError("metrics are disabled")
+        return await metrics.serve(self, host, port)
 
     def get_tasks(self, *tags: str) -> List[tasks.ScheduledTask]:
         """
@@ -166,21 +602,197 @@ class AsyncScheduler:
         """
         if len(tags) == 0:
             return self.tasks
-        return [task for task in self.tasks if task.matching_tags(*tags)]
+        indexed = sorted((self._tag_index.get(tag, ()) for tag in tags), key=len)
+        smallest, others = indexed[0], indexed[1:]
+        return [task for task in smallest if all(task in other for other in others)]
 
     def cancel_task(self, task: tasks.ScheduledTask):
         """cancel a task immediately"""
-        if task._task and not task._task.cancelled():
-            task._task.cancel()
-        self._remove_task(task)
-        return tasks.CancelledTask(task)
+        cancelled, _ = self._cancel([task])
+        return cancelled[0]
+
+    async def cancel_tasks(self, *tags: str) -> List[tasks.CancelledTask]:
+        """
+        cancel all `ScheduledTask`s matching the given `tags` at once
+        and wait until their running executions are stopped.
+        if no tags are defined, all tasks are cancelled.
+        """
+        cancelled, running = self._cancel(self.get_tasks(*tags), everything=not tags)
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+        return cancelled
+
+    async def cancel_all(self) -> List[tasks.CancelledTask]:
+        """cancel all `ScheduledTask`s and wait until their running executions are stopped"""
+        return await self.cancel_tasks()
+
+    def _cancel(
+        self,
+        scheduled_tasks: Iterable[tasks.ScheduledTask],
+        everything: bool = False,
+        keep_stored: bool = False,
+    ) -> Tuple[List[tasks.CancelledTask], List[asyncio.Task]]:
+        """
+        cancel the given tasks in one pass.
+        returns the `CancelledTask`s and the `asyncio.Task`s which are still running.
+        the currently running `asyncio.Task` is never cancelled.
+        if `keep_stored` is True, the tasks are not removed from the store.
+        """
+        scheduled_tasks = list(scheduled_tasks)
+        if not keep_stored and self.store is not None:
+            self.store.remove(scheduled_tasks)
+        current = _current_task()
+        cancelled: List[tasks.CancelledTask] = []
+        running: List[asyncio.Task] = []
+        for task in scheduled_tasks:
+            task._next_run = None
+            if self._dispatcher is not None and not everything:
+                self._dispatcher.discard(task)
+            for running_task in (task._task, *task._instances):
+                if running_task is not None and not running_task.done():
+                    if running_task is not current:
+                        running_task.cancel()
+                        running.append(running_task)
+            if not everything:
+                self._remove_task(task)
+            cancelled.append(tasks.CancelledTask(task))
+
+        if everything:
+            if self._dispatcher is not None:
+                self._dispatcher.clear()
+            self._tasks.clear()
+            self._tag_index.clear()
+            if self.metrics is not None:
+                self.metrics.clear_tasks()
+            self._notify()
+            logger.debug("Cancelled all %d tasks", len(cancelled))
+        return cancelled, running
+
+    def _get_executor(
+        self, executor: Union[str, Executor, None]
+    ) -> Optional[Executor]:
+        """
+        returns the executor to run a regular function in.
+        None means the function is called directly.
+        """
+        executor = executor or self.executor
+        if executor is None or isinstance(executor, Executor):
+            return executor
+        if executor == "thread":
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix="swisscore_scheduler"
+                )
+            return self._thread_pool
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(self.max_workers)
+        return self._process_pool
+
+    def _schedule(self, task: tasks.ScheduledTask) -> None:
+        """hand a task over to the running event loop"""
+        if self._dispatcher is not None:
+            self._dispatcher.push(task)
+        elif task._task is None or task._task.done():
+            task._task = asyncio.get_running_loop().create_task(task._run())
+
+    def _add_task(self, task: tasks.ScheduledTask) -> None:
+        """register a new task and schedule it if the scheduler is running"""
+        if self._batch is not None:
+            self._batch.append(task)
+            return
+        self._append_task(task)
+        if self.is_running:
+            if task._next_run is tasks.PENDING:
+                task._next_run = task._calculate_next_run(self.clock.now())
+            self._schedule(task)
+
+    def _add_tasks(
+        self, new_tasks: List[tasks.ScheduledTask], store: bool = True
+    ) -> None:
+        """register and schedule many new tasks in one step"""
+        new_tasks = [t for t in new_tasks if t.id not in self._tasks]
+        if not new_tasks:
+            return
+        if store and self.store is not None:
+            self.store.add(new_tasks)
+        for task in new_tasks:
+            self._tasks[task.id] = task
+            if task.priority:
+                self._prioritized = True
+            for tag in task.tags:
+                self._tag_index.setdefault(tag, {})[task] = None
+        logger.debug("Created %d tasks", len(new_tasks))
+
+        if self.is_running:
+            calculator.resolve_next_runs(new_tasks, self.clock.now())
+            if self._dispatcher is not None:
+                self._dispatcher.push_many(new_tasks)
+            else:
+                for task in new_tasks:
+                    self._schedule(task)
+        self._notify()
 
     def _append_task(self, task: tasks.ScheduledTask) -> None:
-        if not task in self.tasks:
-            logger.debug(f"Created {task}")
-            self.tasks.append(task)
+        if not task.id in self._tasks:
+            if self.store is not None:
+                self.store.add([task])
+            logger.debug("Created %s", task)
+            self._tasks[task.id] = task
+            if task.priority:
+                self._prioritized = True
+            self._index_tags(task, *task.tags)
+            self._notify()
 
     def _remove_task(self, task: tasks.ScheduledTask) -> None:
-        if task in self.tasks:
-            logger.debug(f"Cancelled {task}")
-            self.tasks.remove(task)
+        if self._tasks.get(task.id) is task:
+            logger.debug("Cancelled %s", task)
+            self._unindex_tags(task, *task.tags)
+            del self._tasks[task.id]
+            if self.metrics is not None:
+                self.metrics.forget(task)
+            self._notify()
+
+    def _update_stored(self, task: tasks.ScheduledTask) -> None:
+        """store the changed state of a registered task"""
+        if self.store is not None and self._tasks.get(task.id) is task:
+            self.store.update([task])
+
+    def _index_tags(self, task: tasks.ScheduledTask, *tags: str) -> None:
+        """add `task` to the tag index of the given `tags`"""
+        if self._tasks.get(task.id) is not task:
+            return
+        for tag in tags:
+            self._tag_index.setdefault(tag, {})[task] = None
+
+    def _unindex_tags(self, task: tasks.ScheduledTask, *tags: str) -> None:
+        """remove `task` from the tag index of the given `tags`"""
+        if self._tasks.get(task.id) is not task:
+            return
+        for tag in tags:
+            indexed = self._tag_index.get(tag)
+            if indexed is not None:
+                indexed.pop(task, None)
+                if not indexed:
+                    del self._tag_index[tag]
+                    if self.metrics is not None:
+                        self.metrics.forget_tag(tag)
+
+
+def _as_coroutine(func: Callable) -> Callable[..., Awaitable]:
+    """wraps a function or coroutine function into a coroutine function"""
+
+    async def handler(*args, **kwargs):
+        if asyncio.iscoroutinefunction(func) or isinstance(func, Awaitable):
+            return await func(*args, **kwargs)
+        else:
+            return func(*args, **kwargs)
+
+    return handler
+
+
+def _current_task() -> Optional[asyncio.Task]:
+    """returns the currently running `asyncio.Task` or None outside of an event loop"""
+    try:
+        return asyncio.current_task()
+    except RuntimeError:
+        return None
@@ -0,0 +1,455 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+import pickle
+import zlib
+from datetime import datetime
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
+
+from . import creation_helper, jobstore, scheduler, tasks, utils
+from . import logger
+
+PARTITIONS = ("id", "tag")
+
+
+class ShardedTask:
+    """a snapshot of a task running in a shard of a `ShardedScheduler`"""
+
+    __slots__ = (
+        "_scheduler",
+        "shard",
+        "id",
+        "type",
+        "tags",
+        "func",
+        "args",
+        "kwargs",
+        "next_run",
+        "previous_runs",
+        "missed_runs",
+        "last_run",
+    )
+
+    def __init__(
+        self,
+        scheduler: ShardedScheduler,
+        shard: Optional[int],
+        record: Dict[str, Any],
+    ) -> None:
+        self._scheduler: ShardedScheduler = scheduler
+        # None if the task was not sent to a shard yet
+        self.shard: Optional[int] = shard
+        self.id: str = record["id"]
+        self.type: creation_helper.TaskType = record["type"]
+        self.tags: List[str] = record["tags"]
+        self.func: Callable = record["func"]
+        self.args: Tuple[Any] = record["args"]
+        self.kwargs: Dict[str, Any] = record["kwargs"]
+        self.next_run: Optional[datetime] = record["next_run"]
+        self.previous_runs: int = record["previous_runs"]
+        self.missed_runs: int = record["missed_runs"]
+        self.last_run: Optional[tasks.TaskResult] = record["last_run"]
+
+    def cancel(self) -> Optional[ShardedTask]:
+        return self._scheduler.cancel_task(self)
+
+    def __repr__(self):
+        d = {
+            "func": utils.function_str(self.func, *self.args, **self.kwargs),
+            "tags": self.tags,
+            "shard": self.shard,
+        }
+        return f"{self.__class__.__name__}: {d}"
+
+
+class ShardedScheduler(scheduler.BaseScheduler):
+    """
+    runs the tasks in `shards` worker processes, each with its own `AsyncScheduler`,
+    so the runs are spread across the cores of the CPU.
+
+    tasks are created with the same `each`, `every`, `at`, `after` and `cron` builders
+    and sent to the shard given by the hash of their id, or if `partition` is "tag",
+    by the hash of their first tag, so tasks with the same first tag run in the same process.
+
+    the `ScheduledTask`s returned by the builders only describe the tasks,
+    their runs happen in the shards. `get_tasks()` returns `ShardedTask` snapshots
+    of the tasks of all shards including their last runs.
+    the methods asking the shards are coroutines, so they don't block the event loop,
+    except `cancel_task()` which only sends the command.
+
+    a shard which died is restarted with its tasks as of their last snapshot,
+    e.g. of `get_tasks()`.
+
+    `options` are passed to the `AsyncScheduler` of each shard.
+    `context` is the `multiprocessing` start method, defaults to "spawn".
+
+    NOTE: like for a `SQLiteJobStore`, only module level functions
+    and picklable arguments can be sent to a shard.
+    """
+
+    def __init__(
+        self,
+        shards: Optional[int] = None,
+        *,
+        partition: str = "id",
+        context: str = "spawn",
+        **options: Any,
+    ) -> None:
+        if shards is None:
+            shards = os.cpu_count() or 1
+        if not isinstance(shards, int):
+            raise TypeError("`shards` must be an `int`")
+        if shards < 1:
+            raise ValueError("`shards` cannot be smaller then 1")
+        if partition not in PARTITIONS:
+            raise ValueError(f"`partition` must be one of {', '.join(PARTITIONS)}")
+        # fail early on invalid options
+        scheduler.AsyncScheduler(**options)
+
+        super().__init__()
+        self.shards: int = shards
+        self.partition: str = partition
+        self.options: Dict[str, Any] = options
+        self.is_running: bool = False
+
+        self._context = multiprocessing.get_context(context)
+        self._processes: List[BaseProcess] = []
+        self._connections: List[Connection] = []
+        # one request at a time per shard, so the replies are not mixed up
+        self._locks: List[asyncio.Lock] = []
+        # the latest known record of each task, sent again if its shard is restarted
+        self._records: Dict[str, Dict[str, Any]] = {}
+        # the shard of each sent task
+        self._routes: Dict[str, int] = {}
+        # tasks moving to another shard, see `_update_stored()`
+        self._moves: Set[asyncio.Task] = set()
+
+    def start(self) -> None:
+        """start the worker processes and send them their tasks"""
+        if self.is_running:
+            raise RuntimeError("Scheduler is already running")
+        self._processes = [None] * self.shards
+        self._connections = [None] * self.shards
+        self._locks = [asyncio.Lock() for _ in range(self.shards)]
+        for shard in range(self.shards):
+            self._spawn(shard)
+        self.is_running = True
+        self._send_tasks(list(self._records.values()))
+        logger.info("Started scheduler with %d shards!", self.shards)
+
+    async def stop(self) -> None:
+        """
+        stop the worker processes.
+        their tasks are kept and sent again when the scheduler is started again
+        """
+        if not self.is_running:
+            raise RuntimeError("Scheduler is not running")
+        self.is_running = False
+        for move in list(self._moves):
+            move.cancel()
+        for shard, records in await self._request_all("stop"):
+            if records is not None:
+                self._refresh(shard, records)
+        loop = asyncio.get_running_loop()
+        for process, connection in zip(self._processes, self._connections):
+            await loop.run_in_executor(None, process.join, 5)
+            if process.is_alive():
+                process.terminate()
+            connection.close()
+        self._processes.clear()
+        self._connections.clear()
+        self._locks.clear()
+        self._routes.clear()
+        logger.info("Scheduler was stopped!")
+
+    async def get_tasks(self, *tags: str) -> List[ShardedTask]:
+        """
+        returns snapshots of the tasks of all shards matching the given `tags`.
+        if no tags are defined, all tasks are returned.
+        """
+        if not self.is_running:
+            return [
+                ShardedTask(self, None, record)
+                for record in self._records.values()
+                if _matching(record, tags)
+            ]
+        await self._wait_for_moves()
+        found = []
+        for shard, records in await self._request_all("get", tags):
+            if records is None:
+                continue
+            if tags:
+                for record in records:
+                    self._records[record["id"]] = record
+            else:
+                self._refresh(shard, records)
+            found.extend(ShardedTask(self, shard, record) for record in records)
+        return found
+
+    def cancel_task(
+        self, task: Union[tasks.ScheduledTask, ShardedTask]
+    ) -> Optional[ShardedTask]:
+        """
+        cancel a task in its shard without waiting for the shard.
+        returns the latest known snapshot of the task or None if it's not pending anymore
+        """
+        record = self._records.pop(task.id, None)
+        shard = self._routes.pop(task.id, None)
+        if record is None:
+            return None
+        if shard is None or not self.is_running:
+            return ShardedTask(self, None, record)
+        self._send(shard, ("remove", [task.id]))
+        return ShardedTask(self, shard, record)
+
+    async def cancel_tasks(self, *tags: str) -> List[ShardedTask]:
+        """
+        cancel all tasks of all shards matching the given `tags` at once
+        and wait until their running executions are stopped.
+        if no tags are defined, all tasks are cancelled.
+        """
+        if not self.is_running:
+            cancelled = []
+            for id, record in list(self._records.items()):
+                if _matching(record, tags):
+                    del self._records[id]
+                    cancelled.append(ShardedTask(self, None, record))
+            return cancelled
+
+        await self._wait_for_moves()
+        cancelled = []
+        for shard, records in await self._request_all("cancel", tags):
+            for record in records or ():
+                self._records.pop(record["id"], None)
+                self._routes.pop(record["id"], None)
+                cancelled.append(ShardedTask(self, shard, record))
+        return cancelled
+
+    async def cancel_all(self) -> List[ShardedTask]:
+        """cancel all tasks of all shards"""
+        return await self.cancel_tasks()
+
+    def _route(self, id: str, tags: List[str]) -> int:
+        """the shard of a task"""
+        key = tags[0] if self.partition == "tag" and tags else id
+        return zlib.crc32(key.encode()) % self.shards
+
+    def _add_tasks(self, new_tasks: List[tasks.ScheduledTask]) -> None:
+        records = []
+        for task in new_tasks:
+            record = jobstore.dump(task)
+            # fail early if a task cannot be sent
+            try:
+                pickle.dumps(record)
+            except Exception as e:
+                raise ValueError(f"cannot send {task} to a shard") from e
+            records.append(record)
+        for record in records:
+            self._records[record["id"]] = record
+        if self.is_running:
+            self._send_tasks(records)
+        logger.debug("Created %d tasks", len(records))
+
+    def _send_tasks(self, records: List[Dict[str, Any]]) -> None:
+        by_shard: Dict[int, List[Dict[str, Any]]] = {}
+        for record in records:
+            shard = self._route(record["id"], record["tags"])
+            self._routes[record["id"]] = shard
+            by_shard.setdefault(shard, []).append(record)
+        for shard, shard_records in by_shard.items():
+            self._send(shard, ("add", shard_records))
+
+    def _update_stored(self, task: tasks.ScheduledTask) -> None:
+        """send the changed tags of a task to its shard"""
+        record = self._records.get(task.id)
+        if record is None:
+            return
+        record["tags"] = list(task.tags)
+        shard = self._routes.get(task.id)
+        if shard is None:
+            return
+        if self._route(task.id, task.tags) == shard:
+            self._send(shard, ("tags", task.id, list(task.tags)))
+            return
+
+        # the first tag changed: the task moves to the shard of the new one
+        # with the state it has in the old one
+        del self._routes[task.id]
+        move = asyncio.get_running_loop().create_task(self._move(task.id, shard))
+        self._moves.add(move)
+        move.add_done_callback(self._moves.discard)
+
+    async def _move(self, id: str, shard: int) -> None:
+        records = await self._request(shard, "cancel_ids", [id])
+        record = self._records.get(id)
+        if record is None or not self.is_running:
+            # cancelled meanwhile
+            return
+        if records == []:
+            # a one time task which ran meanwhile
+            del self._records[id]
+            return
+        if records:
+            records[0]["tags"] = record["tags"]
+            record = self._records[id] = records[0]
+        self._send_tasks([record])
+
+    async def _wait_for_moves(self) -> None:
+        """wait until the moving tasks arrived in their new shards"""
+        if self._moves:
+            await asyncio.gather(*list(self._moves), return_exceptions=True)
+
+    def _refresh(self, shard: int, records: List[Dict[str, Any]]) -> None:
+        """replace the records of the tasks of `shard` by its reply to a request for all"""
+        ids = {record["id"] for record in records}
+        for id, routed in list(self._routes.items()):
+            if routed == shard and id not in ids:
+                # finished meanwhile
+                del self._routes[id]
+                self._records.pop(id, None)
+        for record in records:
+            self._records[record["id"]] = record
+
+    def _spawn(self, shard: int) -> None:
+        """start the worker process of `shard`"""
+        connection, child = self._context.Pipe()
+        process = self._context.Process(
+            target=_work,
+            args=(child, self.options),
+            name=f"swisscore_scheduler_shard_{shard}",
+            daemon=True,
+        )
+        process.start()
+        child.close()
+        self._processes[shard] = process
+        self._connections[shard] = connection
+
+    def _restart(self, shard: int) -> None:
+        """restart a shard which died and send it its tasks again"""
+        logger.error("Shard %d died, restarting it", shard)
+        process = self._processes[shard]
+        if process.is_alive():
+            process.terminate()
+        self._connections[shard].close()
+        self._spawn(shard)
+        records = [self._records[id] for id, s in self._routes.items() if s == shard]
+        if records:
+            self._connections[shard].send(("add", records))
+
+    def _send(self, shard: int, command: Tuple[Any, ...]) -> None:
+        """send a command without a reply, restarting the shard if it died"""
+        try:
+            self._connections[shard].send(command)
+        except OSError:
+            # the tasks of the command are sent again with the other tasks of the shard
+            self._restart(shard)
+
+    async def _request(self, shard: int, *command: Any) -> Any:
+        """
+        send `command` to `shard` and wait for the reply in a thread.
+        if the shard died, it's restarted and asked again.
+        returns None if it doesn't reply
+        """
+        loop = asyncio.get_running_loop()
+        async with self._locks[shard]:
+            for attempt in range(2):
+                if not self._processes[shard].is_alive():
+                    self._restart(shard)
+                connection = self._connections[shard]
+                try:
+                    connection.send(command)
+                    return await loop.run_in_executor(None, connection.recv)
+                except (OSError, EOFError):
+                    if attempt:
+                        break
+                    self._restart(shard)
+        logger.error("Shard %d is not responding", shard)
+        return None
+
+    async def _request_all(self, *command: Any) -> List[Tuple[int, Any]]:
+        """send `command` to all shards at once and returns their replies"""
+        replies = await asyncio.gather(
+            *(self._request(shard, *command) for shard in range(self.shards))
+        )
+        return list(enumerate(replies))
+
+
+def _matching(record: Dict[str, Any], tags: Tuple[str, ...]) -> bool:
+    return all(tag in record["tags"] for tag in tags)
+
+
+def _snapshot(task: tasks.ScheduledTask) -> Dict[str, Any]:
+    """the record of a task which can be sent back"""
+    record = jobstore.dump(task)
+    if record["last_run"] is not None:
+        try:
+            pickle.dumps(record["last_run"])
+        except Exception:
+            record["last_run"] = jobstore.without_result(record["last_run"])
+    return record
+
+
+def _work(connection: Connection, options: Dict[str, Any]) -> None:
+    """the main function of a worker process"""
+    try:
+        asyncio.run(_serve(connection, options))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _serve(connection: Connection, options: Dict[str, Any]) -> None:
+    """runs the scheduler of a shard and executes the commands of the `ShardedScheduler`"""
+    shard = scheduler.AsyncScheduler(**options)
+    shard.start_concurrently()
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            command, *args = await loop.run_in_executor(None, connection.recv)
+        except EOFError:
+            # the `ShardedScheduler` is gone
+            shard.stop()
+            return
+
+        if command == "add":
+            with shard.batch():
+                for record in args[0]:
+                    if record["id"] in shard._tasks:
+                        continue
+                    try:
+                        jobstore.restore(shard, record)
+                    except Exception:
+                        logger.exception("Cannot restore the task %s:", record["id"])
+
+        elif command == "remove":
+            shard._cancel([shard._tasks[id] for id in args[0] if id in shard._tasks])
+
+        elif command == "tags":
+            id, tags = args
+            task = shard._tasks.get(id)
+            if task is not None:
+                task.remove_tags(*(tag for tag in task.tags if tag not in tags))
+                task.add_tags(*tags)
+
+        elif command == "get":
+            connection.send([_snapshot(t) for t in shard.get_tasks(*args[0])])
+
+        elif command in ("cancel", "cancel_ids"):
+            if command == "cancel":
+                cancelled = shard.get_tasks(*args[0])
+            else:
+                cancelled = [shard._tasks[id] for id in args[0] if id in shard._tasks]
+            records = [_snapshot(t) for t in cancelled]
+            _, running = shard._cancel(cancelled)
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+            connection.send(records)
+
+        elif command == "stop":
+            records = [_snapshot(t) for t in shard.tasks]
+            shard.stop()
+            connection.send(records)
+            return
@@ -1,28 +1,72 @@
 from __future__ import annotations
 
 import asyncio
+import itertools
+import logging
+import random
+import zlib
+from collections import deque
+from concurrent.futures import Executor
 from time import perf_counter
 from datetime import datetime, timedelta
-from typing import Awaitable, Dict, List, Optional, Any, Callable, Tuple, Union
-
-from . import creation_helper, scheduler, utils
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+from uuid import uuid4
+
+from . import creation_helper, crontab, scheduler, utils
 from . import logger
 
 
+# placeholder for a next run which is not calculated yet
+PENDING: Any = object()
+
+# orders the runs in the queue of the scheduler with the same priority and due time
+_sequence = itertools.count()
+
+
 class TaskResult:
     """the result of a task"""
 
+    __slots__ = (
+        "_succeed",
+        "_result",
+        "_datetime",
+        "_duration",
+        "_coalesced",
+        "_queued",
+        "_traceback",
+        "_timed_out",
+    )
+
     def __init__(
         self,
         succeed: bool,
         result: Union[Any, Exception, None],
         run_time: datetime,
         duration: float,
+        coalesced: int = 0,
+        queued: float = 0.0,
+        traceback: Optional[str] = None,
+        timed_out: bool = False,
     ) -> None:
         self._succeed: bool = succeed
         self._result: Union[Any, Exception, None] = result
         self._datetime: datetime = run_time
         self._duration: float = duration
+        self._coalesced: int = coalesced
+        self._queued: float = queued
+        self._traceback: Optional[str] = traceback
+        self._timed_out: bool = timed_out
 
     @property
     def succeed(self) -> bool:
@@ -33,7 +77,8 @@ class TaskResult:
     def result(self) -> Union[Any, Exception, None]:
         """
         returns the last returned result of the scheduled function.
-        if an exception was raised, the exception is returned.
+        if an exception was raised, the exception is returned (without its traceback).
+        None if the task doesn't keep its results.
         """
         return self._result
 
@@ -47,28 +92,69 @@ class TaskResult:
         """the duration of the last run in seconds. measured using `time.perf_counter`"""
         return self._duration
 
+    @property
+    def coalesced(self) -> int:
+        """the number of missed runs which were merged into this run"""
+        return self._coalesced
+
+    @property
+    def queued(self) -> float:
+        """seconds the run waited for the concurrency limit of the scheduler"""
+        return self._queued
+
+    @property
+    def traceback(self) -> Optional[str]:
+        """the formatted traceback if an exception was raised"""
+        return self._traceback
+
+    @property
+    def timed_out(self) -> bool:
+        """True if the run was cancelled because it exceeded its timeout"""
+        return self._timed_out
+
     def __bool__(self) -> bool:
         return self._succeed
 
     def __repr__(self) -> str:
-        d = {"ok": self.ok, "result": self.result, "run_duration": self.run_duration}
+        d = {"succeed": self.succeed, "result": self.result, "duration": self.duration}
         return f"{self.__class__.__name__}: {d}"
 
 
 class CancelledTask:
     """a cancelled task"""
 
+    __slots__ = (
+        "type",
+        "tags",
+        "last_run",
+        "history",
+        "total_runs",
+        "func",
+        "args",
+        "kwargs",
+        "_funcstr_cache",
+    )
+
     def __init__(self, task: ScheduledTask) -> None:
         self.type: creation_helper.TaskType = task.type
         self.tags: List[str] = task.tags
         self.last_run: Optional[TaskResult] = task.last_run
+        self.history: List[TaskResult] = task.history
         self.total_runs: int = task.previous_runs
 
         self.func: Callable = task.func
         self.args: Tuple[Any] = task.args
         self.kwargs: Dict[str, Any] = task.kwargs
 
-        self._funcstr = task._funcstr
+        self._funcstr_cache: Optional[str] = task._funcstr_cache
+
+    @property
+    def _funcstr(self) -> str:
+        if self._funcstr_cache is None:
+            self._funcstr_cache = utils.function_str(
+                self.func, *self.args, **self.kwargs
+            )
+        return self._funcstr_cache
 
     def __repr__(self):
         d = {
@@ -84,12 +170,57 @@ class CancelledTask:
 class ScheduledTask:
     """a scheduled task"""
 
+    __slots__ = (
+        "_scheduler",
+        "id",
+        "type",
+        "at_time",
+        "at_date",
+        "interval",
+        "tags",
+        "fixed_datetime",
+        "fixed_month",
+        "fixed_month_day",
+        "fixed_weekday",
+        "cron",
+        "func",
+        "args",
+        "kwargs",
+        "executor",
+        "max_instances",
+        "coalesce",
+        "misfire_grace_time",
+        "misfire_policy",
+        "jitter",
+        "spread",
+        "keep_result",
+        "timeout",
+        "priority",
+        "_history",
+        "_funcstr_cache",
+        "_previous_runs",
+        "_anchor",
+        "_slot",
+        "_spread_offset",
+        "_offset",
+        "_next_run",
+        "_last_run",
+        "_task",
+        "_entry",
+        "_instances",
+        "_missed",
+        "_running",
+        "_queued",
+        "_missed_runs",
+        "_catch_up",
+    )
+
     def __init__(
         self,
         scheduler: scheduler.AsyncScheduler,
-        type: str,
-        at_time: list[int],
-        at_date: list[int],
+        type: creation_helper.TaskType,
+        at_time: Sequence[int],
+        at_date: Sequence[int],
         interval: int,
         tags: Optional[list[str]],
         fixed_datetime: Optional[datetime],
@@ -99,11 +230,26 @@ class ScheduledTask:
         func: Callable,
         args: Tuple[Any],
         kwargs: Dict[str, Any],
+        *,
+        executor: Union[str, Executor, None] = None,
+        max_instances: int = 1,
+        coalesce: bool = False,
+        misfire_grace_time: Optional[float] = None,
+        misfire_policy: str = "run_once",
+        jitter: Optional[float] = None,
+        spread: Optional[float] = None,
+        keep_result: bool = True,
+        history: int = 0,
+        timeout: Optional[float] = None,
+        priority: int = 0,
+        cron: Optional[str] = None,
+        id: Optional[str] = None,
     ) -> None:
         self._scheduler: scheduler.AsyncScheduler = scheduler
-        self.type: str = type
-        self.at_time: list[int] = at_time
-        self.at_date: list[int] = at_date
+        self.id: str = id or uuid4().hex
+        self.type: creation_helper.TaskType = type
+        self.at_time: Tuple[int, ...] = tuple(at_time)
+        self.at_date: Tuple[int, ...] = tuple(at_date)
         self.interval: int = interval
 
         self.tags: Optional[List[str]] = tags
@@ -112,26 +258,66 @@ class ScheduledTask:
         self.fixed_month: Optional[int] = fixed_month
         self.fixed_month_day: Optional[int] = fixed_month_day
         self.fixed_weekday: Optional[int] = fixed_weekday
+        # the expression of a cron task
+        self.cron: Optional[str] = cron
 
         self.func: Callable = func
         self.args: Tuple[Any] = args
         self.kwargs: Dict[str, Any] = kwargs
-
-        self._funcstr = utils.function_str(func, *args, **kwargs)
+        self.executor: Union[str, Executor, None] = executor
+        self.max_instances: int = max_instances
+        self.coalesce: bool = coalesce
+        self.misfire_grace_time: Optional[float] = misfire_grace_time
+        self.misfire_policy: str = misfire_policy
+        self.jitter: Optional[float] = jitter
+        self.spread: Optional[float] = spread
+        self.keep_result: bool = keep_result
+        # None falls back to the timeout of the scheduler
+        self.timeout: Optional[float] = timeout
+        # runs due at the same time start in the order of their priority, the highest first
+        self.priority: int = priority
+        # the last `history` results, if any
+        self._history: Optional[deque] = deque(maxlen=history) if history else None
+
+        # formatted on demand, see `_funcstr`
+        self._funcstr_cache: Optional[str] = None
 
         self._previous_runs = 0
-        self._next_run: datetime = (
-            self.fixed_datetime
-            if self.fixed_datetime
-            else self._calculate_next_run(datetime.now())
-        )
+        # interval tasks run at a fixed rate on the monotonic clock:
+        # the n-th run is due at `_anchor + n * interval`
+        self._anchor: Optional[float] = None
+        self._slot: int = 0
+        if self.type is creation_helper.TaskType.secondly:
+            self._anchor = self._scheduler.clock.monotonic()
+            self._slot = 1
+        # calendar runs are delayed by `_offset` seconds: the offset of `spread`
+        # which is derived from the id and stays the same, plus a random `jitter`
+        self._spread_offset: float = 0.0
+        if spread:
+            self._spread_offset = zlib.crc32(self.id.encode()) / 2**32 * spread
+        self._offset: float = 0.0
+        self._draw_offset()
+        # the next runs of tasks created before the scheduler is started
+        # (or within a batch) are calculated in bulk later on
+        self._next_run: Optional[datetime] = self.fixed_datetime or PENDING
         self._last_run: Optional[TaskResult] = None
         self._task: Optional[asyncio.Task] = None
-
-        self._scheduler._append_task(self)
-
-        if self._scheduler.is_running:
-            self._task = asyncio.get_running_loop().create_task(self._run())
+        self._entry: Optional[list] = None
+        # running executions if overlapping runs are allowed or the runs are queued
+        self._instances: Union[Set[asyncio.Task], Tuple[()]] = (
+            set() if max_instances > 1 or self._scheduler.workers else ()
+        )
+        # missed runs waiting to be coalesced into the next run
+        self._missed: int = 0
+        self._running: int = 0
+        # runs waiting in the queue of the scheduler
+        self._queued: int = 0
+        # runs which were due but skipped
+        self._missed_runs: int = 0
+        # the next run follows the current one even if it's overdue
+        self._catch_up: bool = False
+
+        self._scheduler._add_task(self)
 
     def __repr__(self):
         d = {
@@ -141,11 +327,25 @@ class ScheduledTask:
         }
         return f"{self.__class__.__name__}: {d}"
 
+    @property
+    def _funcstr(self) -> str:
+        """a short description of the scheduled call"""
+        if self._funcstr_cache is None:
+            self._funcstr_cache = utils.function_str(
+                self.func, *self.args, **self.kwargs
+            )
+        return self._funcstr_cache
+
     @property
     def last_run(self) -> Optional[TaskResult]:
         """result of the last previous run"""
         return self._last_run
 
+    @property
+    def history(self) -> List[TaskResult]:
+        """the kept results of the previous runs, the oldest first"""
+        return list(self._history) if self._history is not None else []
+
     @property
     def previous_runs(self) -> int:
         """the total number of prevoius runs"""
@@ -154,16 +354,47 @@ class ScheduledTask:
     @property
     def next_run(self) -> Optional[datetime]:
         """datetime of the next run"""
+        if self._next_run is PENDING:
+            self._next_run = self._calculate_next_run(self._scheduler.clock.now())
         return self._next_run
 
     @property
     def wait_time(self) -> Optional[float]:
         """seconds until the next run"""
         if self.next_run:
-            delta = self.next_run.timestamp() - datetime.now().timestamp()
-            if self.last_run:
-                delta -= self.last_run.duration
-            return delta
+            if self._missed and self.max_instances == 1 and not self._scheduler.workers:
+                # a coalesced run is due immediately
+                return 0
+            return self._time_to_next_run()
+
+    @property
+    def running(self) -> int:
+        """the number of currently running executions"""
+        return self._running
+
+    @property
+    def missed_runs(self) -> int:
+        """
+        the total number of skipped runs.
+        runs are skipped if they misfired or were due while the previous run was running
+        """
+        return self._missed_runs
+
+    def _time_to_next_run(self) -> float:
+        """seconds until the next scheduled run, ignoring coalesced runs"""
+        clock = self._scheduler.clock
+        if self._anchor is not None:
+            return self._anchor + self._slot * self.interval - clock.monotonic()
+        return (
+            self.next_run.timestamp() - clock.now().timestamp() + self._offset
+        )
+
+    def _draw_offset(self) -> None:
+        """the offset of the next calendar run"""
+        self._offset = self._spread_offset
+        if self.jitter:
+            # below `jitter`, so a run never reaches the next one
+            self._offset += random.random() * self.jitter
 
     @property
     def timedelta(self) -> Optional[timedelta]:
@@ -180,7 +411,9 @@ class ScheduledTask:
             for tag in tags:
                 if not tag in self.tags:
                     self.tags.append(tag)
-            logger.debug(f"Updated tags of {self}")
+            self._scheduler._index_tags(self, *tags)
+            self._scheduler._update_stored(self)
+            logger.debug("Updated tags of %s", self)
         return self
 
     def remove_tags(self, *tags: str) -> ScheduledTask:
@@ -189,62 +422,179 @@ class ScheduledTask:
             for tag in tags:
                 if tag in self.tags:
                     self.tags.remove(tag)
-            logger.debug(f"Updated tags of {self}")
+            self._scheduler._unindex_tags(self, *tags)
+            self._scheduler._update_stored(self)
+            logger.debug("Updated tags of %s", self)
         return self
 
     def matching_tags(self, *tags) -> bool:
         """check if tags matching"""
         return all([tag in self.tags for tag in tags])
 
+    def _update_next_run(self, now: datetime) -> None:
+        """
+        schedule the run following the current one.
+        runs missed while the current one was running are skipped,
+        or coalesced into a single run if `coalesce` is True.
+        """
+        last_run = self._last_run
+        if (
+            last_run is not None
+            and last_run.coalesced
+            and self._time_to_next_run() > 0
+        ):
+            # a coalesced run happened before the next one was due
+            return
+
+        if self._catch_up:
+            # the "run_all" policy runs the overdue runs one after another
+            if self._anchor is not None:
+                self._slot += 1
+                self._next_run = now + timedelta(seconds=self._time_to_next_run())
+            else:
+                self._next_run = self._calculate_next_run(self._next_run)
+                self._draw_offset()
+            self._catch_up = self._time_to_next_run() <= 0
+            return
+
+        missed = 0
+        if self._anchor is not None:
+            elapsed = self._scheduler.clock.monotonic() - self._anchor
+            slot = max(self._slot + 1, int(elapsed // self.interval) + 1)
+            missed = slot - self._slot - 1
+            self._slot = slot
+            self._next_run = now + timedelta(seconds=self._time_to_next_run())
+        else:
+            # calendar tasks are resolved from the wall clock.
+            # starting at the current run keeps them aligned even if it finished early
+            self._draw_offset()
+            # a run is only missed once its offset passed as well
+            due = now - timedelta(seconds=self._offset)
+            next_run = self._calculate_next_run(self._next_run)
+            while next_run <= due:
+                missed += 1
+                next_run = self._calculate_next_run(next_run)
+            self._next_run = next_run
+
+        if self.coalesce:
+            self._missed += missed
+        else:
+            self._missed_runs += missed
+
+    def _misfired(self) -> bool:
+        """
+        applies the misfire policy if the run which is due now is
+        more than `misfire_grace_time` seconds late.
+        returns True if the run has to be skipped
+        """
+        if self.misfire_grace_time is None or self._missed:
+            return False
+        lateness = -self._time_to_next_run()
+        if lateness <= self.misfire_grace_time:
+            return False
+
+        logger.warning("Run of %s misfired by %.3f seconds", self, lateness)
+        if self.misfire_policy == "run_all":
+            self._catch_up = True
+            return False
+        if self.type is creation_helper.TaskType.one_time:
+            if self.misfire_policy == "skip":
+                self._missed_runs += 1
+                return True
+            return False
+
+        now = self._scheduler.clock.now()
+        skipped = self._skip_overdue(now)
+        if self.misfire_policy == "run_once":
+            # the current run stands in for the skipped ones
+            if self.coalesce:
+                self._missed += skipped
+            else:
+                self._missed_runs += skipped
+            return False
+
+        self._missed_runs += skipped + 1
+        self._update_next_run(now)
+        return True
+
+    def _skip_overdue(self, now: datetime) -> int:
+        """
+        moves the next run to the latest run which is due at `now`.
+        returns the number of skipped runs
+        """
+        if self._anchor is not None:
+            elapsed = self._scheduler.clock.monotonic() - self._anchor
+            slot = max(self._slot, int(elapsed // self.interval))
+            skipped = slot - self._slot
+            self._slot = slot
+            self._next_run = now + timedelta(seconds=self._time_to_next_run())
+            return skipped
+
+        skipped = 0
+        due = now - timedelta(seconds=self._offset)
+        next_run = self._calculate_next_run(self._next_run)
+        while next_run <= due:
+            skipped += 1
+            self._next_run = next_run
+            next_run = self._calculate_next_run(next_run)
+        return skipped
+
     def _calculate_next_run(self, now: datetime) -> datetime:
-        at = [*self.at_date, *self.at_time, now.microsecond]
+        at = self.at_date + self.at_time
 
-        if self.type == creation_helper.TaskType.secondly:
+        if self.type is creation_helper.TaskType.secondly:
             return now + timedelta(seconds=self.interval)
 
-        if self.type == creation_helper.TaskType.minutely:
+        if self.type is creation_helper.TaskType.minutely:
             then = datetime(now.year, now.month, now.day, now.hour, now.minute, *at)
             # print(now, then)
             return then if then > now else (then + timedelta(minutes=self.interval))
 
-        if self.type == creation_helper.TaskType.hourly:
+        if self.type is creation_helper.TaskType.hourly:
             then = datetime(now.year, now.month, now.day, now.hour, *at)
             return then if then > now else (then + timedelta(hours=self.interval))
 
-        if self.type == creation_helper.TaskType.daily:
+        if self.type is creation_helper.TaskType.daily:
             then = datetime(now.year, now.month, now.day, *at)
             return then if then > now else (then + timedelta(days=self.interval))
 
-        if self.type == creation_helper.TaskType.weekly:
+        if self.type is creation_helper.TaskType.weekly:
             delta_days = (self.fixed_weekday - now.weekday()) % 7
             then = datetime(now.year, now.month, now.day, *at) + timedelta(
                 days=delta_days
             )
             return then if then > now else (then + timedelta(days=7))
 
-        if self.type == creation_helper.TaskType.monthly:
+        if self.type is creation_helper.TaskType.monthly:
             day = self.fixed_month_day or at[0]
-            target_month = now.month
-            delta_year = 0
-            while not utils.day_in_month_range(
-                day, target_month, now.year + delta_year
-            ):
-                target_month = (target_month % 12) + 1
-                delta_year = 0 if target_month > now.month else 1
-            then = datetime(now.year + delta_year, target_month, *at)
-            if then < now:
-                target_month = (target_month % 12) + 1
-                while not utils.day_in_month_range(
-                    day, target_month, now.year + delta_year
-                ):
-                    target_month = (target_month % 12) + 1
-                    delta_year += 0 if target_month > now.month else 1
-                then = datetime(now.year + delta_year, target_month, *at)
-            return then
-
-        if self.type == creation_helper.TaskType.yearly:
-            then = datetime(now.year, *at)
-            return then if then > now else datetime(now.year + 1, *at)
+            year, month = now.year, now.month
+            while 1:
+                # skip the months which are too short
+                if utils.day_in_month_range(day, month, year):
+                    then = datetime(year, month, *at)
+                    if then > now:
+                        return then
+                year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+        if self.type is creation_helper.TaskType.yearly:
+            year = now.year
+            while 1:
+                # february 29 only exists in leap years
+                if utils.day_in_month_range(at[1], at[0], year):
+                    then = datetime(year, *at)
+                    if then > now:
+                        return then
+                year += 1
+
+        if self.type is creation_helper.TaskType.cron:
+            # compiled once per distinct expression
+            return crontab.parse(self.cron).next_run(now)
+
+    def _store_state(self) -> None:
+        """hand the changed state over to the store of the scheduler, if any"""
+        store = self._scheduler.store
+        if store is not None:
+            store.update([self])
 
     async def _wait(self) -> bool:
         """
@@ -252,49 +602,260 @@ class ScheduledTask:
         returns False if the task was cancelled during wait time else True
         """
         try:
-            await asyncio.sleep(self.wait_time)
+            # sleep again if the wall clock was set back meanwhile
+            wait_time = self.wait_time
+            while wait_time is not None and wait_time > 0:
+                await self._scheduler.clock.sleep(wait_time)
+                wait_time = self.wait_time
 
         except asyncio.CancelledError:
             return False
 
-        return True
+        return self._next_run is not None
 
     async def _run(self) -> None:
-        should_run = await self._wait()
-        if not should_run:
+        while await self._wait():
+            if self._scheduler._prioritized:
+                await self._scheduler._take_turn(self)
+            if not await self._fire():
+                return
+
+    async def _dispatch(self) -> None:
+        """fires a single run and hands the next one back to the dispatcher"""
+        try:
+            if await self._fire():
+                self._scheduler._dispatcher.push(self)
+        finally:
+            if self._task is asyncio.current_task():
+                self._task = None
+
+    async def _fire(self) -> bool:
+        """
+        starts the run which is due now.
+        returns True if the task has to run again else False
+        """
+        leader = self._scheduler.leader
+        if leader is not None and not leader.is_leader:
+            # the run is executed by the leader, which also keeps the store up to date
+            if self.type is creation_helper.TaskType.one_time:
+                # done here, but the leader keeps its record in the store
+                self._scheduler._cancel([self], keep_stored=True)
+                return False
+            self._update_next_run(self._scheduler.clock.now())
+            return True
+
+        if self._misfired():
+            if self.type is creation_helper.TaskType.one_time:
+                self.cancel()
+                return False
+            self._store_state()
+            return True
+
+        lateness = max(-self._time_to_next_run(), 0.0)
+        if self._scheduler.workers:
+            await self._enqueue(lateness)
+            if self.type is creation_helper.TaskType.one_time:
+                return False
+            self._update_next_run(self._scheduler.clock.now())
+            self._store_state()
+            return True
+
+        if self.max_instances == 1 or self.type is creation_helper.TaskType.one_time:
+            return await self._execute(lateness)
+
+        # overlapping runs: start an instance and schedule the next run right away
+        if len(self._instances) < self.max_instances:
+            self._start_instance(lateness)
+        elif self.coalesce:
+            self._missed += 1
+        else:
+            self._missed_runs += 1
+        self._update_next_run(self._scheduler.clock.now())
+        self._store_state()
+        return True
+
+    async def _enqueue(self, lateness: float) -> None:
+        """
+        hands the run which is due now over to the workers of the scheduler.
+        waits while the queue is full
+        """
+        if self._queued + self._running >= self.max_instances:
+            # the previous runs are not finished yet
+            if self.coalesce:
+                self._missed += 1
+            else:
+                self._missed_runs += 1
+            return
+        self._queued += 1
+        due = self._scheduler.clock.monotonic() - lateness
+        try:
+            await self._scheduler._queue.put(
+                (-self.priority, due, next(_sequence), self)
+            )
+        except asyncio.CancelledError:
+            self._queued -= 1
+            raise
+
+    async def _execute_queued(self, lateness: float) -> None:
+        """executes a run taken from the queue of the scheduler"""
+        if not await self._call(lateness):
+            return
+        if self.type is creation_helper.TaskType.one_time:
+            self.cancel()
+        await self._scheduler._run_callback(self)
+        if self._missed and self._next_run is not None:
+            # the coalesced runs follow right away
+            await self._enqueue(0.0)
+
+    def _start_instance(self, lateness: float = 0.0) -> None:
+        instance = asyncio.get_running_loop().create_task(
+            self._execute_instance(lateness)
+        )
+        self._instances.add(instance)
+        instance.add_done_callback(self._instances.discard)
+
+    async def _execute_instance(self, lateness: float) -> None:
+        """executes one of possibly overlapping runs"""
+        if not await self._call(lateness):
             return
+        await self._scheduler._run_callback(self)
+        if self._missed and self._next_run is not None:
+            self._instances.discard(asyncio.current_task())
+            self._start_instance()
 
+    async def _execute(self, lateness: float) -> bool:
+        """
+        executes the scheduled function once and schedules the next run.
+        returns True if the task has to run again else False
+        """
+        cancelled = not await self._call(lateness)
+        if cancelled or self.type is creation_helper.TaskType.one_time:
+            self._next_run = None
+            if not cancelled:
+                self.cancel()
+                await self._scheduler._run_callback(self)
+            return False
+
+        self._update_next_run(self._last_run.datetime)
+        self._store_state()
+        await self._scheduler._run_callback(self)
+        # the callback may have cancelled this task
+        return self._next_run is not None
+
+    async def _call(self, lateness: float = 0.0) -> bool:
+        """
+        calls the scheduled function and stores the `TaskResult`.
+        `lateness` is the number of seconds the run started after it was due.
+        returns False if the run was cancelled else True
+        """
         cancelled = False
         succeed = True
+        timed_out = False
         result = None
+        traceback = None
+        duration = None
+        timeout = self.timeout if self.timeout is not None else self._scheduler.timeout
+        queued = 0.0
+        coalesced, self._missed = self._missed, 0
+        semaphore = self._scheduler._semaphore
+        metrics = self._scheduler.metrics
+        watchdog = self._scheduler.watchdog
+        probe = None
+        acquired = False
+        self._running += 1
+        if metrics is not None:
+            metrics.running += 1
         start_time = perf_counter()
         try:
-            logger.debug(f"Running function: {self._funcstr}")
+            if semaphore is not None:
+                if metrics is not None:
+                    metrics.waiting += 1
+                try:
+                    await semaphore.acquire(self.priority)
+                finally:
+                    if metrics is not None:
+                        metrics.waiting -= 1
+                acquired = True
+                queued = perf_counter() - start_time
+                start_time = perf_counter()
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Running function: %s", self._funcstr)
             if asyncio.iscoroutinefunction(self.func) or isinstance(
                 self.func, Awaitable
             ):
-                result = await self.func(*self.args, **self.kwargs)
+                if timeout is None:
+                    if watchdog is not None:
+                        probe = watchdog.watch_run(self, asyncio.current_task())
+                    result = await self.func(*self.args, **self.kwargs)
+                else:
+                    # `wait_for` awaits the coroutine in a task of its own
+                    runner = asyncio.ensure_future(self.func(*self.args, **self.kwargs))
+                    if watchdog is not None:
+                        probe = watchdog.watch_run(self, runner)
+                    result = await asyncio.wait_for(runner, timeout)
             else:
-                result = self.func(*self.args, **self.kwargs)
+                executor = self._scheduler._get_executor(self.executor)
+                if executor is None:
+                    result = self.func(*self.args, **self.kwargs)
+                else:
+                    loop = asyncio.get_running_loop()
+                    future = loop.run_in_executor(
+                        executor, utils.timed_call, self.func, self.args, self.kwargs
+                    )
+                    if watchdog is not None:
+                        probe = watchdog.watch_run(self)
+                    if timeout is not None:
+                        # stops waiting, but a running thread cannot be stopped
+                        future = asyncio.wait_for(future, timeout)
+                    succeed, result, duration = await future
+                    if not succeed:
+                        raise result
 
         except asyncio.CancelledError:
             cancelled = True
 
         except Exception as e:
-            logger.exception("Caught Exception while running a scheduled Task:")
             succeed = False
             result = e
+            # the function may raise a `TimeoutError` on its own
+            timed_out = (
+                isinstance(e, asyncio.TimeoutError)
+                and timeout is not None
+                and perf_counter() - start_time >= timeout
+            )
+            if timed_out:
+                logger.error("Scheduled Task timed out after %ss: %s", timeout, self)
+            else:
+                logger.exception("Caught Exception while running a scheduled Task:")
+            traceback = utils.traceback_summary(e)
 
         finally:
+            if probe is not None:
+                probe.cancel()
+            self._running -= 1
+            if metrics is not None:
+                metrics.running -= 1
+            if acquired:
+                semaphore.release()
+
+        if duration is None:
             duration = perf_counter() - start_time
-            self._last_run = TaskResult(succeed, result, datetime.now(), duration)
-            self._previous_runs += 1
-            if cancelled or self.type == creation_helper.TaskType.one_time:
-                self._next_run = None
-                if not cancelled:
-                    self.cancel()
-                    await self._scheduler._run_callback(self)
-            else:
-                self._next_run = self._calculate_next_run(self._last_run.datetime)
-                await self._scheduler._run_callback(self)
-                await self._run()
+        self._last_run = TaskResult(
+            succeed,
+            result if self.keep_result else None,
+            self._scheduler.clock.now(),
+            duration,
+            coalesced,
+            queued,
+            traceback,
+            timed_out,
+        )
+        if self._history is not None:
+            self._history.append(self._last_run)
+        if metrics is not None and not cancelled:
+            metrics.observe(self, succeed, duration, lateness + queued)
+        if watchdog is not None and not cancelled:
+            watchdog.check_run(self, duration, probe)
+        self._previous_runs += 1
+        return not cancelled
@@ -1,5 +1,19 @@
+import reprlib
+import traceback
+from concurrent.futures import Executor
 from datetime import MAXYEAR, datetime, timedelta, time, date
-from typing import Callable, Optional
+from time import perf_counter
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+MISFIRE_POLICIES = ("skip", "run_once", "run_all")
+
+# the maximum length of the string returned by `function_str`
+FUNCTION_STR_LENGTH = 200
+
+# shortens large containers and strings without formatting all of their items
+_repr = reprlib.Repr()
+_repr.maxstring = 60
+_repr.maxother = 60
 
 
 def to_datetime(t) -> datetime:
@@ -14,12 +28,50 @@ def to_datetime(t) -> datetime:
 
 
 def function_str(func: Callable, *args, **kwargs) -> str:
-    args_str = ", ".join(f"{a.__repr__()}" for a in args)
+    """a short description of the call, at most `FUNCTION_STR_LENGTH` characters long"""
+    args_str = ", ".join(_repr.repr(a) for a in args)
     if kwargs:
         args_str += ", " + ", ".join(
-            [f"{k}={v.__repr__()}" for (k, v) in kwargs.items()]
+            [f"{k}={_repr.repr(v)}" for (k, v) in kwargs.items()]
         )
-    return f"{func.__name__}({args_str})"
+    name = getattr(func, "__name__", None) or _repr.repr(func)
+    result = f"{name}({args_str})"
+    if len(result) > FUNCTION_STR_LENGTH:
+        result = result[: FUNCTION_STR_LENGTH - 4] + "...)"
+    return result
+
+
+def traceback_summary(e: BaseException) -> str:
+    """
+    formats the traceback of `e` and detaches it (and the ones of chained exceptions),
+    so the exception does not keep the frames and their local variables alive.
+    """
+    summary = "".join(traceback.format_exception(e))
+    pending = [e]
+    seen = set()
+    while pending:
+        e = pending.pop()
+        if e is None or id(e) in seen:
+            continue
+        seen.add(id(e))
+        e.__traceback__ = None
+        pending += (e.__cause__, e.__context__)
+    return summary
+
+
+def timed_call(
+    func: Callable, args: Tuple[Any], kwargs: Dict[str, Any]
+) -> Tuple[bool, Any, float]:
+    """
+    calls `func` and measures the duration using `time.perf_counter`.
+    used to run functions in an executor, so the time spent in its queue is not measured.
+    returns (succeed, result or exception, duration)
+    """
+    start_time = perf_counter()
+    try:
+        return True, func(*args, **kwargs), perf_counter() - start_time
+    except Exception as e:
+        return False, e, perf_counter() - start_time
 
 
 def is_leap_year(year: int) -> bool:
@@ -118,3 +170,46 @@ def validate_time(
         raise TypeError(f"`second` must be an `int`")
     if not 0 <= second <= 59:
         raise ValueError(f"`second` must be in 0..59")
+
+
+def validate_misfire(grace_time: Optional[float], policy: str) -> None:
+    if grace_time is not None:
+        if not isinstance(grace_time, (int, float)):
+            raise TypeError("`misfire_grace_time` must be a number")
+        if grace_time < 0:
+            raise ValueError("`misfire_grace_time` cannot be negative")
+    if policy not in MISFIRE_POLICIES:
+        raise ValueError(f"`misfire_policy` must be one of {', '.join(MISFIRE_POLICIES)}")
+
+
+def validate_timeout(timeout: Optional[float]) -> None:
+    if timeout is None:
+        return
+    if not isinstance(timeout, (int, float)):
+        raise TypeError("`timeout` must be a number")
+    if timeout <= 0:
+        raise ValueError("`timeout` must be greater then zero")
+
+
+def validate_offset(
+    jitter: Optional[float], spread: Optional[float], period: int
+) -> None:
+    for name, seconds in (("jitter", jitter), ("spread", spread)):
+        if seconds is None:
+            continue
+        if not isinstance(seconds, (int, float)):
+            raise TypeError(f"`{name}` must be a number")
+        if seconds < 0:
+            raise ValueError(f"`{name}` cannot be negative")
+    # a delayed run must not reach the next one
+    if (jitter or 0) + (spread or 0) >= period:
+        raise ValueError(f"`jitter` + `spread` must be smaller then {period}")
+
+
+def validate_executor(executor: Union[str, Executor, None]) -> None:
+    if executor is None or isinstance(executor, Executor):
+        return
+    if not isinstance(executor, str):
+        raise TypeError("`executor` must be a `str` or a `concurrent.futures.Executor`")
+    if executor not in ("thread", "process"):
+        raise ValueError("`executor` must be 'thread' or 'process'")
@@ -0,0 +1,362 @@
+from __future__ import annotations
+
+import asyncio
+import inspect
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from typing import Any, Callable, List, Optional, Tuple, Union
+
+from . import logger, tasks, utils
+
+# a sampled stack as (filename, line number, function name) from the outermost frame
+Stack = Tuple[Tuple[str, int, str], ...]
+
+
+class Stall:
+    """the event loop was blocked for `duration` seconds"""
+
+    __slots__ = ("task", "duration", "samples")
+
+    def __init__(
+        self,
+        task: Optional[tasks.ScheduledTask],
+        duration: float,
+        samples: Counter,
+    ) -> None:
+        # the task which was running when the loop was blocked (None if unknown)
+        self.task: Optional[tasks.ScheduledTask] = task
+        self.duration: float = duration
+        # the stacks of the loop thread sampled while it was blocked, and how often
+        self.samples: Counter = samples
+
+    @property
+    def stack(self) -> Optional[Stack]:
+        """the most sampled stack"""
+        if not self.samples:
+            return None
+        return self.samples.most_common(1)[0][0]
+
+    def __str__(self) -> str:
+        culprit = f" by {self.task}" if self.task is not None else ""
+        text = f"Event loop was blocked for {self.duration:.3f}s{culprit}"
+        return text + _format_samples(self.samples)
+
+
+class SlowRun:
+    """a run of `task` took `duration` seconds"""
+
+    __slots__ = ("task", "duration", "samples")
+
+    def __init__(
+        self,
+        task: tasks.ScheduledTask,
+        duration: float,
+        samples: Optional[Counter] = None,
+    ) -> None:
+        self.task: tasks.ScheduledTask = task
+        self.duration: float = duration
+        # the stacks of the run sampled after it took longer than `slow_run`, and how often.
+        # empty if the run blocked the loop or ran in a process
+        self.samples: Counter = samples if samples is not None else Counter()
+
+    @property
+    def stack(self) -> Optional[Stack]:
+        """the most sampled stack"""
+        if not self.samples:
+            return None
+        return self.samples.most_common(1)[0][0]
+
+    def __str__(self) -> str:
+        return f"A run of {self.task} took {self.duration:.3f}s" + _format_samples(
+            self.samples
+        )
+
+
+class RunProbe:
+    """samples the stack of a run of `task` while it takes longer than `slow_run`"""
+
+    __slots__ = ("task", "runner", "samples", "_handle")
+
+    def __init__(
+        self, task: tasks.ScheduledTask, runner: Optional[asyncio.Task]
+    ) -> None:
+        self.task: tasks.ScheduledTask = task
+        # the asyncio task awaiting the coroutine, None for a function in an executor
+        self.runner: Optional[asyncio.Task] = runner
+        self.samples: Counter = Counter()
+        self._handle: Optional[asyncio.TimerHandle] = None
+
+    def cancel(self) -> None:
+        """stop sampling, the run is finished"""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+
+class Watchdog:
+    """
+    watches the event loop of an `AsyncScheduler`.
+
+    the loop is expected to respond every `interval` seconds. the time it responds
+    late is its lag. while it is blocked for more than `threshold` seconds,
+    a thread samples the stack of the loop every `sample_interval` seconds and
+    finds the task which is blocking it. the `Stall` is reported when the loop responds again.
+
+    if `slow_run` is set, a `SlowRun` is reported for every run taking longer.
+    once a coroutine or a function in a thread runs longer than `slow_run`,
+    its stack is sampled every `sample_interval` seconds, the samples are attached to the report.
+
+    reports are logged as warnings, or passed to `callback` (a function or coroutine) if given.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.1,
+        *,
+        interval: float = 0.05,
+        sample_interval: float = 0.005,
+        slow_run: Optional[float] = None,
+        callback: Optional[Callable[[Union[Stall, SlowRun]], Any]] = None,
+    ) -> None:
+        for name, value in (
+            ("threshold", threshold),
+            ("interval", interval),
+            ("sample_interval", sample_interval),
+            ("slow_run", slow_run),
+        ):
+            if value is None and name == "slow_run":
+                continue
+            if not isinstance(value, (int, float)):
+                raise TypeError(f"`{name}` must be a number")
+            if value <= 0:
+                raise ValueError(f"`{name}` must be greater then zero")
+        self.threshold: float = threshold
+        self.interval: float = interval
+        self.sample_interval: float = sample_interval
+        self.slow_run: Optional[float] = slow_run
+        self.callback: Optional[Callable[[Union[Stall, SlowRun]], Any]] = callback
+
+        # the lag of the last and the slowest response of the loop
+        self.lag: float = 0.0
+        self.max_lag: float = 0.0
+        self.stalls: int = 0
+
+        self._scheduler: Any = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped: threading.Event = threading.Event()
+        self._lock: threading.Lock = threading.Lock()
+        # monotonic time the loop is expected to respond
+        self._expected: float = 0.0
+        self._samples: Counter = Counter()
+        self._task: Optional[tasks.ScheduledTask] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, scheduler: Any) -> None:
+        """start watching the running event loop of `scheduler`"""
+        if self._thread is not None:
+            return
+        self._scheduler = scheduler
+        self._loop = asyncio.get_running_loop()
+        self._stopped.clear()
+        self._expected = time.monotonic() + self.interval
+        self._handle = self._loop.call_later(self.interval, self._beat)
+        self._thread = threading.Thread(
+            target=self._sample,
+            args=(threading.get_ident(),),
+            name="swisscore_scheduler_watchdog",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stopped.set()
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        self._loop = None
+
+    def _beat(self) -> None:
+        """called by the loop every `interval` seconds"""
+        now = time.monotonic()
+        lag = max(now - self._expected, 0.0)
+        self.lag = lag
+        if lag > self.max_lag:
+            self.max_lag = lag
+        metrics = self._scheduler.metrics
+        if metrics is not None:
+            metrics.loop_lag.observe(lag)
+
+        with self._lock:
+            samples, self._samples = self._samples, Counter()
+            task, self._task = self._task, None
+            self._expected = now + self.interval
+        if lag > self.threshold:
+            self.stalls += 1
+            self._report(Stall(task, lag, samples))
+        self._handle = self._loop.call_later(self.interval, self._beat)
+
+    def _sample(self, loop_thread: int) -> None:
+        """samples the stack of the loop thread while it is blocked"""
+        while not self._stopped.is_set():
+            # sleep until the loop is late, a responsive loop pushes `_expected` further
+            delay = self._expected + self.threshold - time.monotonic()
+            if delay > 0:
+                self._stopped.wait(delay)
+                continue
+            frame = sys._current_frames().get(loop_thread)
+            if frame is None:
+                self._stopped.wait(self.sample_interval)
+                continue
+            task, stack = _extract(frame)
+            with self._lock:
+                # the loop may have responded meanwhile
+                if time.monotonic() - self._expected > self.threshold:
+                    self._samples[stack] += 1
+                    if task is not None:
+                        self._task = task
+            del frame
+            self._stopped.wait(self.sample_interval)
+
+    def watch_run(
+        self, task: tasks.ScheduledTask, runner: Optional[asyncio.Task] = None
+    ) -> Optional[RunProbe]:
+        """
+        start sampling the run of `task` once it takes longer than `slow_run`.
+        `runner` is the asyncio task awaiting a coroutine,
+        None for a function running in an executor.
+        returns None if slow runs are not reported
+        """
+        if self.slow_run is None or self._thread is None:
+            return None
+        probe = RunProbe(task, runner)
+        probe._handle = self._loop.call_later(self.slow_run, self._sample_run, probe)
+        return probe
+
+    def _sample_run(self, probe: RunProbe) -> None:
+        """called by the loop every `sample_interval` seconds while a slow run is running"""
+        if probe.runner is not None:
+            stack = _coroutine_stack(probe.runner)
+        else:
+            stack = _thread_stack(probe.task)
+        if stack:
+            probe.samples[stack] += 1
+        probe._handle = self._loop.call_later(
+            self.sample_interval, self._sample_run, probe
+        )
+
+    def check_run(
+        self,
+        task: tasks.ScheduledTask,
+        duration: float,
+        probe: Optional[RunProbe] = None,
+    ) -> None:
+        """report the run of `task` if it was slow"""
+        if probe is not None:
+            probe.cancel()
+        if self.slow_run is not None and duration > self.slow_run:
+            self._report(SlowRun(task, duration, probe.samples if probe else None))
+
+    def _report(self, report: Union[Stall, SlowRun]) -> None:
+        if self.callback is None:
+            logger.warning(str(report))
+            return
+        try:
+            result = self.callback(report)
+            if inspect.isawaitable(result):
+                asyncio.ensure_future(result).add_done_callback(_log_exception)
+        except Exception:
+            logger.exception("Caught Exception while running a watchdog callback:")
+
+
+def _extract(frame: Any) -> Tuple[Optional[tasks.ScheduledTask], Stack]:
+    """
+    returns the task running in `frame` and the stack above its `_call`.
+    if no task is running, the whole stack is returned
+    """
+    call_code = tasks.ScheduledTask._call.__code__
+    task = None
+    frames: List[Tuple[str, int, str]] = []
+    while frame is not None:
+        code = frame.f_code
+        if code is call_code:
+            task = frame.f_locals.get("self")
+            break
+        frames.append((code.co_filename, frame.f_lineno, code.co_name))
+        frame = frame.f_back
+    frames.reverse()
+    return task, tuple(frames)
+
+
+def _coroutine_stack(runner: asyncio.Task) -> Stack:
+    """the stack of the scheduled coroutine awaited by `runner`, above its `_call`"""
+    call_code = tasks.ScheduledTask._call.__code__
+    frames: List[Tuple[str, int, str]] = []
+    # `get_stack()` only returns the outermost frame of a suspended task,
+    # so follow the chain of awaited coroutines.
+    # `_call` is missing if the coroutine is a task of its own
+    coro = runner.get_coro()
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        code = frame.f_code
+        if code is call_code:
+            frames.clear()
+        else:
+            frames.append((code.co_filename, frame.f_lineno, code.co_name))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return tuple(frames)
+
+
+def _thread_stack(task: tasks.ScheduledTask) -> Stack:
+    """the stack of the executor thread running the function of `task`, if any"""
+    call_code = utils.timed_call.__code__
+    for frame in sys._current_frames().values():
+        frames: List[Tuple[str, int, str]] = []
+        while frame is not None:
+            code = frame.f_code
+            if code is call_code:
+                if (
+                    frame.f_locals.get("func") is task.func
+                    and frame.f_locals.get("args") is task.args
+                ):
+                    frames.reverse()
+                    return tuple(frames)
+                break
+            frames.append((code.co_filename, frame.f_lineno, code.co_name))
+            frame = frame.f_back
+    return ()
+
+
+def _format_samples(samples: Counter) -> str:
+    if not samples:
+        return ""
+    stack, count = samples.most_common(1)[0]
+    total = sum(samples.values())
+    text = f"\nMost sampled stack ({count} of {total} samples):\n"
+    return text + "".join(traceback.format_list(_frame_summaries(stack)))
+
+
+def _frame_summaries(stack: Stack) -> List[traceback.FrameSummary]:
+    return [traceback.FrameSummary(file, line, name) for file, line, name in stack]
+
+
+def _log_exception(future: asyncio.Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(
+            "Caught Exception while running a watchdog callback:",
+            exc_info=future.exception(),
+        )
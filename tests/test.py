@@ -1,9 +1,24 @@
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
 
-from swisscore_scheduler import AsyncScheduler, TaskType, ScheduledTask
+from swisscore_scheduler import AsyncScheduler, TaskType, ScheduledTask, VirtualClock
+from swisscore_scheduler import MemoryJobStore, SQLiteJobStore
+from swisscore_scheduler import Watchdog, Stall, SlowRun
+from swisscore_scheduler import ShardedScheduler
+from swisscore_scheduler import LeaderElection, SQLiteLeaseStore
+from swisscore_scheduler import calculator, crontab, jobstore, metrics, tasks, utils
+from swisscore_scheduler import scheduler as scheduler_module
 
 logger = logging.getLogger("swisscore_scheduler")
 logger.setLevel(logging.CRITICAL)
@@ -17,6 +32,11 @@ async def coro(x=1):
     return 1 / x
 
 
+def blocking(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
 class TestTags(unittest.TestCase):
     def test_tags(self):
         scheduler = AsyncScheduler()
@@ -30,6 +50,30 @@ class TestTags(unittest.TestCase):
         self.assertTrue(t.matching_tags("A"))
         self.assertTrue(t.matching_tags("A", "B"))
 
+    def test_get_tasks(self):
+        scheduler = AsyncScheduler()
+
+        t1 = scheduler.each.second.run(func).add_tags("A", "B")
+        t2 = scheduler.each.second.run(func).add_tags("A")
+        t3 = scheduler.each.second.run(func).add_tags("C")
+
+        self.assertEqual(len(scheduler.get_tasks()), 3)
+        # in the order the tasks were created
+        self.assertEqual(scheduler.get_tasks("A"), [t1, t2])
+        self.assertEqual(scheduler.get_tasks("A", "B"), [t1])
+        self.assertEqual(scheduler.get_tasks("A", "C"), [])
+        self.assertEqual(scheduler.get_tasks("D"), [])
+
+        t1.remove_tags("A")
+        self.assertEqual(scheduler.get_tasks("A"), [t2])
+        self.assertEqual(scheduler.get_tasks("B"), [t1])
+
+        t2.cancel()
+        t2.add_tags("C")
+        self.assertEqual(scheduler.get_tasks("A"), [])
+        self.assertEqual(scheduler.get_tasks("C"), [t3])
+        self.assertNotIn("A", scheduler._tag_index)
+
 
 class TestPeriodic(unittest.TestCase):
     def test_secondly(self):
@@ -120,6 +164,170 @@ class TestPeriodicInterval(unittest.TestCase):
         self.assertEqual(t.next_run.minute, 30)
 
 
+class TestDrift(unittest.IsolatedAsyncioTestCase):
+    ticks = 10_000
+
+    async def test_interval_fixed_rate(self):
+        clock = VirtualClock()
+        scheduler = AsyncScheduler(clock=clock)
+        t = scheduler.every(3).seconds.run(func)
+        self.assertEqual(t.wait_time, 3)
+
+        for tick in range(1, self.ticks + 1):
+            deadline = clock.monotonic() + t.wait_time
+            self.assertAlmostEqual(deadline, tick * 3, delta=1e-9)
+            # fire late and run for a while, but never longer than the interval
+            await clock.advance(t.wait_time + random.uniform(0, 1) + 1)
+            t._update_next_run(clock.now())
+
+        self.assertAlmostEqual(clock.monotonic() + t.wait_time, 10_001 * 3, delta=1e-9)
+
+    async def test_interval_skips_overrun(self):
+        clock = VirtualClock()
+        scheduler = AsyncScheduler(clock=clock)
+        t = scheduler.every(2).seconds.run(func)
+        await clock.advance(2 + 5)
+        t._update_next_run(clock.now())
+        self.assertEqual(t.wait_time, 1)
+
+    def test_calendar_aligned(self):
+        scheduler = AsyncScheduler()
+        t = scheduler.every(2).minutes.at(30).run(func)
+        first = t.next_run
+        self.assertEqual(first.microsecond, 0)
+
+        for tick in range(1, self.ticks + 1):
+            # finishing a bit early or late must not shift the next run
+            finished = t.next_run + timedelta(seconds=random.uniform(-0.01, 5))
+            t._update_next_run(finished)
+            self.assertEqual(t.next_run, first + timedelta(minutes=2 * tick))
+
+
+class TestVirtualClock(unittest.IsolatedAsyncioTestCase):
+    async def simulate_year(self, use_dispatcher: bool):
+        clock = VirtualClock(datetime(2023, 1, 1))
+        scheduler = AsyncScheduler(use_dispatcher=use_dispatcher, clock=clock)
+        runs = {}
+
+        @scheduler.callback()
+        def callback(task: ScheduledTask):
+            runs.setdefault(task.type, []).append(task.last_run.datetime)
+
+        scheduler.each.day.at(12).run(func)
+        scheduler.every(6).hours.run(coro)
+        scheduler.each.monday.at(6, 30).run(func)
+        scheduler.each.month(31).run(func)
+        scheduler.each.february(29).run(func)
+        scheduler.each.december(24).at(18).run(func)
+        scheduler.after(days=100).run(func)
+
+        scheduler.start_concurrently()
+        await clock.advance_to(datetime(2025, 1, 1))
+        scheduler.stop()
+        return runs
+
+    async def test_simulate_year(self):
+        for use_dispatcher in (False, True):
+            runs = await self.simulate_year(use_dispatcher)
+            self.assertEqual(len(runs[TaskType.daily]), 731)
+            self.assertEqual(len(runs[TaskType.hourly]), 731 * 4)
+            self.assertEqual(len(runs[TaskType.weekly]), 52 + 53)
+            self.assertTrue(all(r.weekday() == 0 for r in runs[TaskType.weekly]))
+            self.assertEqual(len(runs[TaskType.monthly]), 7 * 2)
+            self.assertEqual(
+                runs[TaskType.yearly],
+                [
+                    datetime(2023, 12, 24, 18),
+                    datetime(2024, 2, 29),
+                    datetime(2024, 12, 24, 18),
+                ],
+            )
+            self.assertEqual(runs[TaskType.one_time], [datetime(2023, 4, 11)])
+
+    async def test_at_uses_clock(self):
+        clock = VirtualClock(datetime(2000, 1, 1))
+        scheduler = AsyncScheduler(clock=clock)
+        t = scheduler.at(datetime(2000, 1, 2)).run(func)
+        self.assertEqual(t.wait_time, 24 * 60 * 60)
+
+    async def test_busy_loop(self):
+        clock = VirtualClock(datetime(2000, 1, 1))
+        scheduler = AsyncScheduler(clock=clock)
+        t = scheduler.each.minute.run(func)
+        stop = False
+
+        async def spin():
+            while not stop:
+                await asyncio.sleep(0)
+
+        spinning = asyncio.create_task(spin())
+        scheduler.start_concurrently()
+        # a coroutine which never stops yielding doesn't block the clock
+        await asyncio.wait_for(clock.advance(timedelta(hours=1)), 10)
+        stop = True
+        await spinning
+        scheduler.stop()
+        self.assertEqual(t.previous_runs, 60)
+
+    async def test_arguments(self):
+        clock = VirtualClock(datetime(2000, 1, 1))
+        with self.assertRaises(ValueError):
+            await clock.advance(-1)
+        with self.assertRaises(ValueError):
+            await clock.advance_to(datetime(1999, 12, 31))
+        with self.assertRaises(ValueError):
+            VirtualClock(settle_steps=0)
+        with self.assertRaises(TypeError):
+            VirtualClock(settle_steps=1.5)
+        self.assertEqual(clock.now(), datetime(2000, 1, 1))
+
+
+class TestCalculator(unittest.TestCase):
+    def create_tasks(self, scheduler: AsyncScheduler):
+        for _ in range(200):
+            h, m, s = random.randrange(24), random.randrange(60), random.randrange(60)
+            interval = random.randint(2, 5)
+            scheduler.each.second.run(func)
+            scheduler.each.minute.at(s).run(func)
+            scheduler.every(interval).minutes.at(s).run(func)
+            scheduler.each.hour.at(m, s).run(func)
+            scheduler.every(interval).hours.at(m, s).run(func)
+            scheduler.each.day.at(h, m, s).run(func)
+            scheduler.every(interval).days.at(h, m).run(func)
+            scheduler.each.saturday.at(h, m, s).run(func)
+            scheduler.each.sunday.run(func)
+            scheduler.each.month(random.randint(1, 31)).at(h, m, s).run(func)
+            scheduler.each.february(29).at(h).run(func)
+            scheduler.each.december(random.randint(1, 31)).at(h, m).run(func)
+
+    def test_identical_to_scalar(self):
+        scheduler = AsyncScheduler()
+        self.create_tasks(scheduler)
+        scheduled_tasks = scheduler.tasks
+        for _ in range(50):
+            now = datetime(2020, 1, 1) + timedelta(
+                seconds=random.uniform(0, 5 * 365 * 24 * 60 * 60)
+            )
+            if random.random() < 0.3:
+                now = now.replace(microsecond=0)
+            expected = [t._calculate_next_run(now) for t in scheduled_tasks]
+            self.assertEqual(calculator.next_runs(scheduled_tasks, now), expected)
+
+    def test_resolved_on_start(self):
+        clock = VirtualClock(datetime(2023, 1, 1))
+        scheduler = AsyncScheduler(clock=clock)
+        t = scheduler.each.day.at(12).run(func)
+        self.assertIs(t._next_run, tasks.PENDING)
+
+        async def main():
+            scheduler.start_concurrently()
+            await asyncio.sleep(0)
+            self.assertEqual(t._next_run, datetime(2023, 1, 1, 12))
+            scheduler.stop()
+
+        asyncio.run(main())
+
+
 class TestOnetime(unittest.TestCase):
     def test_after(self):
         scheduler = AsyncScheduler()
@@ -227,5 +435,1419 @@ class TestScheduler(unittest.TestCase):
         scheduler.start()
 
 
+class TestMainLoop(unittest.IsolatedAsyncioTestCase):
+    async def test_stop_wakes_main_loop(self):
+        scheduler = AsyncScheduler()
+        scheduler.each.second.run(func)
+        scheduler.start_concurrently()
+        await asyncio.sleep(0)
+        self.assertFalse(scheduler._main_task.done())
+
+        scheduler.stop()
+        await asyncio.wait_for(scheduler._main_task, 0.1)
+
+    def test_start_returns_when_done(self):
+        scheduler = AsyncScheduler()
+        scheduler.after(seconds=1).run(func)
+        start = time.perf_counter()
+        scheduler.start()
+        self.assertLess(time.perf_counter() - start, 1.2)
+        self.assertFalse(scheduler.is_running)
+
+
+class TestDispatcher(unittest.IsolatedAsyncioTestCase):
+    async def test_dispatcher(self):
+        scheduler = AsyncScheduler(use_dispatcher=True)
+        results = []
+
+        @scheduler.callback()
+        async def callback(task: ScheduledTask):
+            results.append(task.last_run.result)
+            if task.previous_runs == 2:
+                task.cancel()
+
+        scheduler.each.second.run(coro, 1)
+        scheduler.after(seconds=1).run(func, 2)
+        scheduler.start_concurrently()
+        await asyncio.sleep(0)
+        self.assertEqual(len(scheduler._dispatcher), 2)
+
+        while len(scheduler.tasks) > 0:
+            await asyncio.sleep(0.1)
+        scheduler.stop()
+        self.assertEqual(sorted(results), [0.5, 1, 1])
+
+    async def test_idle_tasks_have_no_asyncio_task(self):
+        scheduler = AsyncScheduler(use_dispatcher=True)
+        for _ in range(1000):
+            scheduler.every(60).minutes.run(func)
+        scheduler.start_concurrently()
+        await asyncio.sleep(0.1)
+
+        self.assertEqual(len(scheduler._dispatcher), 1000)
+        self.assertTrue(all(t._task is None for t in scheduler.tasks))
+        self.assertLess(len(asyncio.all_tasks()), 10)
+
+        for t in scheduler.tasks[:600]:
+            t.cancel()
+        self.assertEqual(len(scheduler._dispatcher), 400)
+        scheduler.stop()
+
+
+class TestExecutor(unittest.IsolatedAsyncioTestCase):
+    async def test_thread(self):
+        scheduler = AsyncScheduler(executor="thread", max_workers=2)
+        ticks = []
+
+        async def tick():
+            ticks.append(1)
+
+        t = scheduler.after(seconds=1).run(blocking, 0.5)
+        scheduler.at(datetime.now() + timedelta(seconds=1.2)).run(tick)
+        scheduler.start_concurrently()
+        await asyncio.sleep(1.3)
+
+        # the tick was not blocked by the running job
+        self.assertEqual(len(ticks), 1)
+        self.assertIsNone(t.last_run)
+        while len(scheduler.tasks) > 0:
+            await asyncio.sleep(0.1)
+        scheduler.stop()
+
+        self.assertTrue(t.last_run.succeed)
+        self.assertEqual(t.last_run.result, 0.5)
+        self.assertGreaterEqual(t.last_run.duration, 0.5)
+        self.assertLess(t.last_run.duration, 0.6)
+
+    async def test_per_task(self):
+        scheduler = AsyncScheduler()
+        pool = ThreadPoolExecutor(1)
+        t1 = scheduler.after(seconds=1).run(func, 0, executor=pool)
+        t2 = scheduler.after(seconds=1).run(func, 4, executor="process")
+        scheduler.start_concurrently()
+        while len(scheduler.tasks) > 0:
+            await asyncio.sleep(0.1)
+        scheduler.stop()
+        pool.shutdown()
+
+        self.assertFalse(t1.last_run.succeed)
+        self.assertIsInstance(t1.last_run.result, ZeroDivisionError)
+        self.assertTrue(t2.last_run.succeed)
+        self.assertEqual(t2.last_run.result, 0.25)
+
+    def test_validation(self):
+        with self.assertRaises(ValueError):
+            AsyncScheduler(executor="fiber")
+        with self.assertRaises(TypeError):
+            AsyncScheduler().each.second.run(func, executor=1)
+
+
+class TestCancel(unittest.IsolatedAsyncioTestCase):
+    async def test_cancel_tasks(self):
+        for use_dispatcher in (False, True):
+            scheduler = AsyncScheduler(use_dispatcher=use_dispatcher)
+            for i in range(5000):
+                scheduler.every(60).minutes.run(coro).add_tags(f"tenant-{i % 2}")
+            scheduler.start_concurrently()
+            await asyncio.sleep(0)
+
+            cancelled = await scheduler.cancel_tasks("tenant-0")
+            self.assertEqual(len(cancelled), 2500)
+            self.assertEqual(len(scheduler.tasks), 2500)
+            self.assertEqual(scheduler.get_tasks("tenant-0"), [])
+            self.assertEqual(cancelled[0].tags, ["tenant-0"])
+
+            cancelled = await scheduler.cancel_all()
+            self.assertEqual(len(cancelled), 2500)
+            self.assertEqual(len(scheduler.tasks), 0)
+            self.assertEqual(scheduler.get_tasks("tenant-1"), [])
+            running = [
+                t
+                for t in asyncio.all_tasks()
+                if t.get_coro().__qualname__.startswith("ScheduledTask.")
+            ]
+            self.assertEqual(running, [])
+            scheduler.stop()
+
+    async def test_stop(self):
+        scheduler = AsyncScheduler()
+        for _ in range(10):
+            scheduler.each.second.run(coro)
+        scheduler.start_concurrently()
+        await asyncio.sleep(0)
+        scheduler.stop()
+        self.assertEqual(len(scheduler.tasks), 0)
+
+
+class TestBatch(unittest.IsolatedAsyncioTestCase):
+    async def test_batch(self):
+        for use_dispatcher in (False, True):
+            clock = VirtualClock(datetime(2023, 1, 1))
+            scheduler = AsyncScheduler(use_dispatcher=use_dispatcher, clock=clock)
+            scheduler.start_concurrently()
+            await asyncio.sleep(0)
+
+            with scheduler.batch():
+                for i in range(1000):
+                    scheduler.each.day.at(6).run(func, i).add_tags(f"tenant-{i % 2}")
+                self.assertEqual(scheduler.tasks, [])
+            self.assertEqual(len(scheduler.tasks), 1000)
+            self.assertEqual(
+                [t.args[0] for t in scheduler.get_tasks("tenant-1")], list(range(1, 1000, 2))
+            )
+            self.assertEqual(
+                {t.next_run for t in scheduler.tasks}, {datetime(2023, 1, 1, 6)}
+            )
+
+            await clock.advance(timedelta(hours=6))
+            self.assertTrue(all(t.previous_runs == 1 for t in scheduler.tasks))
+            scheduler.stop()
+
+    async def test_batch_exception(self):
+        scheduler = AsyncScheduler()
+        with self.assertRaises(ValueError):
+            with scheduler.batch():
+                scheduler.each.day.run(func)
+                raise ValueError
+        self.assertEqual(scheduler.tasks, [])
+
+    async def test_add_many(self):
+        scheduler = AsyncScheduler()
+        hourly = scheduler.each.hour.at(30)
+        created = scheduler.add_many(
+            [
+                (hourly, func),
+                (hourly, func, (1,)),
+                (scheduler.each.monday, func, (2,), {"x": 3}),
+            ]
+        )
+        self.assertEqual(scheduler.tasks, created)
+        self.assertEqual(created[1].args, (1,))
+        self.assertEqual(created[2].kwargs, {"x": 3})
+        # builders can be reused since the times are immutable
+        self.assertEqual(created[0].at_time, (30, 0))
+        self.assertEqual(created[1].at_time, (30, 0))
+
+        with self.assertRaises(TypeError):
+            scheduler.add_many([(func,)])
+        with self.assertRaises(TypeError):
+            scheduler.add_many([(func, func)])
+        self.assertEqual(len(scheduler.tasks), 3)
+
+
+class TestConcurrency(unittest.IsolatedAsyncioTestCase):
+    async def test_max_instances(self):
+        scheduler = AsyncScheduler()
+        running = []
+
+        async def slow():
+            running.append(t.running)
+            await asyncio.sleep(1.5)
+
+        t = scheduler.each.second.run(slow, max_instances=2)
+        scheduler.start_concurrently()
+        await asyncio.sleep(3.2)
+        await scheduler.cancel_all()
+        scheduler.stop()
+
+        # started at 1s, 2s and 3s. the third one started after the first finished
+        self.assertEqual(running, [1, 2, 2])
+        self.assertEqual(t.running, 0)
+
+    async def test_coalesce(self):
+        scheduler = AsyncScheduler()
+
+        @scheduler.callback()
+        def callback(task: ScheduledTask):
+            if task.previous_runs == 2:
+                task.cancel()
+
+        t = scheduler.each.second.run(asyncio.sleep, 2.2, coalesce=True)
+        scheduler.start_concurrently()
+        while len(scheduler.tasks) > 0:
+            await asyncio.sleep(0.1)
+        scheduler.stop()
+
+        # the runs due at 2s and 3s were merged into one run starting at 3.2s
+        self.assertEqual(t.previous_runs, 2)
+        self.assertEqual(t.last_run.coalesced, 2)
+
+    async def test_missed_runs(self):
+        # due at 1s, 2s, ... 10s and running for 3.5s
+        cases = (
+            (1, {}, (2, 6)),
+            # 3s, 4s, 7s and 8s were due while two runs were running
+            (2, {}, (4, 4)),
+            # the worker is busy at 10s as well
+            (1, {"workers": 1}, (2, 7)),
+        )
+        for max_instances, kwargs, expected in cases:
+            clock = VirtualClock(datetime(2023, 1, 1))
+            scheduler = AsyncScheduler(clock=clock, **kwargs)
+            t = scheduler.each.second.run(clock.sleep, 3.5, max_instances=max_instances)
+            scheduler.start_concurrently()
+            await clock.advance(10)
+            scheduler.stop()
+            # the runs due while `max_instances` runs were running are counted
+            self.assertEqual((t.previous_runs, t.missed_runs), expected, kwargs)
+
+    async def test_max_concurrency(self):
+        scheduler = AsyncScheduler(max_concurrency=1)
+        t1 = scheduler.after(seconds=1).run(asyncio.sleep, 0.3)
+        t2 = scheduler.after(seconds=1).run(asyncio.sleep, 0.3)
+        scheduler.start_concurrently()
+        while len(scheduler.tasks) > 0:
+            await asyncio.sleep(0.1)
+        scheduler.stop()
+
+        queued = sorted([t1.last_run.queued, t2.last_run.queued])
+        self.assertLess(queued[0], 0.05)
+        self.assertGreater(queued[1], 0.25)
+        self.assertLess(t1.last_run.duration, 0.35)
+        self.assertLess(t2.last_run.duration, 0.35)
+
+
+class TestJobStore(unittest.IsolatedAsyncioTestCase):
+    async def test_sqlite(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "jobs.sqlite")
+            clock = VirtualClock(datetime(2023, 1, 1))
+            scheduler = AsyncScheduler(clock=clock, store=SQLiteJobStore(path))
+            daily = scheduler.each.day.at(6).run(func, 2).add_tags("daily")
+            once = scheduler.at(datetime(2023, 1, 3)).run(func, x=4)
+            interval = scheduler.every(10).minutes.run(coro, timeout=30)
+            scheduler.start_concurrently()
+            await clock.advance(timedelta(days=1, hours=1))
+            # crash: only the flushed changes survive
+            scheduler.store.flush()
+            scheduler.store.close()
+
+            clock = VirtualClock(datetime(2023, 1, 2, 2))
+            scheduler = AsyncScheduler(clock=clock, store=SQLiteJobStore(path))
+            restored = {t.id: t for t in scheduler.load_tasks()}
+            self.assertEqual(restored.keys(), {daily.id, once.id, interval.id})
+            self.assertEqual(scheduler.load_tasks(), [])
+
+            t = restored[daily.id]
+            self.assertEqual(t.tags, ["daily"])
+            self.assertEqual(t.args, (2,))
+            self.assertEqual(t.previous_runs, 1)
+            self.assertEqual(t.last_run.result, 0.5)
+            self.assertEqual(t.next_run, datetime(2023, 1, 2, 6))
+            self.assertEqual(restored[once.id].kwargs, {"x": 4})
+            self.assertEqual(restored[once.id].next_run, datetime(2023, 1, 3))
+            self.assertEqual(restored[interval.id].previous_runs, 150)
+            self.assertEqual(restored[interval.id].timeout, 30)
+
+            scheduler.start_concurrently()
+            await clock.advance(timedelta(days=1))
+            self.assertEqual(t.previous_runs, 2)
+            self.assertEqual(restored[once.id].previous_runs, 1)
+            t.cancel()
+            scheduler.stop()
+            scheduler.store.close()
+
+            scheduler = AsyncScheduler(store=SQLiteJobStore(path))
+            self.assertEqual([t.id for t in scheduler.load_tasks()], [interval.id])
+            scheduler.store.close()
+
+    async def test_without_store(self):
+        scheduler = AsyncScheduler()
+        self.assertIsNone(scheduler.store)
+        t = scheduler.each.second.run(func)
+        scheduler.start_concurrently()
+        await asyncio.sleep(0)
+        scheduler.stop()
+        # stopping cancels all tasks like before there were stores
+        self.assertEqual(scheduler.tasks, [])
+        self.assertIsNone(t.next_run)
+        self.assertEqual(scheduler.load_tasks(), [])
+
+    async def test_background_flush(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "jobs.sqlite")
+            store = SQLiteJobStore(path, flush_interval=0.01)
+            scheduler = AsyncScheduler(store=store)
+            scheduler.start_concurrently()
+            scheduler.each.day.run(func)
+            await asyncio.sleep(0.2)
+            with sqlite3.connect(path) as connection:
+                count = connection.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+            self.assertEqual(count, 1)
+            scheduler.stop()
+            store.close()
+
+    def test_not_storable(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = SQLiteJobStore(os.path.join(directory, "jobs.sqlite"))
+            scheduler = AsyncScheduler(store=store)
+            with self.assertRaises(ValueError):
+                scheduler.each.second.run(lambda: None)
+            with self.assertRaises(ValueError):
+                scheduler.each.second.run(func, lambda: None)
+            with self.assertRaises(ValueError):
+                with scheduler.batch():
+                    scheduler.each.second.run(func)
+                    scheduler.each.second.run(lambda: None)
+            self.assertEqual(scheduler.tasks, [])
+            store.close()
+
+    async def test_memory(self):
+        scheduler = AsyncScheduler(store=MemoryJobStore())
+        t = scheduler.each.second.run(func).add_tags("A")
+        scheduler.start_concurrently()
+        await asyncio.sleep(0)
+        scheduler.stop()
+        self.assertEqual(scheduler.tasks, [])
+
+        scheduler.start_concurrently()
+        await asyncio.sleep(0)
+        self.assertEqual([r.id for r in scheduler.get_tasks("A")], [t.id])
+        await scheduler.cancel_all()
+        scheduler.stop()
+
+        scheduler.start_concurrently()
+        await asyncio.sleep(0)
+        self.assertEqual(scheduler.tasks, [])
+        scheduler.stop()
+
+
+class TestMisfire(unittest.IsolatedAsyncioTestCase):
+    async def restart(self, **kwargs) -> ScheduledTask:
+        """runs an hourly task at 01:00 and 02:00 and restarts the scheduler at 10:30"""
+        store = MemoryJobStore()
+        clock = VirtualClock(datetime(2023, 1, 1))
+        scheduler = AsyncScheduler(clock=clock, store=store)
+        scheduler.each.hour.run(func, **kwargs)
+        scheduler.start_concurrently()
+        await clock.advance(timedelta(hours=2, minutes=30))
+        scheduler.stop()
+
+        clock = VirtualClock(datetime(2023, 1, 1, 10, 30))
+        scheduler = AsyncScheduler(clock=clock, store=store)
+        scheduler.start_concurrently()
+        await clock.advance(1)
+        (task,) = scheduler.tasks
+        self.assertEqual(task.next_run, datetime(2023, 1, 1, 11))
+        scheduler.stop()
+        return task
+
+    async def test_policies(self):
+        # the runs from 03:00 to 10:00 are overdue
+        task = await self.restart()
+        self.assertEqual((task.previous_runs, task.missed_runs), (3, 7))
+        task = await self.restart(misfire_grace_time=60, misfire_policy="skip")
+        self.assertEqual((task.previous_runs, task.missed_runs), (2, 8))
+        task = await self.restart(misfire_grace_time=60, misfire_policy="run_once")
+        self.assertEqual((task.previous_runs, task.missed_runs), (3, 7))
+        task = await self.restart(misfire_grace_time=60, misfire_policy="run_all")
+        self.assertEqual((task.previous_runs, task.missed_runs), (10, 0))
+        task = await self.restart(misfire_grace_time=60, coalesce=True)
+        self.assertEqual((task.previous_runs, task.missed_runs), (3, 0))
+        self.assertEqual(task.last_run.coalesced, 7)
+
+    async def test_interval(self):
+        store = MemoryJobStore()
+        clock = VirtualClock(datetime(2023, 1, 1))
+        scheduler = AsyncScheduler(clock=clock, store=store)
+        scheduler.every(10).minutes.run(func, misfire_grace_time=1, misfire_policy="skip")
+        scheduler.start_concurrently()
+        await clock.advance(timedelta(minutes=15))
+        scheduler.stop()
+
+        clock = VirtualClock(datetime(2023, 1, 1, 1, 5))
+        scheduler = AsyncScheduler(clock=clock, store=store)
+        scheduler.start_concurrently()
+        await clock.advance(1)
+        (task,) = scheduler.tasks
+        # the runs from 00:20 to 01:00 were skipped
+        self.assertEqual((task.previous_runs, task.missed_runs), (1, 5))
+        await clock.advance(timedelta(minutes=5))
+        self.assertEqual(task.previous_runs, 2)
+        scheduler.stop()
+
+    async def test_one_time(self):
+        store = MemoryJobStore()
+        clock = VirtualClock(datetime(2023, 1, 1))
+        scheduler = AsyncScheduler(clock=clock, store=store)
+        scheduler.at(datetime(2023, 1, 1, 1)).run(
+            func, misfire_grace_time=60, misfire_policy="skip"
+        )
+        scheduler.start_concurrently()
+        scheduler.stop()
+
+        clock = VirtualClock(datetime(2023, 1, 1, 2))
+        scheduler = AsyncScheduler(clock=clock, store=store)
+        (task,) = scheduler.load_tasks()
+        scheduler.start_concurrently()
+        await clock.advance(1)
+        self.assertEqual(scheduler.tasks, [])
+        self.assertEqual((task.previous_runs, task.missed_runs), (0, 1))
+        scheduler.stop()
+
+    def test_validation(self):
+        scheduler = AsyncScheduler()
+        with self.assertRaises(ValueError):
+            scheduler.each.second.run(func, misfire_policy="run_twice")
+        with self.assertRaises(ValueError):
+            scheduler.each.second.run(func, misfire_grace_time=-1)
+        with self.assertRaises(TypeError):
+            scheduler.each.second.run(func, misfire_grace_time="1")
+
+
+class TestJitter(unittest.IsolatedAsyncioTestCase):
+    async def test_spread(self):
+        store = MemoryJobStore()
+        clock = VirtualClock(datetime(2023, 1, 1))
+        scheduler = AsyncScheduler(clock=clock, store=store)
+        runs = {}
+
+        def job(i):
+            runs.setdefault(i, []).append(clock.now())
+
+        for i in range(100):
+            scheduler.each.hour.at(spread=3599).run(job, i)
+        scheduler.start_concurrently()
+        await clock.advance(timedelta(hours=3))
+        scheduler.stop()
+
+        # each task runs at the same offset in each hour
+        for first, second in runs.values():
+            self.assertEqual(second - first, timedelta(hours=1))
+            self.assertLess(first, datetime(2023, 1, 1, 2))
+        self.assertGreater(len({r[0] for r in runs.values()}), 90)
+
+        # the offsets are derived from the task id and restored
+        scheduler.start_concurrently()
+        await clock.advance(timedelta(hours=1))
+        for first, second, third in runs.values():
+            self.assertEqual(third - second, timedelta(hours=1))
+        scheduler.stop()
+
+    async def test_jitter(self):
+        clock = VirtualClock(datetime(2023, 1, 1))
+        scheduler = AsyncScheduler(clock=clock)
+        runs = []
+        scheduler.each.minute.at(jitter=10).run(lambda: runs.append(clock.now()))
+        scheduler.start_concurrently()
+        await clock.advance(timedelta(minutes=100, seconds=10))
+        scheduler.stop()
+
+        self.assertEqual(len(runs), 100)
+        self.assertTrue(all(run.second < 10 for run in runs))
+        self.assertGreater(len({run.second for run in runs}), 5)
+
+    def test_validation(self):
+        scheduler = AsyncScheduler()
+        with self.assertRaises(ValueError):
+            scheduler.each.minute.at(jitter=61)
+        with self.assertRaises(ValueError):
+            scheduler.each.day.at(spread=-1)
+        with self.assertRaises(TypeError):
+            scheduler.each.hour.at(spread="1")
+        with self.assertRaises(ValueError):
+            scheduler.each.minute.at(jitter=30, spread=30)
+        scheduler.every(2).days.at(spread=2 * 24 * 60 * 60 - 1)
+
+    async def test_offset_longer_than_gap(self):
+        clock = VirtualClock(datetime(2023, 1, 1))
+        scheduler = AsyncScheduler(clock=clock)
+
+        async def job():
+            await clock.sleep(2)
+
+        t = scheduler.each.minute.at(0, spread=59).run(job)
+        # finishes after the un-delayed time of the next run
+        t._spread_offset = t._offset = 58.5
+        scheduler.start_concurrently()
+        await clock.advance(timedelta(minutes=10, seconds=5))
+        scheduler.stop()
+        # at 00:01:58.5, 00:02:58.5, ... 00:09:58.5
+        self.assertEqual(t.previous_runs, 9)
+        self.assertEqual(t.missed_runs, 0)
+
+
+class TestFunctionStr(unittest.TestCase):
+    def test_lazy(self):
+        scheduler = AsyncScheduler()
+        payload = {i: "x" * 100 for i in range(10_000)}
+        t = scheduler.each.second.run(func, payload, x=list(range(1000)))
+        self.assertIsNone(t._funcstr_cache)
+
+        self.assertIn("func({", repr(t))
+        self.assertLessEqual(len(t._funcstr), utils.FUNCTION_STR_LENGTH)
+        self.assertIs(t.cancel()._funcstr, t._funcstr)
+
+    def test_short(self):
+        self.assertEqual(utils.function_str(func, 1, "a", x=None), "func(1, 'a', x=None)")
+
+
+class TestSlots(unittest.TestCase):
+    def test_slots(self):
+        scheduler = AsyncScheduler()
+        t = scheduler.each.day.at(6).run(func)
+        for obj in (t, t.cancel(), tasks.TaskResult(True, None, datetime.now(), 0)):
+            self.assertFalse(hasattr(obj, "__dict__"))
+        self.assertIsInstance(t.at_time, tuple)
+
+
+class TestRetention(unittest.IsolatedAsyncioTestCase):
+    async def test_history(self):
+        clock = VirtualClock(datetime(2023, 1, 1))
+        scheduler = AsyncScheduler(clock=clock)
+        results = iter(range(10))
+        t1 = scheduler.each.second.run(lambda: next(results), history=3)
+        t2 = scheduler.each.second.run(func, 0, keep_result=False)
+        scheduler.start_concurrently()
+        await clock.advance(5)
+        scheduler.stop()
+
+        self.assertEqual([r.result for r in t1.history], [2, 3, 4])
+        self.assertIs(t1.history[-1], t1.last_run)
+        self.assertEqual(t2.history, [])
+        self.assertFalse(t2.last_run.succeed)
+        self.assertIsNone(t2.last_run.result)
+        self.assertIn("ZeroDivisionError", t2.last_run.traceback)
+
+    async def test_traceback(self):
+        clock = VirtualClock(datetime(2023, 1, 1))
+        scheduler = AsyncScheduler(clock=clock)
+        t = scheduler.each.second.run(func, 0)
+        scheduler.start_concurrently()
+        await clock.advance(1)
+        scheduler.stop()
+
+        self.assertIsInstance(t.last_run.result, ZeroDivisionError)
+        self.assertIsNone(t.last_run.result.__traceback__)
+        self.assertIn("return 1 / x", t.last_run.traceback)
+
+    def test_validation(self):
+        scheduler = AsyncScheduler()
+        with self.assertRaises(ValueError):
+            scheduler.each.second.run(func, history=-1)
+
+
+class TestMetrics(unittest.IsolatedAsyncioTestCase):
+    async def test_snapshot(self):
+        clock = VirtualClock(datetime(2023, 1, 1))
+        scheduler = AsyncScheduler(clock=clock, metrics=metrics.Metrics(per_task=True))
+        t1 = scheduler.each.second.run(func).add_tags("A")
+        t2 = scheduler.each.second.run(func, 0).add_tags("A", "B")
+        scheduler.start_concurrently()
+        await clock.advance(3)
+
+        snapshot = scheduler.metrics.snapshot()
+        self.assertEqual(snapshot["total"]["runs"], 6)
+        self.assertEqual(snapshot["total"]["failed"], 3)
+        self.assertEqual(snapshot["tags"]["A"]["runs"], 6)
+        self.assertEqual(snapshot["tags"]["B"]["failed"], 3)
+        self.assertEqual(snapshot["tasks"][t1.id]["succeeded"], 3)
+        self.assertEqual(snapshot["total"]["lateness"]["buckets"][0.001], 6)
+        self.assertEqual(snapshot["running"], 0)
+
+        t2.cancel()
+        snapshot = scheduler.metrics.snapshot()
+        self.assertNotIn(t2.id, snapshot["tasks"])
+        # no task carries "B" any more
+        self.assertNotIn("B", snapshot["tags"])
+        self.assertIn("A", snapshot["tags"])
+        t1.remove_tags("A")
+        self.assertNotIn("A", scheduler.metrics.snapshot()["tags"])
+        scheduler.stop()
+
+    async def test_per_task_disabled(self):
+        clock = VirtualClock(datetime(2023, 1, 1))
+        scheduler = AsyncScheduler(clock=clock, metrics=True)
+        scheduler.each.second.run(func)
+        scheduler.start_concurrently()
+        await clock.advance(2)
+        snapshot = scheduler.metrics.snapshot()
+        self.assertEqual(snapshot["total"]["runs"], 2)
+        self.assertEqual(snapshot["tasks"], {})
+        scheduler.stop()
+
+    def test_histogram(self):
+        histogram = metrics.Histogram((1, 2, 4))
+        for value in (0.5, 1.5, 1.5, 3, 10):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [1, 2, 1, 1])
+        self.assertEqual(histogram.quantile(0.5), 1.75)
+        self.assertEqual(histogram.quantile(1), 4)
+        self.assertIsNone(metrics.Histogram().quantile(0.5))
+
+    async def test_prometheus(self):
+        clock = VirtualClock(datetime(2023, 1, 1))
+        scheduler = AsyncScheduler(clock=clock, metrics=metrics.Metrics(per_task=True))
+        t = scheduler.each.second.run(func).add_tags('a "tag"')
+        scheduler.start_concurrently()
+        await clock.advance(2)
+
+        server = await scheduler.serve_metrics(port=0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        response = (await reader.read()).decode()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        scheduler.stop()
+
+        self.assertTrue(response.startswith("HTTP/1.1 200 OK"))
+        self.assertIn("swisscore_scheduler_tasks 1\n", response)
+        self.assertIn('swisscore_scheduler_runs_total{status="succeeded"} 2\n', response)
+        self.assertIn('swisscore_scheduler_tag_runs_total{tag="a \\"tag\\"",', response)
+        self.assertIn(
+            f'swisscore_scheduler_task_duration_seconds_bucket{{task="{t.id}",'
+            'func="func",le="+Inf"} 2\n',
+            response,
+        )
+
+    async def test_disabled(self):
+        self.assertIsNone(AsyncScheduler(metrics=False).metrics)
+        scheduler = AsyncScheduler()
+        self.assertIsNone(scheduler.metrics)
+        with self.assertRaises(RuntimeError):
+            await scheduler.serve_metrics()
+
+
+class TestTimeout(unittest.IsolatedAsyncioTestCase):
+    async def test_coroutine(self):
+        clock = VirtualClock(datetime(2023, 1, 1))
+        scheduler = AsyncScheduler(clock=clock, metrics=True)
+        cleaned_up = []
+        failed = []
+
+        async def hang():
+            try:
+                await asyncio.sleep(10)
+            finally:
+                cleaned_up.append(1)
+
+        @scheduler.exception_handler
+        def handler(task):
+            failed.append(task)
+
+        t = scheduler.each.second.run(hang, timeout=0.05)
+        scheduler.start_concurrently()
+        await clock.advance(1)
+        await asyncio.sleep(0.1)
+
+        self.assertFalse(t.last_run.succeed)
+        self.assertTrue(t.last_run.timed_out)
+        self.assertIsInstance(t.last_run.result, asyncio.TimeoutError)
+        # the frames of the timed out run are not kept alive
+        self.assertIsNone(t.last_run.result.__traceback__)
+        self.assertIn("TimeoutError", t.last_run.traceback)
+        self.assertEqual(cleaned_up, [1])
+        self.assertEqual(failed, [t])
+        self.assertEqual(scheduler.metrics.total.failed, 1)
+
+        # the task keeps running
+        await clock.advance(1)
+        await asyncio.sleep(0.1)
+        scheduler.stop()
+        self.assertEqual(t.previous_runs, 2)
+
+    async def test_executor(self):
+        clock = VirtualClock(datetime(2023, 1, 1))
+        scheduler = AsyncScheduler(clock=clock, executor="thread", timeout=0.05)
+        t1 = scheduler.each.second.run(blocking, 0.2)
+        t2 = scheduler.each.second.run(blocking, 0.01)
+        t3 = scheduler.each.second.run(blocking, 0.2, timeout=1)
+        scheduler.start_concurrently()
+        await clock.advance(1)
+        await asyncio.sleep(0.3)
+        scheduler.stop()
+
+        self.assertTrue(t1.last_run.timed_out)
+        self.assertLess(t1.last_run.duration, 0.2)
+        self.assertTrue(t2.last_run.succeed)
+        self.assertFalse(t2.last_run.timed_out)
+        self.assertTrue(t3.last_run.succeed)
+
+    async def test_own_timeout_error(self):
+        async def raises():
+            raise asyncio.TimeoutError()
+
+        scheduler = AsyncScheduler(timeout=10)
+        t = scheduler.each.second.run(raises)
+        await t._call()
+        self.assertFalse(t.last_run.succeed)
+        self.assertFalse(t.last_run.timed_out)
+        self.assertIsNotNone(t.last_run.traceback)
+
+    def test_validation(self):
+        scheduler = AsyncScheduler()
+        with self.assertRaises(ValueError):
+            scheduler.each.second.run(func, timeout=0)
+        with self.assertRaises(TypeError):
+            AsyncScheduler(timeout="1")
+
+
+class TestSharding(unittest.IsolatedAsyncioTestCase):
+    async def test_shards(self):
+        scheduler = ShardedScheduler(2)
+        with scheduler.batch():
+            for i in range(20):
+                scheduler.each.second.run(func).add_tags("A" if i % 2 else "B")
+        failing = scheduler.each.second.run(func, 0).add_tags("A")
+        self.assertEqual(len(await scheduler.get_tasks("A")), 11)
+
+        scheduler.start()
+        try:
+            await asyncio.sleep(2.5)
+            found = await scheduler.get_tasks()
+            self.assertEqual(len(found), 21)
+            self.assertEqual({t.shard for t in found}, {0, 1})
+            self.assertTrue(all(t.previous_runs >= 1 for t in found))
+            snapshot = next(t for t in found if t.id == failing.id)
+            self.assertFalse(snapshot.last_run.succeed)
+            self.assertIsInstance(snapshot.last_run.result, ZeroDivisionError)
+
+            self.assertEqual(failing.cancel().id, failing.id)
+            self.assertIsNone(failing.cancel())
+            self.assertEqual(len(await scheduler.cancel_tasks("A")), 10)
+            self.assertEqual(len(await scheduler.get_tasks()), 10)
+        finally:
+            await scheduler.stop()
+
+        # the tasks are kept and sent again on the next start
+        self.assertEqual(len(await scheduler.get_tasks("B")), 10)
+        self.assertEqual(len(await scheduler.cancel_all()), 10)
+
+    async def test_partition_by_tag(self):
+        scheduler = ShardedScheduler(3, partition="tag")
+        scheduler.start()
+        try:
+            for i in range(30):
+                scheduler.each.minute.run(func).add_tags(f"customer-{i % 5}", "report")
+            by_customer = {}
+            for t in await scheduler.get_tasks("report"):
+                by_customer.setdefault(t.tags[0], set()).add(t.shard)
+            self.assertEqual(len(by_customer), 5)
+            self.assertTrue(all(len(shards) == 1 for shards in by_customer.values()))
+        finally:
+            await scheduler.stop()
+
+    async def test_move_keeps_state(self):
+        scheduler = ShardedScheduler(2, partition="tag")
+        task = scheduler.each.second.run(func).add_tags("a")
+        tags = [f"tag-{i}" for i in range(10)]
+        other = next(
+            tag for tag in tags if scheduler._route("", [tag]) != scheduler._route("", ["a"])
+        )
+        scheduler.start()
+        try:
+            # starting the shards may take a while
+            for _ in range(100):
+                [before] = await scheduler.get_tasks()
+                if before.previous_runs:
+                    break
+                await asyncio.sleep(0.1)
+            self.assertGreaterEqual(before.previous_runs, 1)
+
+            task.remove_tags("a").add_tags(other)
+            await asyncio.gather(*scheduler._moves)
+            [moved] = await scheduler.get_tasks()
+            self.assertEqual(moved.tags, [other])
+            self.assertNotEqual(moved.shard, before.shard)
+            # the runs counted by the old shard are kept
+            self.assertGreaterEqual(moved.previous_runs, before.previous_runs)
+        finally:
+            await scheduler.stop()
+
+    async def test_restart_dead_shard(self):
+        scheduler = ShardedScheduler(2)
+        with scheduler.batch():
+            for _ in range(10):
+                scheduler.each.minute.run(func)
+        scheduler.start()
+        try:
+            dead = scheduler._processes[0]
+            dead.kill()
+            await asyncio.get_running_loop().run_in_executor(None, dead.join)
+            self.assertEqual(len(await scheduler.get_tasks()), 10)
+            self.assertIsNot(scheduler._processes[0], dead)
+            self.assertTrue(scheduler._processes[0].is_alive())
+            # a dead shard is also restarted if a task is sent to it
+            scheduler._processes[1].kill()
+            await asyncio.get_running_loop().run_in_executor(None, scheduler._processes[1].join)
+            with scheduler.batch():
+                for _ in range(10):
+                    scheduler.each.minute.run(func)
+            self.assertEqual(len(await scheduler.get_tasks()), 20)
+        finally:
+            await scheduler.stop()
+
+    async def test_validation(self):
+        scheduler = ShardedScheduler(2)
+        with self.assertRaises(ValueError):
+            scheduler.each.second.run(lambda: None)
+        with self.assertRaises(ValueError):
+            ShardedScheduler(0)
+        with self.assertRaises(ValueError):
+            ShardedScheduler(2, partition="func")
+        with self.assertRaises(ValueError):
+            ShardedScheduler(2, executor="fork")
+        self.assertEqual(await scheduler.get_tasks(), [])
+
+
+class TestWorkQueue(unittest.IsolatedAsyncioTestCase):
+    async def simulate(self, use_dispatcher: bool):
+        clock = VirtualClock(datetime(2023, 1, 1))
+        scheduler = AsyncScheduler(
+            clock=clock,
+            use_dispatcher=use_dispatcher,
+            workers=2,
+            queue_size=3,
+            metrics=True,
+        )
+        running = []
+        concurrency = []
+
+        async def job():
+            running.append(1)
+            concurrency.append(len(running))
+            await asyncio.sleep(0.05)
+            running.pop()
+
+        jobs = [scheduler.each.second.run(job) for _ in range(6)]
+        once = scheduler.after(seconds=1).run(job)
+        scheduler.start_concurrently()
+        await clock.advance(1)
+
+        # the tasks keep firing while the workers are busy
+        self.assertLessEqual(scheduler._queue.qsize(), 3)
+        await clock.advance(0.5)
+        for _ in range(20):
+            if sum(t.previous_runs for t in (*jobs, once)) == 7 and not running:
+                break
+            await asyncio.sleep(0.05)
+        self.assertEqual(max(concurrency), 2)
+        self.assertEqual([t.previous_runs for t in jobs], [1] * 6)
+        self.assertEqual(once.previous_runs, 1)
+        self.assertNotIn(once, scheduler.tasks)
+        self.assertTrue(all(t.next_run == datetime(2023, 1, 1, 0, 0, 2) for t in jobs))
+        # the later runs waited for the workers
+        self.assertGreater(scheduler.metrics.total.lateness.quantile(1), 0)
+        scheduler.stop()
+
+    async def test_queue(self):
+        await self.simulate(False)
+
+    async def test_queue_dispatcher(self):
+        await self.simulate(True)
+
+    async def test_max_instances(self):
+        clock = VirtualClock(datetime(2023, 1, 1))
+        scheduler = AsyncScheduler(clock=clock, workers=4)
+        release = asyncio.Event()
+
+        async def job():
+            await release.wait()
+
+        skipped = scheduler.each.second.run(job)
+        coalesced = scheduler.each.second.run(job, coalesce=True)
+        scheduler.start_concurrently()
+        await clock.advance(3)
+        await asyncio.sleep(0.01)
+        self.assertEqual((skipped.running, coalesced.running), (1, 1))
+        self.assertEqual(coalesced._missed, 2)
+
+        release.set()
+        await asyncio.sleep(0.05)
+        self.assertEqual(skipped.previous_runs, 1)
+        self.assertEqual(coalesced.previous_runs, 2)
+        self.assertEqual(coalesced.last_run.coalesced, 2)
+
+        scheduler.stop()
+
+    async def test_cancel_queued(self):
+        clock = VirtualClock(datetime(2023, 1, 1))
+        scheduler = AsyncScheduler(clock=clock, workers=1)
+        release = asyncio.Event()
+
+        async def job():
+            await release.wait()
+
+        blocker = scheduler.each.second.run(job)
+        queued = scheduler.each.second.run(job)
+        scheduler.start_concurrently()
+        await clock.advance(1)
+        self.assertEqual((blocker.running, queued._queued), (1, 1))
+
+        # the queued run of a cancelled task is skipped
+        queued.cancel()
+        release.set()
+        await asyncio.sleep(0.01)
+        self.assertEqual((blocker.previous_runs, queued.previous_runs), (1, 0))
+        self.assertEqual(queued._queued, 0)
+
+        release.clear()
+        await clock.advance(2)
+        self.assertEqual((blocker.running, blocker._queued), (1, 0))
+        scheduler.stop()
+        self.assertEqual(scheduler._queue.qsize(), 0)
+
+    def test_validation(self):
+        with self.assertRaises(ValueError):
+            AsyncScheduler(workers=0)
+        with self.assertRaises(TypeError):
+            AsyncScheduler(workers=2, queue_size=None)
+
+
+class TestPriority(unittest.IsolatedAsyncioTestCase):
+    async def simulate(self, **options):
+        clock = VirtualClock(datetime(2023, 1, 1))
+        scheduler = AsyncScheduler(clock=clock, **options)
+        order = []
+        for priority in (0, 5, -1, 10, 5, 0):
+            scheduler.each.hour.run(order.append, priority, priority=priority)
+        scheduler.start_concurrently()
+        await clock.advance(timedelta(hours=2))
+        await asyncio.sleep(0.05)
+        scheduler.stop()
+        return order
+
+    async def test_simultaneous(self):
+        expected = [10, 5, 5, 0, 0, -1] * 2
+        self.assertEqual(await self.simulate(), expected)
+        self.assertEqual(await self.simulate(use_dispatcher=True), expected)
+        self.assertEqual(await self.simulate(workers=1), expected)
+
+    async def test_concurrency_limit(self):
+        clock = VirtualClock(datetime(2023, 1, 1))
+        scheduler = AsyncScheduler(clock=clock, max_concurrency=1, metrics=True)
+        order = []
+
+        async def job(priority):
+            order.append(priority)
+            await asyncio.sleep(0.01)
+
+        for priority in (0, 1, 2):
+            scheduler.each.second.run(job, priority, priority=priority)
+        # waits for the concurrency limit with the lowest priority
+        blocker = scheduler.each.second.run(job, -1, priority=-1)
+        scheduler.start_concurrently()
+        await clock.advance(1)
+        self.assertEqual(order, [2])
+        self.assertEqual(scheduler.metrics.waiting, 3)
+        await asyncio.sleep(0.1)
+        scheduler.stop()
+        self.assertEqual(order, [2, 1, 0, -1])
+        self.assertEqual(blocker.previous_runs, 1)
+
+    async def test_semaphore(self):
+        semaphore = scheduler_module.PrioritySemaphore(1)
+        order = []
+
+        async def acquire(priority):
+            await semaphore.acquire(priority)
+            order.append(priority)
+
+        await semaphore.acquire()
+        waiters = [asyncio.create_task(acquire(p)) for p in (1, 3, 2)]
+        await asyncio.sleep(0)
+        waiters[1].cancel()
+        await asyncio.sleep(0)
+        for _ in range(2):
+            semaphore.release()
+            await asyncio.sleep(0)
+        self.assertEqual(order, [2, 1])
+        self.assertTrue(semaphore.locked())
+
+    def test_validation(self):
+        with self.assertRaises(TypeError):
+            AsyncScheduler().each.second.run(func, priority=1.5)
+
+
+class TestCron(unittest.IsolatedAsyncioTestCase):
+    def test_next_run(self):
+        expression = crontab.parse("*/15 8-18 * * 1-5")
+        # 2023-01-06 is a friday
+        self.assertEqual(
+            expression.next_run(datetime(2023, 1, 6, 18, 30)), datetime(2023, 1, 6, 18, 45)
+        )
+        self.assertEqual(
+            expression.next_run(datetime(2023, 1, 6, 18, 45)), datetime(2023, 1, 9, 8)
+        )
+        self.assertEqual(
+            expression.next_run(datetime(2023, 1, 9, 7, 59, 59)), datetime(2023, 1, 9, 8)
+        )
+        # the day of month or the day of week
+        expression = crontab.parse("0 0 13 * fri")
+        self.assertEqual(expression.next_run(datetime(2023, 1, 1)), datetime(2023, 1, 6))
+        self.assertEqual(expression.next_run(datetime(2023, 1, 12)), datetime(2023, 1, 13))
+        self.assertEqual(expression.next_run(datetime(2023, 1, 13)), datetime(2023, 1, 20))
+        self.assertEqual(
+            crontab.parse("0 12 29 feb *").next_run(datetime(2023, 1, 1)),
+            datetime(2024, 2, 29, 12),
+        )
+        self.assertEqual(
+            crontab.parse("@yearly").next_run(datetime(2023, 12, 31, 23, 59)),
+            datetime(2024, 1, 1),
+        )
+
+    def test_brute_force(self):
+        def random_field(lowest, highest):
+            """a random field and the values it matches"""
+            a, b = sorted(random.sample(range(lowest, highest + 1), 2))
+            step = random.randint(2, 7)
+            return random.choice(
+                [
+                    ("*", range(lowest, highest + 1)),
+                    (f"*/{step}", range(lowest, highest + 1, step)),
+                    (f"{a}", [a]),
+                    (f"{a}-{b}", range(a, b + 1)),
+                    (f"{a}-{b}/{step}", range(a, b + 1, step)),
+                    (f"{a},{b}", [a, b]),
+                ]
+            )
+
+        def brute_force(fields, now):
+            """the next match, scanning minute by minute"""
+            minutes, hours, days, months, weekdays = (set(v) for _, v in fields)
+            weekdays = {weekday % 7 for weekday in weekdays}
+            either = not (fields[2][0].startswith("*") or fields[4][0].startswith("*"))
+            then = now.replace(second=0, microsecond=0)
+            while 1:
+                then += timedelta(minutes=1)
+                day = then.day in days
+                weekday = (then.weekday() + 1) % 7 in weekdays
+                if (
+                    then.month in months
+                    and ((day or weekday) if either else (day and weekday))
+                    and then.hour in hours
+                    and then.minute in minutes
+                ):
+                    return then
+                if then.month not in months or not (
+                    (day or weekday) if either else (day and weekday)
+                ):
+                    # skip the rest of the day
+                    then = then.replace(hour=23, minute=59)
+
+        random.seed(0)
+        limits = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+        tested = 0
+        while tested < 200:
+            fields = [random_field(*limit) for limit in limits]
+            text = " ".join(field for field, _ in fields)
+            try:
+                expression = crontab.parse(text)
+            except ValueError:
+                # never matches
+                continue
+            now = datetime(2023, 1, 1) + timedelta(seconds=random.randrange(10**8))
+            self.assertEqual(expression.next_run(now), brute_force(fields, now), text)
+            tested += 1
+
+        self.assertEqual(
+            crontab.parse("0 12 * * */2").next_run(datetime(2025, 3, 28, 6, 28, 44)),
+            datetime(2025, 3, 29, 12),
+        )
+        self.assertEqual(
+            crontab.parse("0 0 */5 * 1-5").next_run(datetime(2024, 8, 6)),
+            datetime(2024, 8, 16),
+        )
+
+    def test_validation(self):
+        self.assertIs(crontab.parse("@daily"), crontab.parse("@daily"))
+        self.assertEqual(crontab.parse("@daily").period, 24 * 60 * 60)
+        self.assertEqual(crontab.parse("*/15 8-18 * * *").period, 15 * 60)
+        for text in ("* * * *", "60 * * * *", "*/0 * * * *", "5-1 * * * *", "0 0 30 feb *"):
+            with self.assertRaises(ValueError):
+                AsyncScheduler().cron(text)
+        with self.assertRaises(ValueError):
+            AsyncScheduler().cron("@hourly", spread=3601)
+
+    async def test_runs(self):
+        for use_dispatcher in (False, True):
+            clock = VirtualClock(datetime(2023, 1, 1))
+            scheduler = AsyncScheduler(clock=clock, use_dispatcher=use_dispatcher)
+            task = scheduler.cron("*/15 8-18 * * 1-5").run(func)
+            same = scheduler.cron("*/15 8-18 * * 1-5").run(coro)
+            self.assertEqual(task.type, TaskType.cron)
+            scheduler.start_concurrently()
+            self.assertEqual(task.next_run, datetime(2023, 1, 2, 8))
+            await clock.advance(timedelta(days=7))
+            self.assertEqual(task.previous_runs, 5 * 11 * 4)
+            self.assertEqual(same.previous_runs, 5 * 11 * 4)
+            self.assertEqual(task.next_run, datetime(2023, 1, 9, 8))
+
+            restored = jobstore.restore(scheduler, jobstore.dump(task))
+            self.assertEqual(restored.cron, "*/15 8-18 * * 1-5")
+            self.assertEqual(restored.next_run, datetime(2023, 1, 9, 8))
+            scheduler.stop()
+
+
+class TestLeaderElection(unittest.IsolatedAsyncioTestCase):
+    def test_lease_store(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = SQLiteLeaseStore(os.path.join(directory, "leases.sqlite"))
+            other = SQLiteLeaseStore(os.path.join(directory, "leases.sqlite"))
+            self.assertTrue(store.acquire("lease", "a", 0.1))
+            self.assertTrue(store.acquire("lease", "a", 0.1))
+            self.assertFalse(other.acquire("lease", "b", 0.1))
+            self.assertTrue(other.acquire("other lease", "b", 0.1))
+            time.sleep(0.15)
+            self.assertTrue(other.acquire("lease", "b", 10))
+            # only the owner can release a lease
+            store.release("lease", "a")
+            self.assertFalse(store.acquire("lease", "a", 10))
+            other.release("lease", "b")
+            self.assertTrue(store.acquire("lease", "a", 10))
+            store.close()
+            other.close()
+            with self.assertRaises(ValueError):
+                SQLiteLeaseStore(os.path.join(directory, "leases.sqlite"), table="a; b")
+
+    async def test_replicas(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "leases.sqlite")
+            replicas = []
+            for _ in range(2):
+                clock = VirtualClock(datetime(2023, 1, 1))
+                leader = LeaderElection(SQLiteLeaseStore(path), ttl=0.3)
+                scheduler = AsyncScheduler(clock=clock, leader=leader, store=MemoryJobStore())
+                t = scheduler.each.second.run(func)
+                once = scheduler.after(seconds=2).run(func)
+                scheduler.start_concurrently()
+                await asyncio.sleep(0.05)
+                replicas.append((scheduler, clock, t, once))
+
+            (first, first_clock, t1, once1), (second, second_clock, t2, once2) = replicas
+            self.assertTrue(first.leader.is_leader)
+            self.assertFalse(second.leader.is_leader)
+            second.store.flush()
+            for clock in (first_clock, second_clock):
+                await clock.advance(3)
+            self.assertEqual((t1.previous_runs, t2.previous_runs), (3, 0))
+            self.assertEqual((once1.previous_runs, once2.previous_runs), (1, 0))
+            # the skipped runs are not missed
+            self.assertEqual(t2.missed_runs, 0)
+            self.assertNotIn(once1, first.tasks)
+            # the skipped one time task is done, only the leader changes the store
+            self.assertNotIn(once2, second.tasks)
+            self.assertEqual(second.store._pending, {})
+
+            # the second replica takes over after the first one was stopped
+            release = first.leader.store.release
+            threads = []
+
+            def record_release(name, owner):
+                threads.append(threading.current_thread())
+                release(name, owner)
+
+            first.leader.store.release = record_release
+            first.stop()
+            self.assertFalse(first.leader.is_leader)
+            for _ in range(20):
+                if second.leader.is_leader:
+                    break
+                await asyncio.sleep(0.05)
+            self.assertTrue(second.leader.is_leader)
+            # the lease was released off the event loop
+            self.assertEqual(len(threads), 1)
+            self.assertIsNot(threads[0], threading.current_thread())
+            await second_clock.advance(2)
+            self.assertEqual(t2.previous_runs, 2)
+            second.stop()
+
+    def test_one_time_on_follower(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "leases.sqlite")
+            other = SQLiteLeaseStore(path)
+            self.assertTrue(other.acquire("swisscore_scheduler", "other", 60))
+            store = MemoryJobStore()
+            scheduler = AsyncScheduler(
+                leader=LeaderElection(SQLiteLeaseStore(path)), store=store
+            )
+            once = scheduler.after(seconds=0.1).run(func)
+            # returns as there are no pending tasks left
+            thread = threading.Thread(target=scheduler.start, daemon=True)
+            thread.start()
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+
+            self.assertEqual(once.previous_runs, 0)
+            self.assertEqual(scheduler.tasks, [])
+            # the record is kept for the leader
+            self.assertEqual([record["id"] for record in store.load()], [once.id])
+            scheduler.leader.store.close()
+            other.close()
+
+    async def test_lost_lease(self):
+        class BrokenStore(SQLiteLeaseStore):
+            def acquire(self, name, owner, ttl):
+                if self.broken:
+                    raise sqlite3.OperationalError("database is locked")
+                return super().acquire(name, owner, ttl)
+
+        with tempfile.TemporaryDirectory() as directory:
+            store = BrokenStore(os.path.join(directory, "leases.sqlite"))
+            store.broken = False
+            leader = LeaderElection(store, ttl=0.3)
+            await leader.start()
+            self.assertTrue(leader.is_leader)
+            store.broken = True
+            await asyncio.sleep(0.15)
+            # keeps the leadership until the lease expires
+            self.assertTrue(leader.is_leader)
+            await asyncio.sleep(0.2)
+            self.assertFalse(leader.is_leader)
+            leader.stop()
+            store.close()
+
+
+class TestWatchdog(unittest.IsolatedAsyncioTestCase):
+    async def test_stall(self):
+        clock = VirtualClock(datetime(2023, 1, 1))
+        reports = []
+        watchdog = Watchdog(0.1, interval=0.02, callback=reports.append)
+        scheduler = AsyncScheduler(clock=clock, watchdog=watchdog, metrics=True)
+        t = scheduler.each.second.run(blocking, 0.3)
+        scheduler.start_concurrently()
+        await asyncio.sleep(0.1)
+        self.assertEqual(reports, [])
+
+        await clock.advance(1)
+        await asyncio.sleep(0.1)
+        scheduler.stop()
+        self.assertFalse(watchdog.is_running)
+
+        self.assertEqual(len(reports), 1)
+        stall = reports[0]
+        self.assertIsInstance(stall, Stall)
+        self.assertIs(stall.task, t)
+        self.assertGreaterEqual(stall.duration, 0.2)
+        self.assertGreaterEqual(watchdog.max_lag, 0.2)
+        self.assertEqual(stall.stack[-1][2], "blocking")
+        self.assertIn("blocking", str(stall))
+        self.assertEqual(scheduler.metrics.loop_lag.counts[-1], 0)
+        self.assertGreater(scheduler.metrics.loop_lag.count, 1)
+
+    async def test_idle_sampler(self):
+        class CountingEvent(threading.Event):
+            waits = 0
+
+            def wait(self, timeout=None):
+                CountingEvent.waits += 1
+                return super().wait(timeout)
+
+        watchdog = Watchdog(0.1, interval=0.02, sample_interval=0.001)
+        watchdog._stopped = CountingEvent()
+        scheduler = AsyncScheduler(watchdog=watchdog)
+        scheduler.each.second.run(func)
+        scheduler.start_concurrently()
+        await asyncio.sleep(0.5)
+        scheduler.stop()
+        # the sampler sleeps while the loop is responsive instead of waking every 1ms
+        self.assertLess(CountingEvent.waits, 50)
+        self.assertEqual(watchdog.stalls, 0)
+
+    async def test_slow_run(self):
+        clock = VirtualClock(datetime(2023, 1, 1))
+        reports = []
+
+        async def callback(report):
+            reports.append(report)
+
+        watchdog = Watchdog(slow_run=0.05, callback=callback)
+        scheduler = AsyncScheduler(clock=clock, watchdog=watchdog)
+        slow = scheduler.each.second.run(asyncio.sleep, 0.1)
+        scheduler.each.second.run(func)
+        scheduler.start_concurrently()
+        await clock.advance(1)
+        await asyncio.sleep(0.2)
+        scheduler.stop()
+
+        self.assertEqual(len(reports), 1)
+        self.assertIsInstance(reports[0], SlowRun)
+        self.assertIs(reports[0].task, slow)
+        # awaiting does not block the loop
+        self.assertEqual(watchdog.stalls, 0)
+        # sampled after `slow_run` seconds
+        self.assertEqual(reports[0].stack[-1][2], "sleep")
+        self.assertIn("Most sampled stack", str(reports[0]))
+
+    async def test_slow_run_samples(self):
+        clock = VirtualClock(datetime(2023, 1, 1))
+        reports = {}
+        watchdog = Watchdog(
+            slow_run=0.05, callback=lambda report: reports.setdefault(report.task, report)
+        )
+        scheduler = AsyncScheduler(clock=clock, watchdog=watchdog)
+
+        async def nested():
+            await asyncio.sleep(0.15)
+
+        timed = scheduler.each.second.run(nested, timeout=1)
+        threaded = scheduler.each.second.run(blocking, 0.15, executor="thread")
+        scheduler.start_concurrently()
+        await clock.advance(1)
+        await asyncio.sleep(0.3)
+        scheduler.stop()
+
+        # the coroutine awaited by `wait_for`
+        names = [name for _, _, name in reports[timed].stack]
+        self.assertEqual(names[-2:], ["nested", "sleep"])
+        # the function in the executor thread
+        self.assertEqual(reports[threaded].stack[-1][2], "blocking")
+        self.assertGreater(sum(reports[threaded].samples.values()), 1)
+
+    def test_validation(self):
+        with self.assertRaises(ValueError):
+            Watchdog(0)
+        with self.assertRaises(TypeError):
+            Watchdog(slow_run="1")
+        self.assertIsNone(AsyncScheduler().watchdog)
+        self.assertIsInstance(AsyncScheduler(watchdog=True).watchdog, Watchdog)
+
+
+class TestSoak(unittest.TestCase):
+    """
+    runs a periodic task many times with a fake clock where every run is due immediately.
+    set `SOAK_ITERATIONS` to run a longer soak (e.g. several millions).
+    """
+
+    iterations = int(os.environ.get("SOAK_ITERATIONS", 100_000))
+
+    def test_periodic_run_is_flat(self):
+        # not using `IsolatedAsyncioTestCase` since its debug mode slows down the loop
+        asyncio.run(self._periodic_run_is_flat())
+
+    async def _periodic_run_is_flat(self):
+        scheduler = AsyncScheduler()
+        depths = set()
+        memory = []
+
+        def job():
+            depth = 0
+            frame = sys._getframe()
+            while frame is not None:
+                depth += 1
+                frame = frame.f_back
+            depths.add(depth)
+
+        @scheduler.callback()
+        def callback(task: ScheduledTask):
+            if task.previous_runs in (1_000, self.iterations):
+                memory.append(sys.getallocatedblocks())
+            if task.previous_runs == self.iterations:
+                task.cancel()
+
+        with mock.patch.object(ScheduledTask, "wait_time", property(lambda self: 0)):
+            t = scheduler.each.second.run(job)
+            scheduler.start_concurrently()
+            while len(scheduler.tasks) > 0:
+                await asyncio.sleep(0.1)
+        scheduler.stop()
+
+        self.assertEqual(t.previous_runs, self.iterations)
+        self.assertEqual(len(depths), 1)
+        self.assertLess(memory[1] - memory[0], 1_000)
+
+
 if __name__ == "__main__":
     unittest.main()